@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import json
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "vitaa_app.middleware.QueryAccountingMiddleware",
+    "vitaa_app.middleware.SamplingProfilerMiddleware",
+    "vitaa_app.middleware.MemoryAccountingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -75,13 +80,52 @@ WSGI_APPLICATION = 'core.wsgi.application'
 
 # Database
 
+# WAL lets readers proceed while a writer (importer, admin) holds its
+# transaction; IMMEDIATE avoids lock-upgrade deadlocks between writers.
+_SQLITE_READ_PRAGMAS = (
+    "PRAGMA cache_size=-20000;"      # ~20 MB page cache per connection
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA mmap_size=134217728;"
+)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                "PRAGMA journal_mode=WAL;"
+                "PRAGMA synchronous=NORMAL;"
+                "PRAGMA busy_timeout=5000;"
+                + _SQLITE_READ_PRAGMAS
+            ),
+        },
+    },
+    # Read-only copy of default's catalog tables that serves catalog reads
+    # (see vitaa_app.db_routers); refreshed in the background shortly after
+    # committed catalog writes and by `manage.py refresh_catalog_replica`.
+    'catalog': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR / 'db_catalog.sqlite3'}?mode=ro",
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': "PRAGMA query_only=1;" + _SQLITE_READ_PRAGMAS,
+        },
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['vitaa_app.db_routers.CatalogReplicaRouter']
+CATALOG_REPLICA_ENABLED = True
+# In server processes, catalog writes within this many seconds share one
+# background replica refresh (the replica lags default by about this much).
+# Management commands refresh as soon as their writes commit.
+CATALOG_REPLICA_REFRESH_DELAY_S = 1.0
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -127,4 +171,119 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
-]
\ No newline at end of file
+]
+
+# Request coalescing (vitaa_app.single_flight): identical concurrent
+# planner/target requests share one computation.
+SINGLE_FLIGHT_ENABLED = True
+# Seconds a duplicate request waits for the in-flight one; a number or
+# a per-group dict, e.g. {"plan": 15, "targets": 2}.
+SINGLE_FLIGHT_WAIT_S = {"plan": 15.0, "targets": 2.0}
+
+# Seconds a worker trusts its cached catalog version (vitaa_app.catalog)
+# before re-reading it; bounds how stale ETags and catalog caches can be.
+CATALOG_VERSION_TTL_S = 2.0
+
+# Upstream n8n health-analysis webhook (vitaa_app.health_analysis). Point it
+# at `manage.py n8n_stub` for load tests.
+N8N_WEBHOOK_URL = os.environ.get(
+    "N8N_WEBHOOK_URL", "https://n8n.tm06.me/webhook/health_analysis_openai"
+)
+N8N_TIMEOUT_S = float(os.environ.get("N8N_TIMEOUT_S", "10"))
+
+# Circuit breaker / bulkhead around the n8n call (vitaa_app.resilience).
+N8N_BREAKER_FAILURE_THRESHOLD = 5    # consecutive timeouts/5xx before opening
+N8N_BREAKER_RESET_S = 30.0           # open time before a half-open probe
+N8N_BREAKER_HALF_OPEN_PROBES = 1
+N8N_MAX_CONCURRENCY = 8              # in-flight n8n calls per worker process
+N8N_BULKHEAD_WAIT_S = 0.5            # wait for a free slot before shedding
+N8N_FALLBACK_MODE = "503"            # "503" (with Retry-After) or "local"
+
+# Async health-analysis jobs (vitaa_app.jobs): ?mode=async on the webhook view.
+N8N_JOB_WORKERS = 4             # background threads per worker process
+N8N_JOB_MIN_INTERVAL_S = 0.0    # min spacing between upstream calls per process
+N8N_JOB_TTL_S = 24 * 3600       # finished jobs are pruned after this
+N8N_JOB_STALE_S = 300           # jobs running (or queued) longer than this are reported lost
+N8N_JOB_EAGER = False           # run jobs inline (tests / debugging)
+
+# Micro-batching of health analyses (vitaa_app.batching): payloads arriving
+# within N8N_BATCH_WINDOW_MS of each other go out as one {"batch": [...]} call,
+# answered by {"results": [...]} in the same order. When the webhook rejects a
+# batch (400/404/405/413/415/422 or a mismatched reply) those payloads are sent
+# one by one and batching pauses for N8N_BATCH_RETRY_S.
+N8N_BATCH_ENABLED = os.environ.get("N8N_BATCH_ENABLED", "0") == "1"
+N8N_BATCH_URL = os.environ.get("N8N_BATCH_URL") or N8N_WEBHOOK_URL
+N8N_BATCH_WINDOW_MS = float(os.environ.get("N8N_BATCH_WINDOW_MS", "50"))
+N8N_BATCH_MAX_SIZE = 20         # a full batch goes out at once, before the window ends
+N8N_BATCH_TIMEOUT_S = 30.0      # one batch call, all payloads
+N8N_BATCH_RETRY_S = 300.0
+
+# Per-user dish history (vitaa_app.dish_history): dishes served within the
+# last one to two windows are skipped when a request carries a user_id.
+DISH_HISTORY_WINDOW_DAYS = 3
+
+# Warm catalog structures and planner code paths when a worker process gets
+# its first request, e.g. the readiness probe (vitaa_app.warmup);
+# /api/health/ready/ returns 503 until it finishes.
+VITAA_WARMUP_ENABLED = os.environ.get("VITAA_WARMUP", "0") == "1"
+
+# SQL queries per CSV row import_food_data may issue (bench_import and tests
+# fail above this).
+IMPORT_QUERY_BUDGET_PER_ROW = 16.0
+
+# Per-request query accounting (vitaa_app.middleware): statements slower than
+# this are logged with their view; QUERY_BUDGETS caps queries per URL name
+# when the catalog snapshot is loaded or patched in the request (exceeding it
+# is logged; vitaa_app.tests asserts it).
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+QUERY_BUDGETS = {
+    "nutrition_targets": 0,
+    "meal_plan": 5,
+    "health_plan_meal": 10,
+    "swap_dish": 5,
+    "n8n_health_analysis": 3,  # async mode stores the job
+    "n8n_health_analysis_job": 1,
+    "readiness": 0,
+    "memory_diagnostics": 0,
+    "dish_catalog": 5,
+    "dish_catalog_search": 5,
+}
+
+# Diagnostics: clients presenting this token may request per-request
+# profiles (X-Vitaa-Profile header). Empty disables token-triggered capture.
+DIAGNOSTICS_TOKEN = os.environ.get("VITAA_DIAGNOSTICS_TOKEN", "")
+# Fraction of all requests profiled without a header (0 = off).
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = 5
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", BASE_DIR / "profiles"))
+
+# Upper bound on planner search time per plan (ms); requests may ask for less
+# with "time_budget_ms". None = always search the full candidate grid.
+PLANNER_TIME_BUDGET_MS = float(os.environ["PLANNER_TIME_BUDGET_MS"]) if os.environ.get("PLANNER_TIME_BUDGET_MS") else None
+
+# Prepared (mains, sides) planner pools kept per worker, keyed by canonical
+# diet + catalog version (LRU; 0 disables).
+PLANNER_POOL_CACHE_SIZE = 64
+
+# A new catalog version patches the cached dish rows/frame from the change log
+# when at most this many dishes changed; larger changes reload everything.
+CATALOG_INCREMENTAL_MAX_CHANGES = 500
+
+# Memory accounting (vitaa_app.memory): requests carrying
+# X-Vitaa-Memory: <DIAGNOSTICS_TOKEN>, or this fraction of all requests, are
+# traced with tracemalloc (peak, retained bytes, top sites per planner stage).
+# tracemalloc runs only while a traced request does (traced requests are
+# serialized) and slows the whole worker meanwhile.
+MEMORY_SAMPLE_RATE = float(os.environ.get("MEMORY_SAMPLE_RATE", "0"))
+MEMORY_TRACE_FRAMES = 10
+MEMORY_TOP_SITES = 10
+MEMORY_RECENT_REQUESTS = 50  # traced requests kept for /api/diagnostics/memory/
+# Log the allocation sites that grew since the previous snapshot every this
+# many seconds (0 = off; otherwise tracemalloc stays on in every worker).
+MEMORY_SNAPSHOT_INTERVAL_S = float(os.environ.get("MEMORY_SNAPSHOT_INTERVAL_S", "0"))
+
+# Planner knob overrides by name (defaults at the top of
+# vitaa_app/meal_planner_service.py), e.g. PLANNER_KNOBS='{"RANDOM_TOPK": 3}'.
+# Changing classification knobs needs `manage.py refresh_dish_flags`;
+# `manage.py sweep_planner` compares settings on a fixed profile set.
+PLANNER_KNOBS = json.loads(os.environ.get("PLANNER_KNOBS") or "{}")
@@ -29,7 +29,20 @@ urlpatterns = [
 
     # Health Plan Meals API
     path("api/plan/health/", views.health_plan_meal, name="health_plan_meal"),
+    path("api/plan/swap/", views.swap_dish, name="swap_dish"),
 
     #n8n Health Analysis API
     path("api/webhooks/user-profile/", views.n8n_health_analysis_view, name="n8n_health_analysis"),
+    path("api/webhooks/user-profile/jobs/<uuid:job_id>/", views.n8n_health_analysis_job,
+         name="n8n_health_analysis_job"),
+
+    # Readiness probe
+    path("api/health/ready/", views.readiness, name="readiness"),
+
+    # Diagnostics (DIAGNOSTICS_TOKEN)
+    path("api/diagnostics/memory/", views.memory_diagnostics, name="memory_diagnostics"),
+
+    # Dish Catalog API
+    path("api/catalog/dishes/", views.dish_catalog, name="dish_catalog"),
+    path("api/catalog/dishes/search/", views.dish_catalog_search, name="dish_catalog_search"),
 ]
@@ -0,0 +1,17 @@
+# vitaa_app/aggregates.py
+from django.db.models import Aggregate, CharField, Value
+
+
+class GroupConcat(Aggregate):
+    """
+    Concatenate the non-null values of a column per group, e.g. all allergen
+    names of a dish in the same row as the dish. Order is unspecified.
+    """
+    function = "GROUP_CONCAT"
+    output_field = CharField()
+
+    def __init__(self, expression, separator=",", **extra):
+        super().__init__(expression, Value(separator), **extra)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function="STRING_AGG", **extra_context)
@@ -1,6 +1,56 @@
+import os
+
 from django.apps import AppConfig
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import request_started
+
+_started_pid = None
+
+
+def start_background_work(**kwargs):
+    """
+    Per-process background work, started by the first request a process
+    serves rather than at import: management commands (migrate, shell,
+    bulk_plans) never start it, and each preforked worker starts its own.
+    """
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    _started_pid = os.getpid()
+    from vitaa_app import memory, warmup
+
+    # Build catalog structures early (see /api/health/ready/).
+    if warmup.enabled():
+        warmup.start()
+
+    # Periodic tracemalloc diffs for leak hunting (MEMORY_SNAPSHOT_INTERVAL_S).
+    memory.start_periodic_diffs()
+
+
+def serving_requests() -> bool:
+    """Whether this process has started serving requests (a server worker, not a management command)."""
+    return _started_pid == os.getpid()
+
+
+def check_planner_knobs(app_configs=None, **kwargs):
+    """settings.PLANNER_KNOBS must name known knobs with the right types (checked at start, not per plan)."""
+    from django.conf import settings
+    from vitaa_app.meal_planner_service import validate_knobs
+
+    try:
+        validate_knobs(getattr(settings, "PLANNER_KNOBS", None) or {})
+    except ImproperlyConfigured as e:
+        return [checks.Error(str(e), id="vitaa_app.E001")]
+    return []
 
 
 class VitaaAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "vitaa_app"
+
+    def ready(self):
+        from vitaa_app import signals  # noqa: F401  (connects catalog change logging)
+
+        request_started.connect(start_background_work, dispatch_uid="vitaa_background_work")
+        checks.register(check_planner_knobs)
@@ -0,0 +1,76 @@
+# vitaa_app/batching.py
+import threading
+from typing import Any, Callable, List, Optional
+
+
+class _Batch:
+    __slots__ = ("items", "full", "done", "results", "error")
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results: Optional[List[Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+class MicroBatcher:
+    """
+    Groups concurrent calls into one upstream call. The first caller of a
+    batch (leader) waits up to `window_s` for others to join, and no longer
+    once `max_size` items are in, then calls send(items) once; every caller
+    gets the result at its own position. The others wait for that result
+    however long send() takes (it must bound itself, e.g. with an HTTP
+    timeout) rather than repeat the call on their own.
+
+    send() returns one result per item, or None when the upstream will not
+    take the batch: then each caller makes its own single(item) call. An
+    exception from send() is raised in every caller of the batch.
+    """
+
+    def __init__(self, send: Callable[[List[Any]], Optional[List[Any]]]):
+        self._send = send
+        self._lock = threading.Lock()
+        self._open: Optional[_Batch] = None
+
+    def submit(self, item: Any, single: Callable[[Any], Any], window_s: float, max_size: int):
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= max_size:
+                self._open = None  # later arrivals start the next batch
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(window_s)  # returns as soon as the batch fills
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            self._flush(batch)
+        else:
+            batch.done.wait()  # _flush always sets it
+
+        if batch.error is not None:
+            raise batch.error
+        if batch.results is None:
+            return single(item)
+        return batch.results[index]
+
+    def _flush(self, batch: _Batch):
+        try:
+            results = self._send(list(batch.items))
+            if results is not None and len(results) == len(batch.items):
+                batch.results = results
+        except BaseException as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    def pending(self) -> int:
+        """Items waiting in the open batch."""
+        with self._lock:
+            return len(self._open.items) if self._open is not None else 0
@@ -0,0 +1,435 @@
+# vitaa_app/catalog.py
+import json
+import operator
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Set
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from vitaa_app.dish_search import NAME_FIELDS, NamePrefixIndex
+from vitaa_app.ingredient_index import IngredientIndex
+from vitaa_app.macro_index import MACRO_COLUMNS, MacroKDTree
+from vitaa_app.aggregates import GroupConcat
+from vitaa_app.models import CatalogChange, Dish
+
+# How long a worker trusts its cached catalog version before re-reading it.
+DEFAULT_VERSION_TTL_S = 2.0
+
+
+# ---------- VERSION ----------
+_version_state = (None, 0.0)  # (version, monotonic expiry)
+
+
+def catalog_version() -> int:
+    """
+    Current catalog version (highest CatalogChange.version, 0 when empty).
+    Cached per process for CATALOG_VERSION_TTL_S so conditional GETs and
+    cache lookups do not hit the database on every request.
+    """
+    global _version_state
+    version, expires = _version_state
+    now = time.monotonic()
+    if version is not None and now < expires:
+        return version
+    version = CatalogChange.objects.aggregate(v=Max("version"))["v"] or 0
+    ttl = getattr(settings, "CATALOG_VERSION_TTL_S", DEFAULT_VERSION_TTL_S)
+    _version_state = (version, now + ttl)
+    return version
+
+
+def invalidate_version():
+    global _version_state
+    _version_state = (None, 0.0)
+
+
+# ---------- ROWS ----------
+DISH_FIELDS = (
+    "dish_id",
+    "dish_name",
+    "dish_ms_name",
+    "dish_vi_name",
+    "dish_zh_name",
+    "veg_class",
+    "ingredients",
+    "ingredients_list",
+    "calories_kcal",
+    "protein_g",
+    "fat_g",
+    "carbohydrate_g",
+    "image_url",
+)
+ALLERGEN_SEP = "|"
+
+
+def dish_values_with_allergens(*extra_fields):
+    """One query: every dish (DISH_FIELDS + extra_fields) with its allergen names aggregated by the database."""
+    return (Dish.objects
+            .annotate(allergen_names=GroupConcat("allergendish__allergen__allergen_name", separator=ALLERGEN_SEP))
+            .order_by("dish_id")
+            .values(*DISH_FIELDS, *extra_fields, "allergen_names"))
+
+
+def split_allergens(raw) -> List[str]:
+    if not isinstance(raw, str):  # NULL aggregate (no allergens), NaN once in pandas
+        return []
+    return [a.strip().lower() for a in raw.split(ALLERGEN_SEP) if a.strip()]
+
+
+def _dish_row(r) -> Dict:
+    """One dish_values_with_allergens() row in the catalog API shape."""
+    return {
+        "dish_id": r["dish_id"],
+        "dish_name": r["dish_name"],
+        "dish_ms_name": r["dish_ms_name"],
+        "dish_vi_name": r["dish_vi_name"],
+        "dish_zh_name": r["dish_zh_name"],
+        "veg_class": r["veg_class"],
+        "ingredients": r["ingredients_list"],
+        "allergens": sorted(split_allergens(r["allergen_names"])),
+        "calories_kcal": r["calories_kcal"],
+        "protein_g": float(r["protein_g"]),
+        "fat_g": float(r["fat_g"]),
+        "carbohydrate_g": float(r["carbohydrate_g"]),
+        "image_url": r["image_url"],
+    }
+
+
+def _load_dish_rows() -> List[Dict]:
+    """All dishes as plain dicts (the catalog API shape), ordered by dish_id."""
+    return [_dish_row(r) for r in dish_values_with_allergens()]
+
+
+def dish_rows(ids) -> List[Dict]:
+    """Current rows (catalog API shape) of these dishes, read from the database, ordered by dish_id."""
+    return [_dish_row(r) for r in dish_values_with_allergens().filter(dish_id__in=list(ids))]
+
+
+def _patch_dish_rows(old: List[Dict], touched, rows) -> List[Dict]:
+    """`old` with touched dishes replaced by their current rows (or dropped when deleted)."""
+    kept = [d for d in old if d["dish_id"] not in touched]
+    return sorted(kept + [_dish_row(r) for r in rows], key=lambda d: d["dish_id"])
+
+
+# ---------- SNAPSHOT ----------
+DEFAULT_INCREMENTAL_MAX_CHANGES = 500
+# Members a new snapshot can patch from an older one instead of reloading.
+PATCHABLE = ("dishes", "frame")
+# Derived members a new snapshot takes over from an older one when the
+# inputs they read (their fingerprint) did not change.
+REUSABLE = ("name_index", "ingredient_index", "macro_index")
+
+build_counts = {"full": 0, "incremental": 0, "reused": 0}
+_counts_lock = threading.Lock()
+
+
+def _count_build(kind: str):
+    with _counts_lock:
+        build_counts[kind] += 1
+
+
+def touched_since(since: int, version: int) -> Optional[Set[int]]:
+    """Ids of dishes changed after `since` up to `version`, or None when too many changed to patch."""
+    touched = set(CatalogChange.objects
+                  .filter(version__gt=since, version__lte=version)
+                  .values_list("dish_id", flat=True))
+    limit = getattr(settings, "CATALOG_INCREMENTAL_MAX_CHANGES", DEFAULT_INCREMENTAL_MAX_CHANGES)
+    return None if len(touched) > limit else touched
+
+
+def _name_fingerprint(dishes):
+    return [(d["dish_id"], *(d[f] for f in NAME_FIELDS)) for d in dishes]
+
+
+def _ingredient_fingerprint(dishes):
+    return [(d["dish_id"], tuple(d["ingredients"] or ())) for d in dishes]
+
+
+def _macro_fingerprint(df):
+    if df.empty:
+        return np.empty(0), np.empty((0, len(MACRO_COLUMNS)))
+    return df["dish_id"].to_numpy(), df[MACRO_COLUMNS].to_numpy(dtype=float)
+
+
+def _same_arrays(a, b) -> bool:
+    return all(np.array_equal(x, y) for x, y in zip(a, b))
+
+
+class CatalogSnapshot:
+    """
+    Everything derived from one catalog version. Members are built lazily on
+    first use, once, and are shared read-only by all requests in the worker.
+
+    Given the previous snapshot, the base members (dishes, frame) are patched
+    from the CatalogChange log: only dishes changed since that version are
+    re-read, new ones appended, deleted ones dropped. Large change sets
+    (over CATALOG_INCREMENTAL_MAX_CHANGES dishes) reload everything. The
+    REUSABLE indexes are taken over from the previous snapshot when the
+    fields they index are unchanged (a kcal edit keeps the name index), and
+    otherwise rebuild from the base members in memory.
+    """
+
+    def __init__(self, version: int, previous: Optional["CatalogSnapshot"] = None):
+        self.version = version
+        # Re-entrant: one member's builder may read another member.
+        self._lock = threading.RLock()
+        self._built: Dict[str, object] = {}
+        # name -> (version, value): base members to patch from, including
+        # ones the previous snapshot inherited but never consumed.
+        self._seeds: Dict[str, tuple] = {}
+        # name -> (fingerprint, value): REUSABLE members to take over, and the
+        # fingerprints of the ones built here.
+        self._reusable: Dict[str, tuple] = {}
+        self._fingerprints: Dict[str, object] = {}
+        if previous is not None and previous.version < version:
+            self._seeds.update(previous._seeds)
+            for name in PATCHABLE:
+                if name in previous._built:
+                    self._seeds[name] = (previous.version, previous._built[name])
+            self._reusable.update(previous._reusable)
+            for name in REUSABLE:
+                if name in previous._built:
+                    self._reusable[name] = (previous._fingerprints[name], previous._built[name])
+
+    def _get(self, name: str, build: Callable[[], object]):
+        try:
+            return self._built[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._built:
+                self._built[name] = build()
+            return self._built[name]
+
+    def _changes_since(self, since: int):
+        """(touched dish ids, their current rows) since `since`, or None when too many changed."""
+        def build():
+            touched = touched_since(since, self.version)
+            if touched is None:
+                return None
+            return touched, list(dish_values_with_allergens().filter(dish_id__in=touched)) if touched else []
+        return self._get(f"changes_since_{since}", build)
+
+    def _patched(self, name: str, load: Callable[[], object], patch: Callable[..., object]):
+        seed = self._seeds.pop(name, None)
+        changes = self._changes_since(seed[0]) if seed is not None else None
+        if changes is None:
+            _count_build("full")
+            return load()
+        _count_build("incremental")
+        return patch(seed[1], *changes)
+
+    def _reused(self, name: str, fingerprint: Callable[[], object], build: Callable[[], object],
+                same: Callable[[object, object], bool] = operator.eq):
+        def get():
+            fp = fingerprint()
+            old = self._reusable.pop(name, None)
+            self._fingerprints[name] = fp
+            if old is not None and same(old[0], fp):
+                _count_build("reused")
+                return old[1]
+            return build()
+        return self._get(name, get)
+
+    @property
+    def dishes(self) -> List[Dict]:
+        return self._get("dishes", lambda: self._patched("dishes", _load_dish_rows, _patch_dish_rows))
+
+    @property
+    def dishes_by_id(self) -> Dict[int, Dict]:
+        return self._get("dishes_by_id", lambda: {d["dish_id"]: d for d in self.dishes})
+
+    @property
+    def name_index(self) -> NamePrefixIndex:
+        return self._reused("name_index", lambda: _name_fingerprint(self.dishes),
+                            lambda: NamePrefixIndex(self.dishes))
+
+    @property
+    def ingredient_index(self) -> IngredientIndex:
+        """Ingredient word -> dish ids, for the planner's per-request exclusions and dislikes."""
+        return self._reused("ingredient_index", lambda: _ingredient_fingerprint(self.dishes),
+                            lambda: IngredientIndex((d["dish_id"], d["ingredients"]) for d in self.dishes))
+
+    @property
+    def frame(self):
+        """Planner DataFrame (see meal_planner_service._load_dishes_from_db). Treat as read-only."""
+        from vitaa_app.meal_planner_service import _load_dishes_from_db, _patch_frame
+        return self._get("frame", lambda: self._patched("frame", _load_dishes_from_db, _patch_frame))
+
+    @property
+    def macro_index(self) -> MacroKDTree:
+        """KD-tree over the frame's macro columns; query results are frame row positions."""
+        def build():
+            df = self.frame
+            if df.empty:
+                return MacroKDTree([])
+            return MacroKDTree(df[MACRO_COLUMNS].to_numpy(dtype=float))
+        return self._reused("macro_index", lambda: _macro_fingerprint(self.frame), build, _same_arrays)
+
+    @property
+    def body(self) -> bytes:
+        """Serialized full catalog, encoded once per version."""
+        return self._get("body", lambda: json.dumps(
+            {"version": self.version, "dishes": self.dishes}
+        ).encode("utf-8"))
+
+    def stats(self) -> Dict:
+        """Built members and the size of the big ones (deep pandas accounting: slow, diagnostics only)."""
+        built = dict(self._built)
+        out = {
+            "version": self.version,
+            "members": sorted(n for n in built if not n.startswith("changes_since_")),
+            "seeds": sorted({*self._seeds, *self._reusable}),  # older members still held for patching or reuse
+        }
+        if "dishes" in built:
+            out["dishes"] = len(built["dishes"])
+        if "frame" in built:
+            out["frame_rows"] = len(built["frame"])
+            out["frame_bytes"] = int(built["frame"].memory_usage(deep=True).sum())
+        if "body" in built:
+            out["body_bytes"] = len(built["body"])
+        return out
+
+
+_snapshot: Optional[CatalogSnapshot] = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot() -> CatalogSnapshot:
+    global _snapshot
+    version = catalog_version()
+    snap = _snapshot
+    if snap is not None and snap.version == version:
+        return snap
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = CatalogSnapshot(version, previous=_snapshot)
+        return _snapshot
+
+
+# ---------- DERIVED CACHES ----------
+class LRUCache:
+    """
+    Thread-safe LRU for values derived from the catalog (include the version
+    in the key, or store VersionedEntry values). Capacity comes from the
+    named setting on each insert; 0 disables caching. Concurrent misses on
+    one key may both build.
+    """
+
+    def __init__(self, size_setting: str, default_size: int):
+        self.size_setting = size_setting
+        self.default_size = default_size
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, object]" = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def maxsize(self) -> int:
+        return max(0, int(getattr(settings, self.size_setting, self.default_size)))
+
+    def get_or_build(self, key: Hashable, build: Callable[[], object]):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        value = build()
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize():
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        """Drop all entries and zero the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize(),
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def values(self) -> List[object]:
+        with self._lock:
+            return list(self._data.values())
+
+
+class VersionedEntry:
+    """
+    A cached value that follows the catalog: built once, then carried to
+    newer versions by patch(value, touched dish ids), which returns the value
+    itself when none of the touched dishes concern it. Large change sets
+    (see touched_since) rebuild. Concurrent callers wait for one build/patch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version: Optional[int] = None
+        self.value = None
+
+    def at(self, version: int, build: Callable[[], object], patch: Callable[[object, Set[int]], object]):
+        with self._lock:
+            if self.version is not None and self.version >= version:
+                return self.value
+            touched = touched_since(self.version, version) if self.version is not None else None
+            if touched is None:
+                value = build()
+            else:
+                value = patch(self.value, touched) if touched else self.value
+            self.version, self.value = version, value
+            return value
+
+
+# Planner (mains, sides) pools per canonical diet, as VersionedEntry values
+# patched across catalog versions (meal_planner_service).
+pools = LRUCache("PLANNER_POOL_CACHE_SIZE", 64)
+
+
+def cache_report() -> Dict:
+    """Per-worker cache sizes for the memory diagnostics endpoint."""
+    snap = _snapshot
+    return {
+        "catalog_snapshot": snap.stats() if snap is not None else None,
+        "planner_pools": {**pools.stats(),
+                          "bytes": sum(e.value.nbytes() for e in pools.values() if e.value is not None)},
+        "catalog_builds": dict(build_counts),
+    }
+
+
+def reset():
+    """Forget the cached version, snapshot and derived caches (tests, management commands)."""
+    global _snapshot
+    invalidate_version()
+    with _snapshot_lock:
+        _snapshot = None
+    pools.clear()
+    with _counts_lock:
+        build_counts.update(full=0, incremental=0, reused=0)
+
+
+# ---------- DELTA ----------
+def delta_since(snap: CatalogSnapshot, since: int) -> Dict:
+    """
+    Dishes changed between `since` and the snapshot version. The change log
+    only says which dishes were touched; their current state decides whether
+    they are reported as upserts or deletions.
+    """
+    touched = set(
+        CatalogChange.objects
+        .filter(version__gt=since, version__lte=snap.version)
+        .values_list("dish_id", flat=True)
+    )
+    by_id = snap.dishes_by_id
+    return {
+        "version": snap.version,
+        "since": since,
+        "upserts": [by_id[d] for d in sorted(touched) if d in by_id],
+        "deleted": sorted(d for d in touched if d not in by_id),
+    }
@@ -0,0 +1,148 @@
+# vitaa_app/combo_index.py
+import time
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+# Macro column order used throughout: kcal, protein, fat, carbs.
+DEFAULT_MAX_PAIR_SIDES = 400
+DEFAULT_KCAL_WINDOW = 60.0
+DEFAULT_SETS_PER_MAIN = 8
+MAIN_CHUNK = 128
+
+
+class ComboIndex:
+    """
+    Every side set a meal can add to a main (no side, one side, two sides),
+    sorted by total kcal with their macro sums. A meal for a kcal target
+    binary-searches, per main, the side sets whose kcal lands the meal within
+    a window of the target and scores only those (at most `per_main` on each
+    side of the exact fit, so dense catalogs stay cheap).
+
+    Side pairs are enumerated over at most `max_pair_sides` sides (spread
+    evenly over the kcal range) to bound memory at max_pair_sides^2 / 2 sets.
+    """
+
+    def __init__(self, main_ids, main_mac, side_ids, side_mac, max_pair_sides: int = DEFAULT_MAX_PAIR_SIDES):
+        self.main_ids = np.asarray(main_ids, dtype=np.int64)
+        self.main_mac = np.asarray(main_mac, dtype=float).reshape(-1, 4)
+        self.side_ids = np.asarray(side_ids, dtype=np.int64)
+        side_mac = np.asarray(side_mac, dtype=float).reshape(-1, 4)
+        n = len(self.side_ids)
+        none = n  # sentinel slot: "no side"
+
+        paired = np.arange(n)
+        if n > max_pair_sides:
+            by_kcal = np.argsort(side_mac[:, 0], kind="stable")
+            paired = by_kcal[np.linspace(0, n - 1, max_pair_sides).round().astype(int)]
+        pj, pk = np.triu_indices(len(paired), 1)
+
+        j = np.concatenate([[none], np.arange(n), paired[pj]])
+        k = np.concatenate([[none], np.full(n, none), paired[pk]])
+        ext_mac = np.vstack([side_mac, np.zeros((1, 4))])
+        mac = ext_mac[j] + ext_mac[k]
+        self.side_mac = ext_mac  # indexed by side slot, including the "no side" slot
+
+        order = np.argsort(mac[:, 0], kind="stable")
+        self.set_j = j[order].astype(np.int32)
+        self.set_k = k[order].astype(np.int32)
+        self.set_mac = mac[order]
+        self.set_kcal = np.ascontiguousarray(self.set_mac[:, 0])
+        self._side_ids_ext = np.append(self.side_ids, -1)
+        self._subsets = {}
+
+    def _sets(self, max_sides: int):
+        """(kcal, side_j, side_k, mac) of the side sets with at most `max_sides` sides, sorted by kcal."""
+        if max_sides >= 2:
+            return self.set_kcal, self.set_j, self.set_k, self.set_mac
+        max_sides = max(0, max_sides)
+        if max_sides not in self._subsets:  # a racing duplicate build is harmless
+            none = len(self.side_ids)
+            keep = self.set_k == none if max_sides == 1 else self.set_j == none
+            self._subsets[max_sides] = (np.ascontiguousarray(self.set_kcal[keep]), self.set_j[keep],
+                                        self.set_k[keep], self.set_mac[keep])
+        return self._subsets[max_sides]
+
+    def __len__(self):
+        return len(self.set_kcal)
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.main_ids, self.main_mac, self.side_ids, self.side_mac, self.set_j,
+                                      self.set_k, self.set_mac, self.set_kcal, self._side_ids_ext))
+
+    def query(self, kcal_target: float, score: Callable[[np.ndarray], np.ndarray],
+              main_ok: np.ndarray, side_ok: np.ndarray, want: int,
+              window: float = DEFAULT_KCAL_WINDOW, deadline: Optional[float] = None,
+              per_main: int = DEFAULT_SETS_PER_MAIN,
+              max_sides: int = 2) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, bool]:
+        """
+        Best `want` combos by `score` (lower is better) among mains where
+        main_ok and side sets whose sides are all side_ok and differ from the
+        main, with at most `max_sides` sides. The kcal window and the per-main
+        cap double until `want` combos qualify or they span the whole range.
+        Mains are scanned in chunks, most promising first;
+        past `deadline` (time.monotonic()) the scan stops after the first
+        chunk that has found something. Returns (scores, main, side_j, side_k, complete); side slots
+        equal len(side_ids) mean "no side".
+        """
+        mains = np.flatnonzero(main_ok)
+        ok_ext = np.append(np.asarray(side_ok, dtype=bool), True)
+        sets = self._sets(max_sides)
+        set_kcal = sets[0]
+        if not len(mains) or not len(set_kcal):
+            return np.empty(0), mains[:0], mains[:0], mains[:0], True
+
+        # Most promising first: mains whose kcal leaves room for a typical side set.
+        typical = float(np.median(set_kcal))
+        mains = mains[np.argsort(np.abs(kcal_target - typical - self.main_mac[mains, 0]), kind="stable")]
+        # A window this wide admits every (main, side set) pair.
+        span = abs(kcal_target) + float(self.main_mac[mains, 0].max()) + float(set_kcal[-1])
+
+        while True:
+            found, complete = self._scan(kcal_target, score, mains, ok_ext, want, window, deadline, per_main, sets)
+            if len(found[0]) >= want or not complete:  # incomplete => found some
+                break
+            if window >= span and per_main >= len(set_kcal):
+                break
+            window *= 2
+            per_main *= 2  # the sets nearest the fit may all be excluded (used, or the main itself)
+        return (*found, complete)
+
+    def _scan(self, kcal_target, score, mains, ok_ext, want, window, deadline, per_main, sets):
+        set_kcal, set_j, set_k, set_mac = sets
+        best_s, best_m, best_j, best_k = [np.empty(0)], [np.empty(0, int)], [np.empty(0, int)], [np.empty(0, int)]
+        complete = True
+        found = 0
+        for start in range(0, len(mains), MAIN_CHUNK):
+            if found and deadline is not None and time.monotonic() >= deadline:
+                complete = False
+                break
+            chunk = mains[start:start + MAIN_CHUNK]
+            rest = kcal_target - self.main_mac[chunk, 0]
+            fit = np.searchsorted(set_kcal, rest)
+            lo = np.maximum(np.searchsorted(set_kcal, rest - window, "left"), fit - per_main)
+            hi = np.minimum(np.searchsorted(set_kcal, rest + window, "right"), fit + per_main)
+            counts = hi - lo
+            total = int(counts.sum())
+            if not total:
+                continue
+            m = np.repeat(chunk, counts)
+            s = np.repeat(lo, counts) + (np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts))
+            j, k = set_j[s], set_k[s]
+            main_id = self.main_ids[m]
+            valid = ok_ext[j] & ok_ext[k] & (self._side_ids_ext[j] != main_id) & (self._side_ids_ext[k] != main_id)
+            m, s, j, k = m[valid], s[valid], j[valid], k[valid]
+            scores = score(self.main_mac[m] + set_mac[s])
+            if len(scores) > want:
+                keep = np.argpartition(scores, want - 1)[:want]
+                m, j, k, scores = m[keep], j[keep], k[keep], scores[keep]
+            found += len(scores)
+            best_s.append(scores)
+            best_m.append(m)
+            best_j.append(j)
+            best_k.append(k)
+
+        scores = np.concatenate(best_s)
+        order = np.argsort(scores, kind="stable")[:want]
+        return (scores[order], np.concatenate(best_m)[order],
+                np.concatenate(best_j)[order], np.concatenate(best_k)[order]), complete
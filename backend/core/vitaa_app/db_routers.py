@@ -0,0 +1,188 @@
+# vitaa_app/db_routers.py
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ALIAS = "catalog"
+CATALOG_MODELS = {"dish", "allergen", "allergendish", "catalogchange"}
+
+
+def _replica_path():
+    """Filesystem path of the replica, or None when there is no usable replica."""
+    if not getattr(settings, "CATALOG_REPLICA_ENABLED", False):
+        return None
+    if REPLICA_ALIAS not in settings.DATABASES:
+        return None
+    name = str(connections[REPLICA_ALIAS].settings_dict["NAME"])
+    if name == str(connections["default"].settings_dict["NAME"]):
+        return None  # mirrors default (e.g. under the test runner)
+    return name.split("?", 1)[0].removeprefix("file:")
+
+
+def replica_available() -> bool:
+    path = _replica_path()
+    return bool(path) and os.path.exists(path)
+
+
+class CatalogReplicaRouter:
+    """
+    Catalog reads (Dish, Allergen, AllergenDish, CatalogChange) go to the
+    read-only SQLite copy under the "catalog" alias once it exists, so planner
+    reads never wait on importer/admin write transactions. Writes, and reads
+    made for writing (update_or_create, select_for_update, anything inside a
+    transaction on default), stay on default: the replica lags default, and
+    a read that drives a write must see the rows it is about to change.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == "vitaa_app" and model._meta.model_name in CATALOG_MODELS \
+                and not connections["default"].in_atomic_block and replica_available():
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data; a Dish read from the replica may be
+        # assigned to an AllergenDish written to default.
+        if {obj1._state.db, obj2._state.db} <= {"default", REPLICA_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of default's catalog tables, never migrated itself.
+        return db != REPLICA_ALIAS
+
+
+# ---------- REFRESH ----------
+# Seconds a refresh waits after the write that asked for it, so a burst of
+# writes (an import, a run of admin edits) is copied once.
+DEFAULT_REFRESH_DELAY_S = 1.0
+
+_refresh_lock = threading.Lock()
+
+
+def _catalog_tables():
+    from django.apps import apps
+    return [m._meta.db_table for m in apps.get_app_config("vitaa_app").get_models()
+            if m._meta.model_name in CATALOG_MODELS]
+
+
+def default_database_uri() -> str:
+    """sqlite3 URI of the default database (read-only for a plain file name)."""
+    name = str(connections["default"].settings_dict["NAME"])
+    if name.startswith("file:"):
+        return name  # already a URI (e.g. the test runner's shared in-memory database)
+    return f"file:{quote(os.path.abspath(name))}?mode=ro"
+
+
+def _copy_catalog_tables(dst: sqlite3.Connection):
+    """Create the catalog tables (with their indexes) in `dst` and fill them from default in one read transaction."""
+    tables = _catalog_tables()
+    marks = ",".join("?" * len(tables))
+    dst.execute("ATTACH DATABASE ? AS src", (default_database_uri(),))
+    try:
+        dst.execute("BEGIN")
+        schema = dst.execute(
+            f"SELECT type, sql FROM src.sqlite_master WHERE tbl_name IN ({marks}) AND sql IS NOT NULL",
+            tables).fetchall()
+        for _kind, sql in sorted(schema, key=lambda row: row[0] != "table"):  # tables before indexes
+            dst.execute(sql)
+        for table in tables:
+            dst.execute(f'INSERT INTO main."{table}" SELECT * FROM src."{table}"')
+        dst.execute("COMMIT")
+    finally:
+        dst.execute("DETACH DATABASE src")
+
+
+def refresh_catalog_replica() -> bool:
+    """
+    Copy the catalog tables of default (not history or job tables) into the
+    replica file: first into memory, then onto the file with SQLite's online
+    backup API, so replica readers are only held off for that last, small
+    copy. Readers see the new content on their next query. Returns False
+    when no replica is configured.
+    """
+    path = _replica_path()
+    if not path:
+        return False
+    with _refresh_lock:
+        staged = sqlite3.connect("file::memory:", uri=True, isolation_level=None)
+        try:
+            _copy_catalog_tables(staged)
+            dst = sqlite3.connect(path)
+            try:
+                staged.backup(dst)
+                # Read-only openers cannot create WAL side files; keep the copy in
+                # rollback-journal mode whatever mode default uses.
+                dst.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                dst.close()
+        finally:
+            staged.close()
+
+    from vitaa_app import catalog
+    catalog.invalidate_version()
+    return True
+
+
+_refresh_wanted = threading.Event()
+_refresher_lock = threading.Lock()
+_refresher = {"thread": None, "pid": None}
+
+
+def _refresh_loop():
+    while True:
+        _refresh_wanted.wait()
+        time.sleep(getattr(settings, "CATALOG_REPLICA_REFRESH_DELAY_S", DEFAULT_REFRESH_DELAY_S))
+        _refresh_wanted.clear()  # writes from here on ask for another refresh
+        try:
+            refresh_catalog_replica()
+        except Exception:
+            logger.exception("catalog replica refresh failed")
+
+
+def request_replica_refresh():
+    """
+    Ask this process's background refresher (started on first use) for a
+    refresh. A process that serves no requests (import_food_data,
+    refresh_dish_flags, a shell) refreshes right away instead: it may exit
+    before a delayed background refresh runs.
+    """
+    from vitaa_app.apps import serving_requests
+    if not serving_requests():
+        try:
+            refresh_catalog_replica()
+        except Exception:
+            logger.exception("catalog replica refresh failed")
+        return
+    with _refresher_lock:
+        if _refresher["pid"] != os.getpid():  # none yet, or inherited across a fork without its thread
+            thread = threading.Thread(target=_refresh_loop, name="vitaa-replica-refresh", daemon=True)
+            _refresher.update(thread=thread, pid=os.getpid())
+            thread.start()
+    _refresh_wanted.set()
+
+
+def schedule_replica_refresh():
+    """
+    Refresh the replica once the current transaction commits. Called on
+    every catalog write; an import touching thousands of rows registers one
+    request, and in a server process requests within
+    CATALOG_REPLICA_REFRESH_DELAY_S of each other share one background copy.
+    """
+    if _replica_path() is None:
+        return
+    conn = transaction.get_connection()
+    if any(entry[1] is request_replica_refresh for entry in conn.run_on_commit):
+        return
+    transaction.on_commit(request_replica_refresh)
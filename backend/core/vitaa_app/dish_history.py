@@ -0,0 +1,87 @@
+# vitaa_app/dish_history.py
+from datetime import timedelta
+from typing import Iterable, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from vitaa_app.models import UserDishHistory
+
+# Bloom filter geometry: 2048 bits (256 bytes) and 3 hashes give a false
+# positive rate of (1 - e^(-3n/2048))^3: below 0.1% up to ~70 dishes per
+# window, about 0.25% at 100. A false positive only skips a dish as
+# recently served. (Stored filters are this size: changing it needs a reset.)
+BLOOM_BITS = 2048
+BLOOM_HASHES = 3
+_SHIFT = np.uint64(64 - 11)  # log2(BLOOM_BITS) == 11
+_MULTS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9], dtype=np.uint64)
+DEFAULT_WINDOW_DAYS = 3
+_EMPTY = bytes(BLOOM_BITS // 8)
+
+
+def bloom_positions(dish_ids) -> np.ndarray:
+    """(n, BLOOM_HASHES) bit positions per dish id (multiplicative hashing)."""
+    ids = np.asarray(dish_ids, dtype=np.uint64).reshape(-1, 1) + np.uint64(1)
+    with np.errstate(over="ignore"):
+        return ((ids * _MULTS[:BLOOM_HASHES]) >> _SHIFT).astype(np.intp)
+
+
+def _bits(raw) -> np.ndarray:
+    return np.unpackbits(np.frombuffer(bytes(raw or _EMPTY), dtype=np.uint8), bitorder="little").astype(bool)
+
+
+def bloom_add(raw, dish_ids) -> bytes:
+    bits = _bits(raw)
+    bits[bloom_positions(dish_ids).ravel()] = True
+    return np.packbits(bits, bitorder="little").tobytes()
+
+
+def bloom_contains(raw, dish_ids) -> np.ndarray:
+    """Boolean mask: which dish ids are (probably) in the filter."""
+    return _bits(raw)[bloom_positions(dish_ids)].all(axis=1)
+
+
+def _window() -> timedelta:
+    return timedelta(days=getattr(settings, "DISH_HISTORY_WINDOW_DAYS", DEFAULT_WINDOW_DAYS))
+
+
+def recent_mask(user_id: Optional[str], dish_ids) -> Optional[np.ndarray]:
+    """
+    Mask over dish_ids of dishes served to the user in the last one to two
+    windows; None when there is no user or no history. One primary-key read.
+    """
+    if not user_id:
+        return None
+    h = UserDishHistory.objects.filter(pk=str(user_id)).first()
+    if h is None:
+        return None
+    ids = np.asarray(dish_ids)
+    age = timezone.now() - h.window_started_at
+    if age >= 2 * _window():
+        return None
+    mask = bloom_contains(h.recent, ids)
+    if age < _window():
+        mask |= bloom_contains(h.previous, ids)
+    return mask
+
+
+def record_served(user_id: Optional[str], dish_ids: Iterable[int]):
+    """Add served dishes to the user's current window, rolling windows as needed."""
+    dish_ids = list(dish_ids)
+    if not user_id or not dish_ids:
+        return
+    now = timezone.now()
+    with transaction.atomic():
+        h = UserDishHistory.objects.select_for_update().filter(pk=str(user_id)).first()
+        if h is None:
+            h = UserDishHistory(user_id=str(user_id), recent=_EMPTY, previous=_EMPTY, window_started_at=now)
+        else:
+            age = now - h.window_started_at
+            if age >= 2 * _window():
+                h.recent, h.previous, h.window_started_at = _EMPTY, _EMPTY, now
+            elif age >= _window():
+                h.recent, h.previous, h.window_started_at = _EMPTY, bytes(h.recent), now
+        h.recent = bloom_add(h.recent, dish_ids)
+        h.save()
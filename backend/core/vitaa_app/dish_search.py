@@ -0,0 +1,112 @@
+# vitaa_app/dish_search.py
+import unicodedata
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from vitaa_app.models import Dish, allergen_ids_matching
+
+NAME_FIELDS = ("dish_name", "dish_ms_name", "dish_vi_name", "dish_zh_name")
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Name matches are resolved against the DB filters this many ids at a time.
+ID_CHUNK = 500
+
+
+# ---------- NAME PREFIX INDEX ----------
+def normalize_name(s: str) -> str:
+    """Casefold and strip accents so 'Phở bò' and 'pho bo' compare equal."""
+    s = unicodedata.normalize("NFKD", str(s or "")).replace("đ", "d").replace("Đ", "D")
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    return " ".join(s.casefold().split())
+
+
+def _is_cjk(ch: str) -> bool:
+    return "㐀" <= ch <= "鿿"
+
+
+def _index_keys(name: str) -> Iterable[str]:
+    """
+    Every position a query may start matching at: each word start, and for
+    CJK names (no spaces) every character.
+    """
+    words = name.split(" ")
+    for i in range(len(words)):
+        yield " ".join(words[i:])
+    if any(_is_cjk(ch) for ch in name):
+        for i in range(1, len(name)):
+            if name[i] != " ":
+                yield name[i:]
+
+
+class NamePrefixIndex:
+    """Sorted (key, dish_id) pairs over all localized names; prefix lookup by bisection."""
+
+    def __init__(self, dishes: Iterable[Dict]):
+        pairs = set()
+        for d in dishes:
+            for field in NAME_FIELDS:
+                name = normalize_name(d.get(field))
+                if name:
+                    pairs.update((k, d["dish_id"]) for k in _index_keys(name))
+        pairs = sorted(pairs)
+        self._keys = [k for k, _ in pairs]
+        self._ids = [i for _, i in pairs]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def match(self, prefix: str) -> Set[int]:
+        p = normalize_name(prefix)
+        if not p:
+            return set()
+        lo = bisect_left(self._keys, p)
+        hi = bisect_left(self._keys, p + "\U0010ffff", lo)
+        return set(self._ids[lo:hi])
+
+
+# ---------- SEARCH ----------
+def _filtered_queryset(veg_classes=None, min_kcal=None, max_kcal=None,
+                       min_protein=None, max_protein=None, exclude_allergens=None):
+    qs = Dish.objects.all()
+    if veg_classes:
+        qs = qs.filter(veg_class__in=veg_classes)
+    if min_kcal is not None:
+        qs = qs.filter(calories_kcal__gte=min_kcal)
+    if max_kcal is not None:
+        qs = qs.filter(calories_kcal__lte=max_kcal)
+    if min_protein is not None:
+        qs = qs.filter(protein_g__gte=min_protein)
+    if max_protein is not None:
+        qs = qs.filter(protein_g__lte=max_protein)
+    if exclude_allergens:
+        # Substring match on allergen names, as the planner's allergy filter does.
+        qs = qs.exclude(allergendish__allergen_id__in=allergen_ids_matching(exclude_allergens))
+    return qs
+
+
+def search_dish_ids(name_ids: Optional[Set[int]] = None, after: int = 0,
+                    limit: int = DEFAULT_PAGE_SIZE, **filters) -> Tuple[List[int], Optional[int]]:
+    """
+    One page of dish ids matching the filters, ordered by dish_id, starting
+    after the `after` cursor (keyset pagination: cost does not grow with page
+    depth). `name_ids` restricts the page to ids from the name index.
+    Returns (ids, next_cursor); next_cursor is None on the last page.
+    """
+    qs = _filtered_queryset(**filters).filter(dish_id__gt=after).order_by("dish_id")
+
+    if name_ids is None:
+        ids = list(qs.values_list("dish_id", flat=True)[:limit + 1])
+    else:
+        # Walk the name matches in id order, letting the DB filter one chunk at a time.
+        candidates = sorted(i for i in name_ids if i > after)
+        ids = []
+        for start in range(0, len(candidates), ID_CHUNK):
+            chunk = candidates[start:start + ID_CHUNK]
+            ids.extend(qs.filter(dish_id__in=chunk).values_list("dish_id", flat=True)[:limit + 1 - len(ids)])
+            if len(ids) > limit:
+                break
+
+    if len(ids) > limit:
+        ids = ids[:limit]
+        return ids, ids[-1]
+    return ids, None
@@ -1,10 +1,22 @@
 # backend/core/vitaa_app/health_analysis.py
-from typing import Dict, Any
+import time
+from typing import Dict, Any, List, Optional
 import requests
 import json
+from django.conf import settings
 
-# Your n8n webhook URL
+from vitaa_app.batching import MicroBatcher
+from vitaa_app.resilience import Bulkhead, BulkheadFullError, CircuitBreaker
+
+# Default n8n webhook URL; settings.N8N_WEBHOOK_URL overrides it.
 WEBHOOK_URL = "https://n8n.tm06.me/webhook/health_analysis_openai"
+DEFAULT_TIMEOUT_S = 10
+DEFAULT_BATCH_WINDOW_MS = 50.0
+DEFAULT_BATCH_MAX_SIZE = 20
+DEFAULT_BATCH_TIMEOUT_S = 30
+DEFAULT_BATCH_RETRY_S = 300.0
+# Answers meaning "this webhook does not take batches" rather than "n8n is down".
+BATCH_REJECTED_STATUSES = {400, 404, 405, 413, 415, 422}
 
 # Optional: map UI activity levels to a canonical internal set
 _ACTIVITY_MAP = {
@@ -15,6 +27,26 @@ _ACTIVITY_MAP = {
     "very_high": "extra_active",
 }
 
+# Per-process guards around the upstream call: stop calling n8n after
+# repeated timeouts/5xx, and cap how many workers can be stuck waiting on it.
+_breaker = CircuitBreaker(
+    "n8n",
+    failure_threshold=getattr(settings, "N8N_BREAKER_FAILURE_THRESHOLD", 5),
+    reset_timeout_s=getattr(settings, "N8N_BREAKER_RESET_S", 30.0),
+    half_open_probes=getattr(settings, "N8N_BREAKER_HALF_OPEN_PROBES", 1),
+)
+_bulkhead = Bulkhead(
+    "n8n",
+    max_concurrent=getattr(settings, "N8N_MAX_CONCURRENCY", 8),
+    wait_s=getattr(settings, "N8N_BULKHEAD_WAIT_S", 0.5),
+)
+
+def _webhook_url() -> str:
+    return getattr(settings, "N8N_WEBHOOK_URL", WEBHOOK_URL)
+
+def _timeout_s() -> float:
+    return getattr(settings, "N8N_TIMEOUT_S", DEFAULT_TIMEOUT_S)
+
 def _norm(s: Any) -> str:
     return str(s or "").strip()
 
@@ -72,16 +104,122 @@ def _normalize_payload(p: Dict[str, Any]) -> Dict[str, Any]:
         "raw_input": p,
     }
 
-def n8n_health_analysis(user_payload: Dict[str, Any]) -> Dict[str, Any]:
+def _post_guarded(body: Any, url: Optional[str] = None, timeout_s: Optional[float] = None) -> requests.Response:
     """
-    Normalize and forward to n8n; return n8n's response.
-    Raises HTTPError on non-2xx responses.
+    POST to the webhook through the circuit breaker and bulkhead.
+    Timeouts, connection errors and 5xx count as failures; 4xx do not
+    (the upstream is healthy, the request was bad).
+    Raises CircuitOpenError / BulkheadFullError without calling upstream.
     """
-    normalized = _normalize_payload(user_payload)
-    resp = requests.post(WEBHOOK_URL, json=normalized, timeout=10)
+    _breaker.allow()
+    try:
+        with _bulkhead.slot():
+            try:
+                resp = requests.post(url or _webhook_url(), json=body, timeout=timeout_s or _timeout_s())
+            except (requests.Timeout, requests.ConnectionError):
+                _breaker.on_failure()
+                raise
+            except BaseException:
+                _breaker.on_abandon()
+                raise
+    except BulkheadFullError:
+        _breaker.on_abandon()
+        raise
+    if resp.status_code >= 500:
+        _breaker.on_failure()
+    else:
+        _breaker.on_success()
+    return resp
+
+def _forward_one(normalized: Dict[str, Any]) -> Dict[str, Any]:
+    resp = _post_guarded(normalized)
     resp.raise_for_status()
     try:
         return resp.json()
     except ValueError:
         # If n8n returns non-JSON text
         return {"status": "ok", "text": resp.text}
+
+# ---------- MICRO-BATCHING ----------
+# Until this monotonic time the upstream is assumed not to take batches.
+_batch_rejected_until = [0.0]
+
+def _batching_enabled() -> bool:
+    return getattr(settings, "N8N_BATCH_ENABLED", False) and time.monotonic() >= _batch_rejected_until[0]
+
+def _reject_batches():
+    _batch_rejected_until[0] = time.monotonic() + getattr(settings, "N8N_BATCH_RETRY_S", DEFAULT_BATCH_RETRY_S)
+
+def _forward_batch(items: List[Dict[str, Any]]) -> Optional[List[Any]]:
+    """
+    One {"batch": [...]} call for several normalized payloads; n8n answers
+    {"results": [...]} (or a bare list) in the same order. Returns None when
+    the webhook rejects batches, so each caller forwards its own payload.
+    """
+    if len(items) == 1:
+        return None  # nobody joined: a plain call, no wrapper
+    resp = _post_guarded(
+        {"batch": items},
+        url=getattr(settings, "N8N_BATCH_URL", None),
+        timeout_s=getattr(settings, "N8N_BATCH_TIMEOUT_S", DEFAULT_BATCH_TIMEOUT_S),
+    )
+    if resp.status_code in BATCH_REJECTED_STATUSES:
+        _reject_batches()
+        return None
+    resp.raise_for_status()
+    try:
+        body = resp.json()
+    except ValueError:
+        body = None
+    results = body.get("results") if isinstance(body, dict) else body
+    if not isinstance(results, list) or len(results) != len(items):
+        _reject_batches()
+        return None
+    return results
+
+_batcher = MicroBatcher(_forward_batch)
+
+def n8n_health_analysis(user_payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalize and forward to n8n; return n8n's response.
+    With N8N_BATCH_ENABLED, payloads arriving within N8N_BATCH_WINDOW_MS of
+    each other share one webhook call (see _forward_batch).
+    Raises HTTPError on non-2xx responses, CircuitOpenError / BulkheadFullError
+    when the upstream is being shed.
+    """
+    normalized = _normalize_payload(user_payload)
+    if not _batching_enabled():
+        return _forward_one(normalized)
+    return _batcher.submit(
+        normalized,
+        _forward_one,
+        window_s=getattr(settings, "N8N_BATCH_WINDOW_MS", DEFAULT_BATCH_WINDOW_MS) / 1000.0,
+        max_size=getattr(settings, "N8N_BATCH_MAX_SIZE", DEFAULT_BATCH_MAX_SIZE),
+    )
+
+def _bmi_category(bmi):
+    if bmi is None:
+        return None
+    if bmi < 18.5:
+        return "underweight"
+    if bmi < 25:
+        return "normal"
+    if bmi < 30:
+        return "overweight"
+    return "obese"
+
+def local_health_summary(user_payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fallback when n8n is unavailable: only the derived metrics computed by
+    _normalize_payload, with standard BMI / waist-to-height cut-offs.
+    """
+    normalized = _normalize_payload(user_payload)
+    anthro = normalized["anthropometrics"]
+    whtr = anthro["waist_to_height_ratio"]
+    return {
+        "age": normalized["age"],
+        "sex": normalized["sex"],
+        "anthropometrics": anthro,
+        "bmi_category": _bmi_category(anthro["bmi"]),
+        "waist_to_height_risk": None if whtr is None else ("increased" if whtr >= 0.5 else "low"),
+    }
@@ -0,0 +1,62 @@
+# vitaa_app/ingredient_index.py
+import re
+from typing import Dict, Iterable, List, Set, Tuple
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def _singular(word: str) -> str:
+    """Crude plural folding, applied to both index and query so they agree."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith("oes"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def ingredient_words(text: str) -> Tuple[str, ...]:
+    return tuple(_singular(w) for w in _WORD_RE.findall(str(text or "").casefold()))
+
+
+class IngredientIndex:
+    """
+    Inverted index: normalized ingredient word -> ids of dishes using it.
+    Multi-word terms ("soy sauce") are matched as a phrase inside a single
+    ingredient, checked only on the dishes that contain every word.
+    """
+
+    def __init__(self, items: Iterable[Tuple[int, Iterable[str]]]):
+        self._postings: Dict[str, Set[int]] = {}
+        self._phrases: Dict[int, List[Tuple[str, ...]]] = {}
+        for dish_id, ingredients in items:
+            phrases = [ingredient_words(i) for i in ingredients or []]
+            phrases = [p for p in phrases if p]
+            self._phrases[dish_id] = phrases
+            for phrase in phrases:
+                for w in phrase:
+                    self._postings.setdefault(w, set()).add(dish_id)
+
+    def __len__(self):
+        return len(self._postings)
+
+    def lookup(self, term: str) -> Set[int]:
+        words = ingredient_words(term)
+        if not words:
+            return set()
+        sets = sorted((self._postings.get(w, set()) for w in set(words)), key=len)
+        hits = set(sets[0]).intersection(*sets[1:])
+        if len(words) == 1:
+            return hits
+        n = len(words)
+        return {
+            d for d in hits
+            if any(p[i:i + n] == words for p in self._phrases[d] for i in range(len(p) - n + 1))
+        }
+
+    def dishes_with_any(self, terms: Iterable[str]) -> Set[int]:
+        out: Set[int] = set()
+        for t in terms:
+            out |= self.lookup(t)
+        return out
@@ -0,0 +1,159 @@
+# vitaa_app/jobs.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from requests import HTTPError, RequestException
+
+from vitaa_app.health_analysis import _normalize_payload, n8n_health_analysis
+from vitaa_app.models import AnalysisJob
+from vitaa_app.resilience import BulkheadFullError, CircuitOpenError
+
+# Background health analyses: the job row lives in the database, so any
+# worker process can answer a status poll; the forward itself runs on a
+# small in-process thread pool (no external broker).
+
+DEFAULT_WORKERS = 4
+DEFAULT_TTL_S = 24 * 3600
+DEFAULT_STALE_S = 300
+MAX_WAIT_S = 30.0
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_pace_lock = threading.Lock()
+_last_start = [0.0]
+# In-process wake-ups for long polls on jobs this worker is running.
+_done_events: Dict[str, threading.Event] = {}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "N8N_JOB_WORKERS", DEFAULT_WORKERS),
+                thread_name_prefix="n8n-job",
+            )
+        return _executor
+
+
+def _pace():
+    """Space upstream calls at least N8N_JOB_MIN_INTERVAL_S apart (per process)."""
+    interval = getattr(settings, "N8N_JOB_MIN_INTERVAL_S", 0.0)
+    if interval <= 0:
+        return
+    with _pace_lock:
+        wait = _last_start[0] + interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        _last_start[0] = time.monotonic()
+
+
+def _error_for(e: Exception) -> Dict:
+    """Same status codes the synchronous view returns for these failures."""
+    if isinstance(e, (CircuitOpenError, BulkheadFullError)):
+        return {"status": 503, "error": "Health analysis temporarily unavailable", "details": str(e)}
+    if isinstance(e, HTTPError):
+        return {"status": 502, "error": "Webhook returned error", "details": str(e),
+                "body": getattr(e.response, "text", "")}
+    if isinstance(e, RequestException):
+        return {"status": 504, "error": "Webhook unreachable", "details": str(e)}
+    return {"status": 400, "error": str(e)}
+
+
+def _run_job(job_id: str):
+    close_old_connections()
+    try:
+        _pace()
+        # Status guards: a job already reported finished (lost) stays finished.
+        started = AnalysisJob.objects.filter(pk=job_id, status=AnalysisJob.QUEUED).update(
+            status=AnalysisJob.RUNNING, started_at=timezone.now())
+        if not started:
+            return
+        payload = AnalysisJob.objects.values_list("payload", flat=True).get(pk=job_id)
+        unfinished = AnalysisJob.objects.filter(pk=job_id, status__in=(AnalysisJob.QUEUED, AnalysisJob.RUNNING))
+        try:
+            result = n8n_health_analysis(payload)
+        except Exception as e:
+            unfinished.update(status=AnalysisJob.FAILED, error=_error_for(e), finished_at=timezone.now())
+        else:
+            unfinished.update(status=AnalysisJob.DONE, result=result, finished_at=timezone.now())
+    finally:
+        event = _done_events.pop(str(job_id), None)
+        if event is not None:
+            event.set()
+        close_old_connections()
+
+
+def submit_analysis(payload: Dict) -> AnalysisJob:
+    """
+    Validate the payload, store a queued job and hand it to the worker pool.
+    Raises the same errors as _normalize_payload for bad input.
+    """
+    _normalize_payload(payload)  # reject bad input now, not in the background
+
+    ttl = getattr(settings, "N8N_JOB_TTL_S", DEFAULT_TTL_S)
+    AnalysisJob.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=ttl)).delete()
+
+    job = AnalysisJob.objects.create(payload=payload)
+    job_id = str(job.pk)
+    if getattr(settings, "N8N_JOB_EAGER", False):
+        _run_job(job_id)
+        job.refresh_from_db()
+        return job
+
+    def enqueue():
+        # Registered only once the job exists for other connections: a rolled
+        # back transaction never runs this, so it leaves no event behind.
+        _done_events[job_id] = threading.Event()
+        _get_executor().submit(_run_job, job_id)
+
+    transaction.on_commit(enqueue)
+    return job
+
+
+def job_status(job: AnalysisJob) -> Dict:
+    out = {"job_id": str(job.pk), "status": job.status}
+    if job.status == AnalysisJob.DONE:
+        out["webhook_response"] = job.result
+    elif job.status == AnalysisJob.FAILED:
+        out["error"] = job.error
+    return out
+
+
+def wait_for_job(job_id, wait_s: float = 0.0) -> Optional[AnalysisJob]:
+    """
+    Current job row, long-polling up to wait_s for it to finish. Jobs running
+    for over N8N_JOB_STALE_S since they started, or still queued that long
+    after they were created, are reported failed: their worker died or
+    restarted, and the in-process queue went with it.
+    """
+    wait_s = max(0.0, min(wait_s, MAX_WAIT_S))
+    deadline = time.monotonic() + wait_s
+    delay = 0.05
+    while True:
+        job = AnalysisJob.objects.filter(pk=job_id).first()
+        if job is None or job.status in (AnalysisJob.DONE, AnalysisJob.FAILED):
+            return job
+        stale_s = getattr(settings, "N8N_JOB_STALE_S", DEFAULT_STALE_S)
+        since = job.started_at if job.status == AnalysisJob.RUNNING else job.created_at
+        if since is not None and timezone.now() - since > timedelta(seconds=stale_s):
+            AnalysisJob.objects.filter(pk=job.pk, status=job.status).update(
+                status=AnalysisJob.FAILED, finished_at=timezone.now(),
+                error={"status": 504, "error": "Job lost before completion"})
+            job.refresh_from_db()
+            return job
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return job
+        event = _done_events.get(str(job.pk))
+        if event is not None:
+            event.wait(min(remaining, 1.0))
+        else:
+            time.sleep(min(remaining, delay))
+            delay = min(delay * 2, 0.5)
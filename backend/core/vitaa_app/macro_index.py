@@ -0,0 +1,87 @@
+# vitaa_app/macro_index.py
+import heapq
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+MACRO_COLUMNS = ["calories_kcal", "protein_g", "fat_g", "carbohydrate_g"]
+LEAF_SIZE = 16
+
+
+class MacroKDTree:
+    """
+    KD-tree over dish macro vectors (kcal, protein, fat, carbs), each axis
+    scaled by its standard deviation so kcal does not drown out the grams.
+
+    Queries take an optional boolean mask over rows; masked-out rows are
+    skipped during the search, so diet/allergy filtering needs no rebuild.
+    """
+
+    def __init__(self, points: np.ndarray):
+        points = np.asarray(points, dtype=float).reshape(-1, len(MACRO_COLUMNS))
+        scale = points.std(axis=0) if len(points) else np.ones(points.shape[1])
+        scale[scale == 0] = 1.0
+        self.scale = scale
+        self.points = points / scale
+        self.order = np.arange(len(points))
+        # node: (lo, hi, dim, split, left, right); leaves have dim == -1
+        self.nodes: List[Tuple[int, int, int, float, int, int]] = []
+        if len(points):
+            self._build(0, len(points))
+
+    def __len__(self):
+        return len(self.points)
+
+    def _build(self, lo: int, hi: int) -> int:
+        node_id = len(self.nodes)
+        self.nodes.append((lo, hi, -1, 0.0, -1, -1))
+        if hi - lo <= LEAF_SIZE:
+            return node_id
+        idx = self.order[lo:hi]
+        pts = self.points[idx]
+        dim = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+        mid = (hi - lo) // 2
+        part = np.argpartition(pts[:, dim], mid)
+        self.order[lo:hi] = idx[part]
+        split = float(self.points[self.order[lo + mid], dim])
+        left = self._build(lo, lo + mid)
+        right = self._build(lo + mid, hi)
+        self.nodes[node_id] = (lo, hi, dim, split, left, right)
+        return node_id
+
+    def query(self, x, k: int = 5, mask: Optional[np.ndarray] = None) -> List[Tuple[float, int]]:
+        """k nearest rows to macro vector x as [(distance, row)], nearest first."""
+        if not self.nodes or k <= 0:
+            return []
+        q = np.asarray(x, dtype=float) / self.scale
+        best: List[Tuple[float, int]] = []  # max-heap via negated distance
+
+        def worst():
+            return -best[0][0] if len(best) == k else np.inf
+
+        stack = [(0.0, 0)]
+        while stack:
+            bound, node_id = stack.pop()
+            if bound >= worst():
+                continue
+            lo, hi, dim, split, left, right = self.nodes[node_id]
+            if dim < 0:
+                rows = self.order[lo:hi]
+                if mask is not None:
+                    rows = rows[mask[rows]]
+                if not len(rows):
+                    continue
+                dists = np.sqrt(((self.points[rows] - q) ** 2).sum(axis=1))
+                for d, r in zip(dists, rows):
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, int(r)))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, int(r)))
+                continue
+            diff = q[dim] - split
+            near, far = (left, right) if diff < 0 else (right, left)
+            # Push far first so the near side is explored first.
+            stack.append((max(bound, abs(diff)), far))
+            stack.append((bound, near))
+
+        return sorted((-d, r) for d, r in best)
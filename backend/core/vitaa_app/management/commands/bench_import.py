@@ -0,0 +1,198 @@
+import csv
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+
+DEFAULT_SIZES = "1000,10000,100000,500000"
+DEFAULT_QUERY_BUDGET_PER_ROW = 16.0
+
+_PROTEINS = ["chicken", "beef", "pork", "tofu", "salmon", "prawn", "egg", "tempeh", "lamb", "duck"]
+_EXTRAS = ["rice", "noodles", "garlic", "onion", "soy sauce", "coconut milk", "chilli", "ginger",
+           "lemongrass", "spinach", "basil", "peanuts", "sesame oil", "lime", "tomato"]
+_ALLERGENS = ["wheat", "soy", "peanuts", "shellfish", "milk", "egg", "fish", "sesame", "tree nuts"]
+_DIETS = ["non-veg", "vegetarian", "vegan", "unknown"]
+CSV_HEADER = ["dish_name", "dish_name_cn", "dish_name_ms", "dish_name_vn", "image_url",
+              "ingredients", "diet_class", "nutritional_profile", "allergens"]
+
+
+def _list_cell(rng, items):
+    """The list formats seen in real exports: JSON, Python literal, comma-separated."""
+    style = rng.random()
+    if style < 0.4:
+        return repr(items)
+    if style < 0.7:
+        return json.dumps(items)
+    return ", ".join(items)
+
+
+def _nutrition_cell(rng):
+    prof = {
+        "calories_kcal": rng.choice([rng.randint(60, 900), float(rng.randint(60, 900))]),
+        "protein_g": round(rng.uniform(0, 60), rng.choice([0, 1, 2])),
+        "fat_g": round(rng.uniform(0, 45), 1),
+        "carbohydrate_g": round(rng.uniform(0, 120), 1),
+    }
+    if rng.random() < 0.1:
+        prof.pop(rng.choice(list(prof)))  # importer defaults missing keys to 0
+    if rng.random() < 0.2:
+        prof["fiber_g"] = round(rng.uniform(0, 12), 1)  # extra keys are ignored
+    keys = list(prof)
+    rng.shuffle(keys)
+    return json.dumps({k: prof[k] for k in keys})
+
+
+def _allergen_cell(rng):
+    r = rng.random()
+    if r < 0.3:
+        return rng.choice(["", "none", "None"])
+    picked = rng.sample(_ALLERGENS, rng.randint(1, 3))
+    if r < 0.5:
+        return picked[0]
+    return _list_cell(rng, picked)
+
+
+def write_synthetic_csv(path, rows, seed=0):
+    """A food CSV in the import_food_data format with `rows` distinct dishes."""
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(CSV_HEADER)
+        for i in range(rows):
+            protein = rng.choice(_PROTEINS)
+            name = f"{protein.title()} {rng.choice(_EXTRAS).title()} #{i}"
+            ingredients = [protein] + rng.sample(_EXTRAS, rng.randint(1, 6))
+            w.writerow([
+                name, f"菜{i}", f"Hidangan {i}", f"Món {i}",
+                f"https://img.example/{i}.jpg",
+                _list_cell(rng, ingredients),
+                rng.choice(_DIETS),
+                _nutrition_cell(rng),
+                _allergen_cell(rng),
+            ])
+
+
+def run_import(csv_path, trace_memory=False):
+    """
+    Run import_food_data on csv_path against the current default database.
+    Returns rows, seconds, rows_per_s, queries, queries_per_row and
+    peak_mb (tracemalloc peak when trace_memory, otherwise process max RSS).
+    """
+    with open(csv_path, encoding="utf-8") as f:
+        rows = max(0, sum(1 for _ in f) - 1)
+
+    queries = [0]
+
+    def count(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with connections["default"].execute_wrapper(count):
+            call_command("import_food_data", csv_path, stdout=StringIO(), stderr=StringIO())
+        seconds = time.perf_counter() - started
+        if trace_memory:
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        else:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak_mb = rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_s": round(rows / seconds, 1) if seconds else 0.0,
+        "queries": queries[0],
+        "queries_per_row": round(queries[0] / rows, 2) if rows else 0.0,
+        "peak_mb": round(peak_mb, 1),
+    }
+
+
+@contextmanager
+def scratch_database(path):
+    """Point the default alias at a freshly migrated SQLite file for the duration."""
+    conn = connections["default"]
+    old_test = dict(conn.settings_dict.get("TEST") or {})
+    conn.settings_dict["TEST"] = {**old_test, "NAME": path}
+    old_name = conn.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        # Never let catalog signals copy the scratch data into the real replica.
+        with override_settings(CATALOG_REPLICA_ENABLED=False):
+            yield
+    finally:
+        conn.creation.destroy_test_db(old_name, verbosity=0)
+        conn.settings_dict["TEST"] = old_test
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark import_food_data on synthetic CSVs of increasing size against a "
+        "scratch database; fails when SQL queries per row exceed the budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f'Row counts, e.g. "{DEFAULT_SIZES}"')
+        parser.add_argument('--passes', type=int, default=1,
+                            help='Imports per size; passes after the first measure the update path')
+        parser.add_argument('--budget', type=float,
+                            default=getattr(settings, "IMPORT_QUERY_BUDGET_PER_ROW", DEFAULT_QUERY_BUDGET_PER_ROW),
+                            help='Max SQL queries per CSV row')
+        parser.add_argument('--tracemalloc', action='store_true',
+                            help='Report Python peak allocation instead of max RSS (slows the import)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_out', default=None, help='Also write results to this file')
+
+    def handle(self, *args, **opts):
+        try:
+            sizes = [int(s) for s in opts['sizes'].split(",") if s.strip()]
+        except ValueError:
+            raise CommandError("--sizes must be comma-separated integers")
+        if connections["default"].vendor != "sqlite":
+            raise CommandError("bench_import uses a scratch SQLite file; the default database must be SQLite")
+
+        results = []
+        self.stdout.write(f"{'rows':>8}{'pass':>6}{'seconds':>10}{'rows/s':>10}{'queries':>11}{'q/row':>8}{'peak MB':>9}")
+        with tempfile.TemporaryDirectory(prefix="vitaa-bench-") as tmp:
+            for size in sizes:
+                csv_path = os.path.join(tmp, f"dishes_{size}.csv")
+                write_synthetic_csv(csv_path, size, seed=opts['seed'])
+                with scratch_database(os.path.join(tmp, f"bench_{size}.sqlite3")):
+                    for n in range(1, max(1, opts['passes']) + 1):
+                        r = run_import(csv_path, trace_memory=opts['tracemalloc'])
+                        r["pass"] = n
+                        results.append(r)
+                        self.stdout.write(
+                            f"{r['rows']:>8}{n:>6}{r['seconds']:>10.2f}{r['rows_per_s']:>10.1f}"
+                            f"{r['queries']:>11}{r['queries_per_row']:>8.2f}{r['peak_mb']:>9.1f}"
+                        )
+                os.remove(csv_path)
+
+        if opts['json_out']:
+            with open(opts['json_out'], "w", encoding="utf-8") as f:
+                json.dump({"budget_queries_per_row": opts['budget'], "results": results}, f, indent=2)
+
+        over = [r for r in results if r["queries_per_row"] > opts['budget']]
+        if over:
+            worst = max(over, key=lambda r: r["queries_per_row"])
+            raise CommandError(
+                f"query budget exceeded: {worst['queries_per_row']} queries/row "
+                f"(budget {opts['budget']}) at {worst['rows']} rows, pass {worst['pass']}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"All runs within {opts['budget']} queries/row."))
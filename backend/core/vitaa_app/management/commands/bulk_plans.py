@@ -0,0 +1,161 @@
+import csv
+import json
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from vitaa_app import profiles
+from vitaa_app.meal_planner_service import generate_meal_plan
+from vitaa_app.utils import calc_targets
+
+# CSV columns that hold lists ("peanuts;shellfish") or booleans ("false").
+LIST_COLUMNS = ("allergies", "exclude_ingredients", "dislikes")
+BOOL_COLUMNS = ("include_eggs",)
+CHECKPOINT_EVERY = 200
+
+
+def read_profiles(path):
+    """Yield flat profile dicts (same shape as /api/plan/health/ bodies) from .csv or .jsonl."""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                yield _coerce_csv_row(row)
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _coerce_csv_row(row):
+    out = {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
+    for col in LIST_COLUMNS:
+        if col in out:
+            out[col] = [x.strip() for x in (out[col] or "").split(";") if x.strip()]
+    for col in BOOL_COLUMNS:
+        if col in out:
+            out[col] = str(out[col]).lower() not in ("0", "false", "no", "n", "")
+    return out
+
+
+def plan_profile(item):
+    """(row, body) -> one output record. Runs in pool workers."""
+    row, body = item
+    record = {"row": row, "user_id": profiles.norm(body.get("user_id")) or None}
+    try:
+        targets = calc_targets(profiles.targets_profile(body))["targets"]
+        record["targets"] = targets
+        record["plan"] = generate_meal_plan(profiles.planner_goals(body, float(targets["calories_kcal"])))
+    except KeyError as ke:
+        record["error"] = f"missing field: {ke.args[0]}"
+    except Exception as e:
+        record["error"] = str(e)
+    return record
+
+
+def _init_worker():
+    # Under spawn the child starts without Django; under fork it inherits it.
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+class Checkpoint:
+    """
+    `<output>.checkpoint` records how many input rows are in the output and the
+    output size at that point. Resuming truncates anything written after it.
+    """
+
+    def __init__(self, output):
+        self.path = output + ".checkpoint"
+        self.input = None
+        self.rows_done = 0
+        self.offset = 0
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.input, self.rows_done, self.offset = data["input"], data["rows_done"], data["offset"]
+        return True
+
+    def save(self, out_file):
+        out_file.flush()
+        os.fsync(out_file.fileno())
+        self.offset = out_file.tell()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"input": self.input, "rows_done": self.rows_done, "offset": self.offset}, f)
+        os.replace(tmp, self.path)
+
+
+class Command(BaseCommand):
+    help = 'Generate targets and meal plans for a file of profiles (CSV or JSONL) into a JSONL file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', type=str, help='Profiles: .csv (lists as "a;b") or .jsonl')
+        parser.add_argument('output', type=str, help='JSONL output, one record per input row')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Planner processes (0 = plan in this process)')
+        parser.add_argument('--chunk-size', type=int, default=16, help='Profiles handed to a worker at a time')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint and start over')
+
+    def handle(self, *args, **opts):
+        src, output = opts['input'], opts['output']
+        if not os.path.exists(src):
+            raise CommandError(f"input not found: {src}")
+
+        ckpt = Checkpoint(output)
+        resuming = not opts['restart'] and ckpt.load()
+        if resuming and ckpt.input != os.path.abspath(src):
+            raise CommandError(f"{ckpt.path} belongs to {ckpt.input}; use --restart to start over")
+        if resuming and not os.path.exists(output):
+            raise CommandError(f"{ckpt.path} exists but {output} does not; use --restart")
+        if not resuming:
+            ckpt = Checkpoint(output)
+        ckpt.input = os.path.abspath(src)
+
+        out = open(output, "r+" if resuming else "w", encoding="utf-8")
+        if resuming:
+            out.seek(ckpt.offset)
+            out.truncate()
+            self.stdout.write(f"Resuming after {ckpt.rows_done} rows.")
+
+        todo = ((i, body) for i, body in enumerate(read_profiles(src)) if i >= ckpt.rows_done)
+        started = time.perf_counter()
+        planned = errors = 0
+        pool = None
+        try:
+            if opts['workers'] > 0:
+                connections.close_all()  # never share a DB connection across fork
+                pool = multiprocessing.Pool(opts['workers'], initializer=_init_worker)
+                results = pool.imap(plan_profile, todo, chunksize=max(1, opts['chunk_size']))
+            else:
+                results = map(plan_profile, todo)
+
+            # imap keeps input order, so rows_done is always a contiguous prefix.
+            for record in results:
+                out.write(json.dumps(record) + "\n")
+                ckpt.rows_done = record["row"] + 1
+                planned += 1
+                errors += "error" in record
+                if planned % CHECKPOINT_EVERY == 0:
+                    ckpt.save(out)
+            ckpt.save(out)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            out.close()
+
+        elapsed = time.perf_counter() - started
+        rate = planned / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Planned {planned} profiles ({errors} errors) in {elapsed:.1f}s ({rate:.1f}/s); "
+            f"{ckpt.rows_done} rows in {output}."
+        ))
@@ -95,6 +95,7 @@ class Command(BaseCommand):
                         'dish_vi_name': dish_name_vi,
                         'dish_zh_name': dish_name_zh,
                         'ingredients': ingredients,
+                        'ingredients_list': ingredients_list,
                         'veg_class': veg_class,
                         'fat_g': _to_decimal(nutrition.get('fat_g', 0)),
                         'protein_g': _to_decimal(nutrition.get('protein_g', 0)),
@@ -107,14 +108,22 @@ class Command(BaseCommand):
                     # --- allergens ---
                     # CSV might be "wheat" or "wheat, soy" or "['wheat','soy']" or "none"
                     allergens_raw = (row.get('allergens') or '').strip()
-                    # Reset and re-add for clean idempotency
-                    AllergenDish.objects.filter(dish=dish).delete()
+                    allergen_ids = set()
                     if allergens_raw and allergens_raw.lower() != 'none':
                         for name in _parse_list(allergens_raw):
                             if not name:
                                 continue
                             allergen, _ = Allergen.objects.get_or_create(allergen_name=name.lower())
-                            AllergenDish.objects.get_or_create(dish=dish, allergen=allergen)
+                            allergen_ids.add(allergen.pk)
+                    # Sync links for idempotency: drop stale ones, add missing ones
+                    # (unchanged links cost no writes and no allergen_mask updates).
+                    # Read them from default, never from the lagging catalog replica.
+                    linked = set() if created else set(
+                        AllergenDish.objects.using('default').filter(dish=dish).values_list('allergen_id', flat=True))
+                    if linked - allergen_ids:
+                        AllergenDish.objects.filter(dish=dish, allergen_id__in=linked - allergen_ids).delete()
+                    for allergen_id in sorted(allergen_ids - linked):
+                        AllergenDish.objects.create(dish=dish, allergen_id=allergen_id)
 
                     imported_count += 1
 
@@ -0,0 +1,217 @@
+import math
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+# route key -> path (the API routes in core/urls.py)
+ROUTES = {
+    "targets": "/api/nutrition/targets/",
+    "mealplan": "/api/mealplan/",
+    "health": "/api/plan/health/",
+    "webhook": "/api/webhooks/user-profile/",
+}
+DEFAULT_MIX = "targets=2,mealplan=3,health=4,webhook=1"
+_ACTIVITY = ["sedentary", "low", "medium", "high", "very_high"]
+_DIETS = ["any", "vegetarian", "vegan", "non-veg"]
+_GOALS = ["weight loss", "maintenance", "gain"]
+
+
+def _profile(rng):
+    return {
+        "age": rng.randint(18, 70),
+        "sex": rng.choice(["male", "female"]),
+        "height_cm": rng.randint(150, 195),
+        "weight_kg": rng.randint(45, 120),
+    }
+
+
+def make_body(route, rng):
+    """A plausible request body for each route; varied so caches are exercised realistically."""
+    p = _profile(rng)
+    if route == "targets":
+        return {
+            "age": p["age"], "sex": p["sex"], "height_cm": p["height_cm"], "weight_kg": p["weight_kg"],
+            "activity_level": rng.choice(["sedentary", "lightly_active", "moderately_active", "very_active"]),
+        }
+    if route == "mealplan":
+        return {
+            "energy": {"target_kcal": rng.randint(1400, 2800)},
+            "inputs": {
+                "fitness_goal": rng.choice(_GOALS),
+                "diet": {"diet_preference": rng.choice(_DIETS), "include_eggs": rng.random() < 0.8,
+                         "allergies": rng.sample(["peanuts", "shellfish", "milk", "soy"], rng.randint(0, 2))},
+            },
+        }
+    if route == "health":
+        return {
+            **p,
+            "waist_cm": rng.randint(60, 120),
+            "activity_frequency": rng.choice(_ACTIVITY),
+            "allergies": rng.sample(["peanuts", "shellfish", "milk", "soy"], rng.randint(0, 2)),
+            "diet_preference": rng.choice(_DIETS),
+            "include_eggs": rng.random() < 0.8,
+            "fitness_goal": rng.choice(_GOALS),
+        }
+    return {
+        "Age": p["age"], "Sex": p["sex"].title(),
+        "FamilyHistory": {"Diabetes": rng.choice(["Yes", "No"]), "Hypertension": rng.choice(["Yes", "No"])},
+        "WeightKg": p["weight_kg"], "HeightCm": p["height_cm"],
+        "WaistCircumferenceCm": rng.randint(60, 120),
+        "ActivityLevel": rng.choice(["Low", "Medium", "High"]),
+        "Smoking": rng.choice(["Yes", "No"]),
+        "AlcoholConsumption": rng.choice(["None", "Occasional", "Regular"]),
+    }
+
+
+def parse_mix(raw):
+    mix = {}
+    for part in raw.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise CommandError(f"unknown route '{name}'; use: {', '.join(ROUTES)}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise CommandError("--mix needs at least one route with a positive weight")
+    return mix
+
+
+def percentile(sorted_vals, pct):
+    """Nearest-rank percentile: the smallest value with at least pct% of the values at or below it."""
+    if not sorted_vals:
+        return 0.0
+    rank = math.ceil(round(pct / 100.0 * len(sorted_vals), 9))  # round: 0.95 * 100 is 95.00000000000001
+    return sorted_vals[min(len(sorted_vals), max(1, rank)) - 1]
+
+
+def send_times(start, duration, rate):
+    """Open-loop schedule: when each request is due, every 1/rate s from start, before start + duration."""
+    i = 0
+    while i / rate < duration:
+        yield start + i / rate  # from i, not by accumulating the interval, so rounding does not drift
+        i += 1
+
+
+class _Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)  # route -> [ms]
+        self.outcomes = defaultdict(Counter)  # route -> Counter(status or exception)
+        self.in_flight = 0
+        self.queued = 0  # open loop: due while --max-in-flight requests were already running
+
+    def add(self, route, ms, outcome):
+        with self.lock:
+            self.latencies[route].append(ms)
+            self.outcomes[route][outcome] += 1
+            self.in_flight -= 1
+
+    def due(self, max_in_flight):
+        with self.lock:
+            if self.in_flight >= max_in_flight:
+                self.queued += 1
+            self.in_flight += 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Send mixed traffic to the API at a target rate (open loop) or concurrency "
+        "(closed loop) and report throughput, latency percentiles and errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds to send traffic')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Requests/s to start (open loop); overrides --concurrency')
+        parser.add_argument('--concurrency', type=int, default=10, help='Closed-loop client count')
+        parser.add_argument('--max-in-flight', type=int, default=200, help='Thread cap in open-loop mode')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Route weights, e.g. "{DEFAULT_MIX}"')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Client timeout per request (s)')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **opts):
+        mix = parse_mix(opts['mix'])
+        names, weights = list(mix), list(mix.values())
+        base = opts['base_url'].rstrip('/')
+        timeout = opts['timeout']
+        rec = _Recorder()
+        local = threading.local()
+        seed_rng = random.Random(opts['seed'])
+        seed_lock = threading.Lock()
+
+        def rng():
+            if not hasattr(local, "rng"):
+                with seed_lock:
+                    local.rng = random.Random(seed_rng.random())
+                local.session = requests.Session()
+            return local.rng
+
+        def fire(due_at=None):
+            r = rng()
+            route = r.choices(names, weights)[0]
+            body = make_body(route, r)
+            # Open loop: time from when the request was due, so waiting for a
+            # free thread counts (no coordinated omission under overload).
+            t0 = time.perf_counter() if due_at is None else due_at
+            try:
+                resp = local.session.post(base + ROUTES[route], json=body, timeout=timeout)
+                outcome = resp.status_code
+            except requests.RequestException as e:
+                outcome = type(e).__name__
+            rec.add(route, (time.perf_counter() - t0) * 1000.0, outcome)
+
+        started = time.perf_counter()
+        deadline = started + opts['duration']
+
+        if opts['rate']:
+            with ThreadPoolExecutor(max_workers=opts['max_in_flight']) as pool:
+                for due_at in send_times(started, opts['duration'], opts['rate']):
+                    time.sleep(max(0.0, due_at - time.perf_counter()))
+                    rec.due(opts['max_in_flight'])
+                    pool.submit(fire, due_at)
+            mode = f"open loop @ {opts['rate']:g} req/s"
+        else:
+            def client():
+                while time.perf_counter() < deadline:
+                    rec.due(opts['concurrency'])
+                    fire()
+            threads = [threading.Thread(target=client) for _ in range(opts['concurrency'])]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            mode = f"closed loop x {opts['concurrency']}"
+
+        self._report(rec, time.perf_counter() - started, mode)
+
+    def _report(self, rec, elapsed, mode):
+        total = sum(len(v) for v in rec.latencies.values())
+        self.stdout.write(f"{mode}: {total} requests in {elapsed:.1f}s -> {total / elapsed:.1f} req/s")
+        self.stdout.write(f"{'route':<10}{'count':>7}{'ok%':>7}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}  errors")
+        for route in ROUTES:
+            lat = sorted(rec.latencies.get(route, []))
+            if not lat:
+                continue
+            outcomes = rec.outcomes[route]
+            ok = sum(n for o, n in outcomes.items() if isinstance(o, int) and o < 400)
+            errors = ", ".join(f"{o}x{n}" for o, n in sorted(outcomes.items(), key=str)
+                               if not (isinstance(o, int) and o < 400)) or "-"
+            self.stdout.write(
+                f"{route:<10}{len(lat):>7}{100.0 * ok / len(lat):>6.1f}%"
+                + "".join(f"{percentile(lat, p):>9.1f}" for p in (50, 90, 95, 99))
+                + f"{lat[-1]:>9.1f}  {errors}"
+            )
+        self.stdout.write("(latencies in ms)")
+        if rec.queued:
+            self.stdout.write(
+                f"{rec.queued} of {total} requests were due while --max-in-flight requests were running; "
+                "they waited for a thread, and that wait is part of their latency. "
+                "The server is not keeping up with this rate.")
@@ -0,0 +1,114 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class _StubConfig:
+    def __init__(self, latency_ms, jitter_ms, error_rate, payload_bytes, seed=None, reject_batches=False):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.payload_bytes = payload_bytes
+        self.reject_batches = reject_batches
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.served = 0
+        self.failed = 0
+        self.batched = 0  # payloads that arrived inside {"batch": [...]}
+
+
+def _make_handler(cfg):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass  # keep stdout for the summary line
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+
+            with cfg.lock:
+                delay = max(0.0, cfg.latency_ms + cfg.rng.uniform(-cfg.jitter_ms, cfg.jitter_ms))
+                fail = cfg.rng.random() < cfg.error_rate
+            time.sleep(delay / 1000.0)
+
+            try:
+                received = json.loads(raw or b"{}")
+            except ValueError:
+                received = None
+            batch = received.get("batch") if isinstance(received, dict) else None
+            batched = 0
+
+            if fail:
+                status = 503
+                body = {"error": "stub failure"}
+            elif isinstance(batch, list):
+                if cfg.reject_batches:
+                    status = 400
+                    body = {"error": "batches not supported"}
+                else:
+                    status = 200
+                    body = {"results": [self._analysis(item) for item in batch]}
+                    batched = len(batch)
+            else:
+                status = 200
+                body = self._analysis(received)
+            data = json.dumps(body).encode("utf-8")
+
+            with cfg.lock:
+                cfg.served += 1
+                cfg.failed += int(fail)
+                cfg.batched += batched
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _analysis(self, received):
+            return {
+                "status": "ok",
+                "echo_keys": sorted(received) if isinstance(received, dict) else [],
+                "analysis": "x" * cfg.payload_bytes,
+            }
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local stand-in for the n8n health-analysis webhook with configurable "
+        "latency, error rate and response size. Point N8N_WEBHOOK_URL at it for load tests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=800.0, help='Mean response delay')
+        parser.add_argument('--jitter-ms', type=float, default=200.0, help='Uniform +/- jitter on the delay')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+        parser.add_argument('--payload-bytes', type=int, default=512, help='Size of the fake analysis text')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--reject-batches', action='store_true',
+                            help='Answer {"batch": [...]} calls with 400 (exercises the single-call fallback)')
+
+    def handle(self, *args, **opts):
+        cfg = _StubConfig(opts['latency_ms'], opts['jitter_ms'], opts['error_rate'],
+                          opts['payload_bytes'], seed=opts['seed'], reject_batches=opts['reject_batches'])
+
+        server = ThreadingHTTPServer((opts['host'], opts['port']), _make_handler(cfg))
+        server.daemon_threads = True
+        url = f"http://{opts['host']}:{server.server_address[1]}/webhook/health_analysis_openai"
+        self.stdout.write(self.style.SUCCESS(f"n8n stub listening on {url}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {cfg.served} requests ({cfg.failed} failed, {cfg.batched} payloads in batches).")
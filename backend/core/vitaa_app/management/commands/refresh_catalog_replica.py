@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from vitaa_app.db_routers import refresh_catalog_replica
+
+
+class Command(BaseCommand):
+    help = 'Copy the default database into the read-only catalog replica.'
+
+    def handle(self, *args, **kwargs):
+        if refresh_catalog_replica():
+            self.stdout.write(self.style.SUCCESS("Catalog replica refreshed."))
+        else:
+            self.stdout.write("No catalog replica configured (CATALOG_REPLICA_ENABLED / DATABASES['catalog']).")
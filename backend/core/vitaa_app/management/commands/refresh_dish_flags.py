@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from vitaa_app import catalog
+from vitaa_app.db_routers import schedule_replica_refresh
+from vitaa_app.models import AllergenDish, CatalogChange, Dish, allergen_mask
+
+FLAG_FIELDS = ['protein_density', 'is_banned', 'is_main', 'is_side', 'allergen_mask']
+
+
+@transaction.atomic
+def refresh_planner_flags() -> int:
+    """Recompute every dish's derived columns under the current knobs; returns how many changed."""
+    links = {}
+    for dish_id, allergen_id in AllergenDish.objects.values_list('dish_id', 'allergen_id'):
+        links.setdefault(dish_id, []).append(allergen_id)
+
+    changed = []
+    for dish in Dish.objects.all().iterator(chunk_size=2000):
+        mask = allergen_mask(links.get(dish.dish_id, ()))
+        if dish.refresh_flags() | (mask != dish.allergen_mask):
+            dish.allergen_mask = mask
+            changed.append(dish)
+
+    if changed:
+        # bulk_update sends no signals: log the changes like signals.py would.
+        Dish.objects.bulk_update(changed, FLAG_FIELDS, batch_size=500)
+        CatalogChange.objects.bulk_create(
+            [CatalogChange(dish_id=d.dish_id, op=CatalogChange.UPSERT) for d in changed], batch_size=500)
+        transaction.on_commit(catalog.invalidate_version)
+        schedule_replica_refresh()
+    return len(changed)
+
+
+class Command(BaseCommand):
+    help = 'Recompute the derived planner columns of every dish (after the classification rules change).'
+
+    def handle(self, *args, **kwargs):
+        changed = refresh_planner_flags()
+        self.stdout.write(self.style.SUCCESS(f"Updated planner flags of {changed} dishes."))
@@ -0,0 +1,224 @@
+import itertools
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+
+from vitaa_app import catalog, profiles
+from vitaa_app.db_routers import default_database_uri
+from vitaa_app.management.commands.bulk_plans import read_profiles
+from vitaa_app.management.commands.loadtest import make_body, percentile
+from vitaa_app.management.commands.refresh_dish_flags import refresh_planner_flags
+from vitaa_app.meal_planner_service import CLASSIFICATION_KNOBS, KNOB_NAMES, generate_meal_plan, validate_knobs
+from vitaa_app.utils import calc_targets
+
+MACROS = (("protein_g", "Protein_g"), ("fat_g", "Fat_g"), ("carbs_g", "Carbs_g"))
+# (metric, +1 minimize / -1 maximize) for the Pareto front.
+OBJECTIVES = (("failures", 1), ("kcal_dev_pct", 1), ("macro_dev_pct", 1), ("variety", -1),
+              ("p95_ms", 1), ("cpu_ms", 1))
+
+
+def parse_knob(raw):
+    """'NAME=v1,v2' -> (NAME, [values]); values are JSON scalars."""
+    name, sep, values = raw.partition("=")
+    name = name.strip()
+    if not sep or name not in KNOB_NAMES:
+        raise CommandError(f"--knob expects NAME=v1,v2 with NAME one of: {', '.join(KNOB_NAMES)}")
+    try:
+        return name, [json.loads(v) for v in values.split(",") if v.strip()]
+    except ValueError:
+        raise CommandError(f"--knob {name}: values must be JSON scalars")
+
+
+def build_grid(axes):
+    """{name: [values]} -> list of override dicts (cartesian product)."""
+    names = list(axes)
+    return [dict(zip(names, combo)) for combo in itertools.product(*(axes[n] for n in names))]
+
+
+def make_cases(bodies):
+    """Flat profiles -> (targets, goals) with a fixed seed per case, so configs see the same random draws."""
+    cases = []
+    for i, body in enumerate(bodies):
+        body = {k: v for k, v in body.items() if k != "user_id"}  # no history: runs must not affect each other
+        targets = calc_targets(profiles.targets_profile(body))["targets"]
+        goals = profiles.planner_goals(body, float(targets["calories_kcal"]))
+        goals["seed"] = i
+        cases.append((targets, goals))
+    return cases
+
+
+def plan_quality(targets, plan):
+    """(kcal deviation %, mean protein/fat/carb deviation %) of a plan's totals from calc_targets."""
+    kcal = sum(m["Calories"] for m in plan)
+    kcal_dev = abs(kcal - targets["calories_kcal"]) / targets["calories_kcal"] * 100
+    macro_dev = sum(abs(sum(m[p] for m in plan) - targets[t]) / targets[t] * 100 if targets[t] else 0.0
+                    for t, p in MACROS) / len(MACROS)
+    return kcal_dev, macro_dev
+
+
+@contextmanager
+def copied_database(path):
+    """Point the default alias at a copy of the default database (SQLite backup into `path`) for the duration."""
+    src = sqlite3.connect(default_database_uri(), uri=True)
+    dst = sqlite3.connect(path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    original = connections["default"]
+    scratch = original.__class__({**original.settings_dict, "NAME": path}, "default")
+    connections["default"] = scratch
+    catalog.reset()
+    try:
+        # The replica holds the real catalog, not the copy's flags.
+        with override_settings(CATALOG_REPLICA_ENABLED=False):
+            yield
+    finally:
+        scratch.close()
+        connections["default"] = original
+        catalog.reset()
+
+
+def evaluate(cases, overrides, repeat=3, refresh_flags=False):
+    """
+    Plan every case under PLANNER_KNOBS=overrides: one untimed warm-up pass
+    (pools, combo indexes), then `repeat` timed passes. Quality comes from
+    the last pass. With refresh_flags the stored Dish flags are recomputed
+    for these knobs first (callers run this on a copy of the database).
+    """
+    with override_settings(PLANNER_KNOBS=overrides):
+        if refresh_flags:
+            refresh_planner_flags()
+        catalog.reset()
+
+        def run():
+            out = []
+            for targets, goals in cases:
+                wall, cpu = time.perf_counter(), time.process_time()
+                try:
+                    plan = generate_meal_plan(goals)
+                except ValueError:
+                    plan = None
+                out.append((plan, (time.perf_counter() - wall) * 1000.0, (time.process_time() - cpu) * 1000.0))
+            return out
+
+        run()
+        passes = [run() for _ in range(max(1, repeat))]
+
+    latencies = sorted(ms for p in passes for _, ms, _ in p)
+    cpu_ms = [c for p in passes for _, _, c in p]
+    last = passes[-1]
+    quality = [plan_quality(targets, plan) for (targets, _), (plan, _, _) in zip(cases, last) if plan]
+    served = [d["dish_name"] for plan, _, _ in last if plan for m in plan for d in m["Dishes"]]
+    return {
+        "knobs": overrides,
+        "plans": len(cases),
+        "failures": sum(1 for plan, _, _ in last if plan is None),
+        "kcal_dev_pct": round(sum(q[0] for q in quality) / len(quality), 2) if quality else None,
+        "macro_dev_pct": round(sum(q[1] for q in quality) / len(quality), 2) if quality else None,
+        "variety": round(len(set(served)) / len(served), 3) if served else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "cpu_ms": round(sum(cpu_ms) / len(cpu_ms), 2) if cpu_ms else 0.0,
+    }
+
+
+def pareto_front(results, objectives=OBJECTIVES):
+    """Indices of results no other result dominates (at least as good everywhere, better somewhere)."""
+    def vec(r):
+        return [sign * (r[key] if r[key] is not None else float("inf")) for key, sign in objectives]
+
+    vecs = [vec(r) for r in results]
+    return [i for i, v in enumerate(vecs)
+            if not any(all(a <= b for a, b in zip(w, v)) and w != v for w in vecs)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Plan a fixed profile set under a grid of planner knob settings and report plan quality "
+        "(kcal/macro deviation from calc_targets, variety) against latency and CPU, marking the Pareto front."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--knob', action='append', default=[], metavar='NAME=v1,v2',
+                            help='A knob axis, e.g. RANDOM_TOPK=1,5,10 (repeatable)')
+        parser.add_argument('--grid', default=None, help='JSON file {"KNOB": [values, ...]} (merged with --knob)')
+        parser.add_argument('--profiles', default=None,
+                            help='.csv/.jsonl of /api/plan/health/ bodies (default: synthetic, see --count)')
+        parser.add_argument('--count', type=int, default=40, help='Synthetic profiles when --profiles is not given')
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--repeat', type=int, default=3, help='Timed passes per setting')
+        parser.add_argument('--json', dest='json_out', default=None, help='Also write results to this file')
+
+    def handle(self, *args, **opts):
+        axes = {}
+        if opts['grid']:
+            with open(opts['grid'], encoding="utf-8") as f:
+                axes.update(json.load(f))
+        axes.update(parse_knob(raw) for raw in opts['knob'])
+        unknown = set(axes) - set(KNOB_NAMES)
+        if unknown:
+            raise CommandError("unknown knobs: " + ", ".join(sorted(unknown)))
+        grid = build_grid(axes) if axes else [{}]
+        try:
+            for overrides in grid:
+                validate_knobs(overrides)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        if connections["default"].vendor != "sqlite":
+            raise CommandError("sweep_planner runs on a scratch SQLite copy; the default database must be SQLite")
+
+        if opts['profiles']:
+            bodies = list(read_profiles(opts['profiles']))
+        else:
+            rng = random.Random(opts['seed'])
+            bodies = [make_body("health", rng) for _ in range(opts['count'])]
+        try:
+            cases = make_cases(bodies)
+        except (KeyError, ValueError) as e:
+            raise CommandError(f"bad profile: {e}")
+
+        # Everything runs on a scratch copy of the database: classification
+        # knobs rewrite the stored Dish flags per setting, and holding the
+        # real database's write lock for the whole sweep would block imports,
+        # admin edits and job updates.
+        refresh_flags = bool(CLASSIFICATION_KNOBS & set(axes))
+        self.stdout.write(f"{len(grid)} settings x {len(cases)} profiles x {opts['repeat']} passes")
+        results = []
+        with tempfile.TemporaryDirectory(prefix="vitaa-sweep-") as tmp:
+            with copied_database(os.path.join(tmp, "sweep.sqlite3")):
+                for overrides in grid:
+                    results.append(evaluate(cases, overrides, opts['repeat'], refresh_flags))
+
+        front = set(pareto_front(results))
+        for i, r in enumerate(results):
+            r["pareto"] = i in front
+        self._report(results)
+        if opts['json_out']:
+            with open(opts['json_out'], "w", encoding="utf-8") as f:
+                json.dump({"profiles": len(cases), "repeat": opts['repeat'], "results": results}, f, indent=2)
+
+    def _report(self, results):
+        def num(v):
+            return "-" if v is None else f"{v:.2f}"
+
+        self.stdout.write(f"  {'kcal%':>7}{'macro%':>8}{'variety':>8}{'p50 ms':>8}{'p95 ms':>8}{'cpu ms':>8}"
+                          f"{'fails':>6}  knobs")
+        for r in results:
+            label = " ".join(f"{k}={json.dumps(v)}" for k, v in r["knobs"].items()) or "(defaults)"
+            self.stdout.write(
+                f"{'*' if r['pareto'] else ' '} {num(r['kcal_dev_pct']):>7}{num(r['macro_dev_pct']):>8}"
+                f"{r['variety']:>8.3f}{r['p50_ms']:>8.2f}{r['p95_ms']:>8.2f}{r['cpu_ms']:>8.2f}"
+                f"{r['failures']:>6}  {label}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"{sum(r['pareto'] for r in results)} settings on the Pareto front (*)."))
@@ -1,16 +1,26 @@
 # vitaa_app/meal_planner_service.py
-import json
-import ast
-import random
-from itertools import combinations
-from typing import Dict, List
+import threading
+import time
+from typing import Dict, List, Optional
 
 import numpy as np
 import pandas as pd
-
-from vitaa_app.models import Dish, AllergenDish
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F, Q
+
+from vitaa_app import catalog
+from vitaa_app import dish_history
+from vitaa_app import memory
+from vitaa_app.combo_index import ComboIndex
+from vitaa_app.macro_index import MACRO_COLUMNS
+from vitaa_app.models import ALLERGEN_MASK_BITS, Dish, allergen_bit, allergen_ids_matching, allergen_mask
+from vitaa_app.profiles import term_list
 
 # ---------- KNOBS ----------
+# Defaults; a deployment overrides any of them by name in settings.PLANNER_KNOBS
+# (see knobs()). CLASSIFICATION_KNOBS feed the stored Dish flags: run
+# `manage.py refresh_dish_flags` after changing them.
 MEAL_SPLIT = {"Breakfast": 0.30, "Lunch": 0.40, "Dinner": 0.30}
 MAX_ITEMS_PER_MEAL = 3
 MIN_CAL_PER_DISH = 120
@@ -23,6 +33,18 @@ WEIGHT_LOSS_FAT_PENALTY = 0.6
 MAINT_FAT_PENALTY = 0.25
 PROTEIN_BONUS = 0.15
 RANDOM_TOPK = 5
+COMBO_KCAL_WINDOW = 60.0     # initial +/- kcal window scored around a meal target
+COMBO_MAX_PAIR_SIDES = 400   # two-side sets are enumerated over at most this many sides
+COMBO_SETS_PER_MAIN = 8      # side sets scored per main on each side of the exact kcal fit
+
+KNOB_NAMES = (
+    "MEAL_SPLIT", "MAX_ITEMS_PER_MEAL", "MIN_CAL_PER_DISH", "SIDE_MAX_KCAL", "MAIN_MIN_KCAL",
+    "MAIN_MIN_PROTEIN_G", "MAIN_MIN_PROT_DENS", "FAT_BOMB_RATIO", "WEIGHT_LOSS_FAT_PENALTY",
+    "MAINT_FAT_PENALTY", "PROTEIN_BONUS", "RANDOM_TOPK", "COMBO_KCAL_WINDOW", "COMBO_MAX_PAIR_SIDES",
+    "COMBO_SETS_PER_MAIN",
+)
+CLASSIFICATION_KNOBS = frozenset({"SIDE_MAX_KCAL", "MAIN_MIN_KCAL", "MAIN_MIN_PROTEIN_G", "MAIN_MIN_PROT_DENS",
+                                  "FAT_BOMB_RATIO"})
 
 # ---------- BANNED KEYWORDS ----------
 ALCOHOL_WORDS = {
@@ -39,22 +61,36 @@ DESSERT_SWEET_WORDS = {
 BANNED_NAME_KEYWORDS = ALCOHOL_WORDS | BEVERAGE_WORDS | DESSERT_SWEET_WORDS
 
 
-# ---------- HELPERS ----------
-def parse_list_cell(cell):
-    """Parse an ingredients cell that may be JSON list or comma-separated text."""
-    if isinstance(cell, list):
-        return cell
-    try:
-        v = ast.literal_eval(cell)
-        if isinstance(v, list):
-            return v
-        if isinstance(v, str) and v:
-            return [s.strip() for s in v.split(",") if s.strip()]
-    except Exception:
-        pass
-    return [s.strip() for s in str(cell or "").split(",") if s.strip()]
+def _is_number(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def validate_knobs(overrides: Dict):
+    """Raise ImproperlyConfigured unless every override names a knob and has its default's type."""
+    unknown = set(overrides) - set(KNOB_NAMES)
+    if unknown:
+        raise ImproperlyConfigured("unknown PLANNER_KNOBS: " + ", ".join(sorted(unknown)))
+    for name, value in overrides.items():
+        default = globals()[name]
+        if isinstance(default, dict):
+            ok = isinstance(value, dict) and value and all(_is_number(v) for v in value.values())
+        elif isinstance(default, int):
+            ok = isinstance(value, int) and not isinstance(value, bool)
+        else:
+            ok = _is_number(value)
+        if not ok:
+            raise ImproperlyConfigured(f"PLANNER_KNOBS[{name!r}] = {value!r}: expected {type(default).__name__} "
+                                       f"like the default {default!r}")
+
 
+def knobs() -> Dict:
+    """The module defaults above with settings.PLANNER_KNOBS applied."""
+    overrides = getattr(settings, "PLANNER_KNOBS", None) or {}
+    validate_knobs(overrides)
+    return {name: overrides.get(name, globals()[name]) for name in KNOB_NAMES}
 
+
+# ---------- HELPERS ----------
 def to_num(df, cols):
     for c in cols:
         df[c] = pd.to_numeric(df[c], errors="coerce")
@@ -79,103 +115,125 @@ def is_banned_row(row):
     return False
 
 
-def score_combo(rows, kcal_target, weight_loss=False):
-    cal = sum(float(r["calories_kcal"]) for r in rows)
-    prot = sum(float(r["protein_g"]) for r in rows)
-    fat = sum(float(r["fat_g"]) for r in rows)
-    carbs = sum(float(r["carbohydrate_g"]) for r in rows)
-    cal_diff = abs(cal - kcal_target)
-    fat_pen = (WEIGHT_LOSS_FAT_PENALTY if weight_loss else MAINT_FAT_PENALTY) * fat
-    prot_boost = PROTEIN_BONUS * prot
-    score = cal_diff + fat_pen - prot_boost
-    return score, cal, prot, fat, carbs
-
-
-def is_main(row):
+def is_main(row, k=None):
+    k = knobs() if k is None else k
     if is_banned_row(row):
         return False
     kcal = float(row["calories_kcal"])
     prot = float(row["protein_g"])
     fat = float(row["fat_g"])
     carbs = float(row["carbohydrate_g"])
-    if kcal < MAIN_MIN_KCAL:
+    if kcal < k["MAIN_MIN_KCAL"]:
         return False
     pdens = (prot / kcal) * 100 if kcal > 0 else 0
-    if prot < MAIN_MIN_PROTEIN_G and pdens < MAIN_MIN_PROT_DENS:
+    if prot < k["MAIN_MIN_PROTEIN_G"] and pdens < k["MAIN_MIN_PROT_DENS"]:
         return False
-    if fat > FAT_BOMB_RATIO * prot and carbs < 20:
+    if fat > k["FAT_BOMB_RATIO"] * prot and carbs < 20:
         return False
-    if kcal < MIN_CAL_PER_DISH:
+    if kcal < k["MIN_CAL_PER_DISH"]:
         return False
     return True
 
 
-def is_side(row):
+def is_side(row, k=None):
+    k = knobs() if k is None else k
     if is_banned_row(row):
         return False
     kcal = float(row["calories_kcal"])
     name = str(row.get("dish_name") or "").lower()
-    if kcal <= SIDE_MAX_KCAL:
+    if kcal <= k["SIDE_MAX_KCAL"]:
         return True
     if ("nut" in name or "seed" in name):
         return True
     return False
 
 
+def dish_flags(dish_name, calories_kcal, protein_g, fat_g, carbohydrate_g) -> Dict:
+    """The derived Dish columns (see models.Dish.refresh_flags) for one dish."""
+    row = {
+        "dish_name": dish_name,
+        "calories_kcal": float(calories_kcal or 0),
+        "protein_g": float(protein_g or 0),
+        "fat_g": float(fat_g or 0),
+        "carbohydrate_g": float(carbohydrate_g or 0),
+    }
+    kcal = row["calories_kcal"]
+    k = knobs()
+    return {
+        "protein_density": round(row["protein_g"] / kcal * 100, 3) if kcal > 0 else 0.0,
+        "is_banned": is_banned_row(row),
+        "is_main": is_main(row, k),
+        "is_side": is_side(row, k),
+    }
+
+
 def detect_allergens(allergen_str, blocklist_lower):
     s = str(allergen_str or "").lower()
     return any(a in s for a in blocklist_lower)
 
 
-def choose_meal(main_df, side_df, kcal_target, weight_loss, used_names, randomness_topk=RANDOM_TOPK):
-    mains = main_df[~main_df["dish_name"].fillna("").isin(used_names)].copy()
-    sides = side_df[~side_df["dish_name"].fillna("").isin(used_names)].copy()
+def _combo_scores(cal, prot, fat, kcal_target, weight_loss, k):
+    """Kcal distance + fat penalty - protein bonus over arrays of combo totals (lower is better)."""
+    fat_pen = (k["WEIGHT_LOSS_FAT_PENALTY"] if weight_loss else k["MAINT_FAT_PENALTY"]) * fat
+    return np.abs(cal - kcal_target) + fat_pen - k["PROTEIN_BONUS"] * prot
 
-    if mains.empty and not main_df.empty:
-        mains = main_df.copy()
-    if sides.empty and not side_df.empty:
-        sides = side_df.copy()
-    if mains.empty:
-        return ["No suitable dishes"], {"calories": 0, "Protein_g": 0, "Fat_g": 0, "Carbs_g": 0}
-
-    mains = mains.sample(frac=1, random_state=np.random.randint(0, 1_000_000)).reset_index(drop=True)
-    sides = sides.sample(frac=1, random_state=np.random.randint(0, 1_000_000)).reset_index(drop=True)
-
-    combos = []
-    # 1 item (main only)
-    for i in range(min(len(mains), 20)):
-        rows = [mains.iloc[i]]
-        combos.append((score_combo(rows, kcal_target, weight_loss), rows))
-    # 2 items (main + side)
-    for i in range(min(len(mains), 20)):
-        for j in range(min(len(sides), 30)):
-            rows = [mains.iloc[i], sides.iloc[j]]
-            if len({str(r["dish_name"]) for r in rows}) < len(rows):
-                continue
-            combos.append((score_combo(rows, kcal_target, weight_loss), rows))
-    # 3 items (main + 2 sides)
-    for i in range(min(len(mains), 15)):
-        for j, k in combinations(range(min(len(sides), 30)), 2):
-            rows = [mains.iloc[i], sides.iloc[j], sides.iloc[k]]
-            if len({str(r["dish_name"]) for r in rows}) < len(rows):
-                continue
-            combos.append((score_combo(rows, kcal_target, weight_loss), rows))
-
-    if not combos:
-        return ["No suitable dishes"], {"calories": 0, "Protein_g": 0, "Fat_g": 0, "Carbs_g": 0}
-
-    combos.sort(key=lambda x: x[0][0])
-    topk = min(randomness_topk, len(combos))
-    chosen_score, best_rows = random.choice(combos[:topk])
-    score, cal, prot, fat, carbs = chosen_score
-    names = [str(r["dish_name"]) for r in best_rows]
-
-    return names, {
-        "calories": round(cal, 1),
-        "Protein_g": round(prot, 1),
-        "Fat_g": round(fat, 1),
-        "Carbs_g": round(carbs, 1),
-    }
+
+def _macro_arrays(df):
+    return tuple(df[c].to_numpy(dtype=float) for c in ("calories_kcal", "protein_g", "fat_g", "carbohydrate_g"))
+
+
+def choose_meal(pool, kcal_target, weight_loss, used_ids, main_ok=None, side_ok=None,
+                randomness_topk=None, deadline=None, rng: Optional[np.random.Generator] = None, k=None):
+    """
+    Pick a meal near kcal_target: one main plus up to two sides (fewer when
+    MAX_ITEMS_PER_MEAL is lower) from the pool's combo index, over every
+    allowed main and side. Dishes in used_ids are skipped unless nothing else
+    is left. Past `deadline` the best combos found so far are used. The pick
+    among the top combos draws only from `rng` (no global random state).
+    `k`: knobs() to use. Returns (dish_ids, totals, search_complete).
+    """
+    k = knobs() if k is None else k
+    randomness_topk = k["RANDOM_TOPK"] if randomness_topk is None else randomness_topk
+    rng = np.random.default_rng() if rng is None else rng
+    index = pool.combos
+    main_ok = np.ones(len(index.main_ids), dtype=bool) if main_ok is None else main_ok
+    side_ok = np.ones(len(index.side_ids), dtype=bool) if side_ok is None else side_ok
+    used = np.fromiter(used_ids, dtype=np.int64)
+    m_ok = main_ok & ~np.isin(index.main_ids, used)
+    s_ok = side_ok & ~np.isin(index.side_ids, used)
+    if not m_ok.any():
+        m_ok = main_ok
+    if not s_ok.any():
+        s_ok = side_ok
+
+    def score(totals):
+        return _combo_scores(totals[:, 0], totals[:, 1], totals[:, 2], kcal_target, weight_loss, k)
+
+    scores = np.empty(0)
+    complete = True
+    # Without used dishes first; if no combo qualifies, with them.
+    for mains_ok, sides_ok in ((m_ok, s_ok), (main_ok, side_ok)):
+        if not mains_ok.any():
+            continue
+        scores, m, side_j, side_k, complete = index.query(
+            kcal_target, score, mains_ok, sides_ok, want=max(1, randomness_topk), window=k["COMBO_KCAL_WINDOW"],
+            deadline=deadline, per_main=k["COMBO_SETS_PER_MAIN"], max_sides=max(0, k["MAX_ITEMS_PER_MEAL"] - 1))
+        if len(scores):
+            break
+    if not len(scores):
+        return [], {"calories": 0, "Protein_g": 0, "Fat_g": 0, "Carbs_g": 0}, complete
+
+    pick = int(rng.integers(len(scores)))
+    slots = [x for x in (side_j[pick], side_k[pick]) if x < len(index.side_ids)]
+    dish_ids = [int(index.main_ids[m[pick]])] + [int(index.side_ids[x]) for x in slots]
+    cal, prot, fat, carbs = index.main_mac[m[pick]] + index.side_mac[side_j[pick]] + index.side_mac[side_k[pick]]
+
+    return dish_ids, {
+        "calories": round(float(cal), 1),
+        "Protein_g": round(float(prot), 1),
+        "Fat_g": round(float(fat), 1),
+        "Carbs_g": round(float(carbs), 1),
+    }, complete
 
 
 def _sum_macros(rows_df: pd.DataFrame) -> Dict[str, float]:
@@ -191,81 +249,246 @@ def _sum_macros(rows_df: pd.DataFrame) -> Dict[str, float]:
 
 
 # ---------- DATA LOAD ----------
-def _load_dishes_from_db() -> pd.DataFrame:
-    """
-    Pulls dishes + allergens from the DB and returns a DataFrame
-    aligned to the old CSV shape, now including localized names.
-    """
-    base = list(Dish.objects.values(
-        "dish_id",
-        "dish_name",
-        "dish_ms_name",
-        "dish_vi_name",
-        "dish_zh_name",
-        "veg_class",
-        "ingredients",
-        "calories_kcal",
-        "protein_g",
-        "fat_g",
-        "carbohydrate_g",
-        "image_url",
-    ))
-
-    ad = (AllergenDish.objects
-          .select_related("allergen", "dish")
-          .values("dish_id", "allergen__allergen_name"))
-
-    allergen_map = {}
-    for row in ad:
-        d = row["dish_id"]
-        allergen_map.setdefault(d, []).append((row["allergen__allergen_name"] or "").strip().lower())
-
-    def _parse_ingredients(raw):
-        if not raw:
-            return []
-        try:
-            temp = json.loads(raw)
-            if isinstance(temp, list):
-                return temp
-            if isinstance(temp, str) and temp:
-                return [s.strip() for s in temp.split(",") if s.strip()]
-        except Exception:
-            pass
-        return [s.strip() for s in str(raw).split(",") if s.strip()]
-
-    records = []
-    for r in base:
-        allergens = ", ".join(allergen_map.get(r["dish_id"], []))
-        ingredients_list = _parse_ingredients(r.get("ingredients"))
-
-        records.append({
-            "dish_name": r["dish_name"],
-            "dish_ms_name": r.get("dish_ms_name"),
-            "dish_vi_name": r.get("dish_vi_name"),
-            "dish_zh_name": r.get("dish_zh_name"),
-            "diet_class": r["veg_class"],
-            "ingredients": json.dumps(ingredients_list),
-            "allergens": allergens,
-            "calories_kcal": r["calories_kcal"],
-            "protein_g": r["protein_g"],
-            "fat_g": r["fat_g"],
-            "carbohydrate_g": r["carbohydrate_g"],
-            "image_url": r.get("image_url"),
-        })
-
-    df = pd.DataFrame.from_records(records)
+def _frame_from_records(records) -> pd.DataFrame:
+    """catalog.dish_values_with_allergens() rows -> planner DataFrame."""
+    df = pd.DataFrame.from_records(list(records))
     if df.empty:
         return df
 
+    df = df.rename(columns={"veg_class": "diet_class"})
+    df["allergens"] = df.pop("allergen_names").map(lambda s: ", ".join(catalog.split_allergens(s)))
+    df = df.drop(columns=["ingredients"])
+
     df = to_num(df, ["calories_kcal", "protein_g", "fat_g", "carbohydrate_g"])
     df = df.dropna(subset=["calories_kcal", "protein_g", "fat_g", "carbohydrate_g"])
     df = df[df["calories_kcal"] > 0]
-    df["ingredients_list"] = df["ingredients"].apply(parse_list_cell)
 
     # Deduplicate so each EN name maps to exactly one row
     df = df.drop_duplicates(subset=["dish_name"], keep="first").reset_index(drop=True)
     return df
 
+
+def _load_dishes_from_db() -> pd.DataFrame:
+    """
+    Pulls dishes + allergens from the DB in one aggregated query and returns
+    a DataFrame aligned to the old CSV shape, now including localized names.
+    """
+    return _frame_from_records(catalog.dish_values_with_allergens())
+
+
+def _patch_frame(frame: pd.DataFrame, touched, rows) -> pd.DataFrame:
+    """
+    The planner frame after the dishes in `touched` changed (`rows`: their
+    current values; missing ids were deleted). Dishes sharing a name with a
+    touched dish are reloaded too so name de-duplication stays exact.
+    """
+    if frame.empty:
+        return _load_dishes_from_db()
+    names = set(frame.loc[frame["dish_id"].isin(touched), "dish_name"]) | {r["dish_name"] for r in rows}
+    same_name = list(catalog.dish_values_with_allergens()
+                     .filter(dish_name__in=names).exclude(dish_id__in=touched)) if names else []
+    kept = frame[~frame["dish_id"].isin(touched) & ~frame["dish_name"].isin(names)]
+    fresh = _frame_from_records(rows + same_name)
+    df = pd.concat([kept, fresh], ignore_index=True) if not fresh.empty else kept
+    df = df.sort_values("dish_id", kind="stable")
+    return df.drop_duplicates(subset=["dish_name"], keep="first").reset_index(drop=True)
+
+# ---------- FILTERS ----------
+def _diet_terms(diet: Dict):
+    """(diet_pref, include_eggs, allergies, excluded_ingredients) normalized from goals["inputs"]["diet"]."""
+    return (
+        str(diet.get("diet_preference", "any")).lower().strip(),
+        bool(diet.get("include_eggs", True)),
+        {str(a).lower().strip() for a in term_list(diet.get("allergies"))},
+        [str(i) for i in term_list(diet.get("exclude_ingredients")) + term_list(diet.get("dislikes"))],
+    )
+
+
+_OVERFLOW_BIT = allergen_bit(ALLERGEN_MASK_BITS)
+
+
+def _eligible_frame(diet: Dict, k: Dict, only: Optional[Q] = None) -> pd.DataFrame:
+    """
+    The dishes a plan for this diet may use, filtered in the database on the
+    derived Dish columns (dish_planner_idx + allergen_mask) so that only
+    eligible rows are loaded. Allergy and egg terms match allergen names by
+    substring, as detect_allergens does; allergens sharing the mask's overflow
+    bit are checked on the loaded rows. Ingredient exclusions are not applied
+    here: they vary per user and are masked per request (_allowed_masks).
+    `only` restricts the load to some dishes (patching a pool).
+    """
+    diet_pref, include_eggs, allergies, _excluded = _diet_terms(diet)
+    qs = (catalog.dish_values_with_allergens("is_main", "is_side")
+          .filter(Q(is_main=True) | Q(is_side=True), is_banned=False, calories_kcal__gte=k["MIN_CAL_PER_DISH"]))
+    if only is not None:
+        qs = qs.filter(only)
+
+    blocked = set(allergies)
+    if diet_pref == "vegan":
+        qs = qs.filter(veg_class="vegan")
+    elif diet_pref == "vegetarian":
+        qs = qs.exclude(veg_class="non-veg")
+        if not include_eggs:
+            qs = qs.exclude(dish_name__icontains="egg")
+            blocked.add("egg")
+
+    mask = 0
+    if blocked:
+        mask = allergen_mask(allergen_ids_matching(blocked))
+        exact = mask & ~_OVERFLOW_BIT
+        if exact:
+            qs = qs.alias(blocked_allergens=F("allergen_mask").bitand(exact)).filter(blocked_allergens=0)
+
+    df = _frame_from_records(qs)
+    if df.empty:
+        return df
+    if mask & _OVERFLOW_BIT:
+        df = df[~df["allergens"].apply(lambda s: detect_allergens(s, blocked))]
+    return df
+
+
+def _pool_key(diet: Dict, k: Dict):
+    """Canonical form of the diet fields _eligible_frame reads, plus the pool knobs."""
+    diet_pref, include_eggs, allergies, _excluded = _diet_terms(diet)
+    return (
+        k["MIN_CAL_PER_DISH"],
+        k["COMBO_MAX_PAIR_SIDES"],
+        diet_pref,
+        include_eggs,
+        tuple(sorted(allergies)),
+    )
+
+
+class CandidatePool:
+    """
+    The eligible rows for one diet, split into mains and sides, plus their
+    combo index (built on first use). Shared across requests; read-only.
+    """
+
+    def __init__(self, frame: pd.DataFrame, mains: pd.DataFrame, sides: pd.DataFrame,
+                 max_pair_sides: int = COMBO_MAX_PAIR_SIDES):
+        self.frame = frame
+        self.mains = mains
+        self.sides = sides
+        self.max_pair_sides = max_pair_sides
+        self._lock = threading.Lock()
+        self._combos: Optional[ComboIndex] = None
+
+    def nbytes(self) -> int:
+        """Approximate memory held by this pool (frames deep-counted, combo arrays)."""
+        total = sum(int(df.memory_usage(deep=True).sum()) for df in (self.frame, self.mains, self.sides))
+        combos = self._combos
+        if combos is not None:
+            total += combos.nbytes()
+        return total
+
+    @property
+    def combos(self) -> ComboIndex:
+        with self._lock:
+            if self._combos is None:
+                self._combos = ComboIndex(
+                    self.mains["dish_id"].to_numpy(), np.column_stack(_macro_arrays(self.mains)),
+                    self.sides["dish_id"].to_numpy(), np.column_stack(_macro_arrays(self.sides)),
+                    max_pair_sides=self.max_pair_sides,
+                )
+            return self._combos
+
+
+def _pool_from_frame(df: pd.DataFrame, k: Dict) -> CandidatePool:
+    mains = df[df["is_main"]] if not df.empty else df
+    sides = df[df["is_side"]] if not df.empty else df
+    if mains.empty:
+        raise ValueError("No suitable 'main' dishes after filters.")
+    if sides.empty:
+        sides = mains
+    return CandidatePool(df, mains, sides, max_pair_sides=k["COMBO_MAX_PAIR_SIDES"])
+
+
+def _patch_pool(pool: CandidatePool, touched, diet: Dict, k: Dict) -> CandidatePool:
+    """
+    The pool after the dishes in `touched` changed: only those are re-read
+    (plus eligible dishes sharing a name with them, so name de-duplication
+    stays exact, as in _patch_frame). A change that neither was nor becomes
+    eligible for this diet keeps the pool, combo index included, as it is.
+    """
+    frame = pool.frame
+    was = frame["dish_id"].isin(touched)
+    fresh = _eligible_frame(diet, k, Q(dish_id__in=touched))
+    if not was.any() and fresh.empty:
+        return pool
+    names = set(frame.loc[was, "dish_name"]) | (set(fresh["dish_name"]) if not fresh.empty else set())
+    same_name = _eligible_frame(diet, k, Q(dish_name__in=names) & ~Q(dish_id__in=touched))
+    kept = frame[~was & ~frame["dish_name"].isin(names)]
+    df = pd.concat([f for f in (kept, fresh, same_name) if not f.empty], ignore_index=True)
+    df = df.sort_values("dish_id", kind="stable")
+    return _pool_from_frame(df.drop_duplicates(subset=["dish_name"], keep="first").reset_index(drop=True), k)
+
+
+def _candidate_pools(diet: Dict, version: int, k: Optional[Dict] = None) -> CandidatePool:
+    """
+    The CandidatePool for this diet at `version`, memoized in catalog.pools
+    and patched forward by the dishes each catalog change touched.
+    """
+    k = knobs() if k is None else k
+
+    def build():
+        df = _eligible_frame(diet, k)
+        if df.empty and not Dish.objects.exists():
+            raise ValueError("No dishes available in database.")
+        return _pool_from_frame(df, k)
+
+    entry = catalog.pools.get_or_build(_pool_key(diet, k), catalog.VersionedEntry)
+    return entry.at(version, build, lambda pool, touched: _patch_pool(pool, touched, diet, k))
+
+
+def _excluded_ids(diet: Dict, snap) -> set:
+    """Ids of dishes using an excluded or disliked ingredient of this diet (the snapshot's ingredient index)."""
+    excluded = _diet_terms(diet)[3]
+    return snap.ingredient_index.dishes_with_any(excluded) if excluded else set()
+
+
+def _allowed_masks(diet: Dict, pool: CandidatePool, snap):
+    """
+    (main_ok, side_ok) masks over the shared pool without the diet's excluded
+    and disliked dishes, so exclusions need no pool of their own.
+    """
+    main_ids = pool.mains["dish_id"].to_numpy()
+    side_ids = pool.sides["dish_id"].to_numpy()
+    excluded = np.fromiter(_excluded_ids(diet, snap), dtype=np.int64)
+    main_ok = ~np.isin(main_ids, excluded)
+    if not main_ok.any():
+        raise ValueError("No suitable 'main' dishes after filters.")
+    return main_ok, ~np.isin(side_ids, excluded)
+
+
+def _fresh_masks(user_id, pool: CandidatePool, main_ok, side_ok):
+    """
+    main_ok / side_ok narrowed to dishes the user was not served recently,
+    from one history lookup; a mask that would end up empty is kept as given.
+    """
+    main_ids = pool.mains["dish_id"].to_numpy()
+    side_ids = pool.sides["dish_id"].to_numpy()
+    if not user_id:
+        return main_ok, side_ok
+    ids = np.union1d(main_ids, side_ids)
+    mask = dish_history.recent_mask(user_id, ids)
+    if mask is None or not mask.any():
+        return main_ok, side_ok
+    recent_ids = ids[mask]
+    fresh_mains = main_ok & ~np.isin(main_ids, recent_ids)
+    fresh_sides = side_ok & ~np.isin(side_ids, recent_ids)
+    return (fresh_mains if fresh_mains.any() else main_ok,
+            fresh_sides if fresh_sides.any() else side_ok)
+
+
+def _time_budget_ms(goals: Dict) -> Optional[float]:
+    """Per-request goals["time_budget_ms"], capped by settings.PLANNER_TIME_BUDGET_MS."""
+    budgets = [float(b) for b in (goals.get("time_budget_ms"), getattr(settings, "PLANNER_TIME_BUDGET_MS", None))
+               if b is not None]
+    budgets = [b for b in budgets if b > 0]
+    return min(budgets) if budgets else None
+
+
 # ---------- PUBLIC API ----------
 def generate_meal_plan(goals: Dict) -> List[Dict]:
     """
@@ -273,18 +496,26 @@ def generate_meal_plan(goals: Dict) -> List[Dict]:
     {
       "energy": {"target_kcal": float},
       "inputs": {
+        "user_id": "abc123",        # optional: avoid dishes served to this user recently
         "fitness_goal": "weight loss" | "maintenance" | "gain",
         "diet": {
           "diet_preference": "vegan|vegetarian|non-veg|any",
           "include_eggs": true,
-          "allergies": ["nuts", ...]
+          "allergies": ["nuts", ...],
+          "exclude_ingredients": ["pork", ...],   # optional
+          "dislikes": ["mushroom", ...]           # optional, same effect
         }
-      }
+      },
+      "time_budget_ms": 50,                 # optional: search deadline for the whole plan
+      "seed": 1234                          # optional: reproducible dish picks
     }
+    Each meal reports "SearchComplete": false when the deadline cut its search short.
     """
-    df = _load_dishes_from_db()
-    if df.empty:
-        raise ValueError("No dishes available in database.")
+    # Per-request random stream: concurrent plans share no mutable state.
+    rng = np.random.default_rng(goals.get("seed"))
+    k = knobs()
+    budget_ms = _time_budget_ms(goals)
+    deadline = time.monotonic() + budget_ms / 1000.0 if budget_ms else None
 
     target_kcal = float(goals.get("energy", {}).get("target_kcal", 0))
     if target_kcal <= 0:
@@ -292,97 +523,145 @@ def generate_meal_plan(goals: Dict) -> List[Dict]:
 
     fitness_goal = str(goals.get("inputs", {}).get("fitness_goal", "maintenance")).lower().strip()
     diet = goals.get("inputs", {}).get("diet", {}) or {}
-    diet_pref = str(diet.get("diet_preference", "any")).lower().strip()
-    include_eggs = bool(diet.get("include_eggs", True))
-    allergies = {a.lower().strip() for a in diet.get("allergies", [])}
     weight_loss = (fitness_goal == "weight loss")
 
-    # Dietary filters
-    if diet_pref == "vegan":
-        df = df[df["diet_class"].eq("vegan")]
-    elif diet_pref == "vegetarian":
-        df = df[~df["diet_class"].eq("non-veg")]
-        if not include_eggs:
-            egg_mask = df["allergens"].fillna("").str.contains("egg", case=False) | \
-                       df["dish_name"].fillna("").str.contains("egg", case=False)
-            df = df[~egg_mask]
-
-    # Allergy filter
-    if allergies:
-        df = df[~df["allergens"].apply(lambda s: detect_allergens(s, allergies))]
-
-    # Ban & basic nutrition thresholds
-    df = df[~df.apply(is_banned_row, axis=1)]
-    df = df[df["calories_kcal"] >= MIN_CAL_PER_DISH]
+    # Eligible mains/sides loaded from the database, shared by every request with this
+    # diet; the user's ingredient exclusions are masks over them
+    with memory.stage("pool"):
+        snap = catalog.get_snapshot()
+        pool = _candidate_pools(diet, snap.version, k)
+        df = pool.frame
+        main_ok, side_ok = _allowed_masks(diet, pool, snap)
 
-    # Classify mains/sides
-    mains = df[df.apply(is_main, axis=1)].copy()
-    sides = df[df.apply(is_side, axis=1)].copy()
-    if mains.empty:
-        raise ValueError("No suitable 'main' dishes after filters.")
-    if sides.empty:
-        sides = mains.copy()
+        # Variety across requests: skip what this user was served recently
+        user_id = goals.get("inputs", {}).get("user_id")
+        main_ok, side_ok = _fresh_masks(user_id, pool, main_ok, side_ok)
 
     # Build plan
-    meal_targets = {meal: round(frac * target_kcal, 1) for meal, frac in MEAL_SPLIT.items()}
-    used_names = set()
+    meal_targets = {meal: round(frac * target_kcal, 1) for meal, frac in k["MEAL_SPLIT"].items()}
+    used_ids = set()
+    served_ids = []
     plan = []
 
     for meal, kcal_t in meal_targets.items():
-        names, _unused_totals = choose_meal(mains, sides, kcal_t, weight_loss, used_names)
-
-        selected_names = names[:MAX_ITEMS_PER_MEAL]
-        used_names.update(selected_names)
-
-        ordered_rows_list = []
-        ing_map = {}
-        img_map = {}
-        per_dish = []
-        dishes_localized = []  # <- new
-
-        for dish_name in selected_names:
-            row = df.loc[df["dish_name"] == dish_name].head(1)
-            if row.empty:
-                continue
-            r = row.iloc[0]
-            ordered_rows_list.append(r)
-
-            # localized names payload
-            dishes_localized.append({
-                "dish_name": r["dish_name"],
-                "dish_ms_name": r.get("dish_ms_name"),
-                "dish_vi_name": r.get("dish_vi_name"),
-                "dish_zh_name": r.get("dish_zh_name"),
+        with memory.stage("search"):
+            dish_ids, _unused_totals, complete = choose_meal(pool, kcal_t, weight_loss, used_ids,
+                                                             main_ok, side_ok, deadline=deadline, rng=rng, k=k)
+
+        with memory.stage("assemble"):
+            selected_ids = dish_ids[:k["MAX_ITEMS_PER_MEAL"]]
+            used_ids.update(selected_ids)
+
+            ordered_rows_list = []
+            ing_map = {}
+            img_map = {}
+            per_dish = []
+            dishes_localized = []  # <- new
+
+            for dish_id in selected_ids:
+                row = df.loc[df["dish_id"] == dish_id].head(1)
+                if row.empty:
+                    continue
+                r = row.iloc[0]
+                dish_name = r["dish_name"]
+                ordered_rows_list.append(r)
+                served_ids.append(dish_id)
+
+                # localized names payload
+                dishes_localized.append({
+                    "dish_name": r["dish_name"],
+                    "dish_ms_name": r.get("dish_ms_name"),
+                    "dish_vi_name": r.get("dish_vi_name"),
+                    "dish_zh_name": r.get("dish_zh_name"),
+                })
+
+                # maps (keep keyed by EN name)
+                ing_map[dish_name] = r["ingredients_list"]
+                img_map[dish_name] = r.get("image_url")
+
+                per_dish.append({
+                    "Dish": dish_name,
+                    "Calories": round(float(r["calories_kcal"]), 1),
+                    "Protein_g": round(float(r["protein_g"]), 1),
+                    "Fat_g": round(float(r["fat_g"]), 1),
+                    "Carbs_g": round(float(r["carbohydrate_g"]), 1),
+                })
+
+            if ordered_rows_list:
+                ordered_rows = pd.DataFrame(ordered_rows_list)
+                meal_totals = _sum_macros(ordered_rows)
+            else:
+                meal_totals = {"calories": 0.0, "Protein_g": 0.0, "Fat_g": 0.0, "Carbs_g": 0.0}
+
+            plan.append({
+                "Meal": meal,
+                "Dishes": dishes_localized,   # <- now returns all 4 names
+                "Ingredients": ing_map,
+                "Images": img_map,
+                "PerDish": per_dish,
+                "Calories": meal_totals["calories"],
+                "Protein_g": meal_totals["Protein_g"],
+                "Fat_g": meal_totals["Fat_g"],
+                "Carbs_g": meal_totals["Carbs_g"],
+                "SearchComplete": complete,
             })
 
-            # maps (keep keyed by EN name)
-            ing_map[dish_name] = r["ingredients_list"]
-            img_map[dish_name] = r.get("image_url")
+    dish_history.record_served(user_id, served_ids)
+    return plan
 
-            per_dish.append({
-                "Dish": dish_name,
-                "Calories": round(float(r["calories_kcal"]), 1),
-                "Protein_g": round(float(r["protein_g"]), 1),
-                "Fat_g": round(float(r["fat_g"]), 1),
-                "Carbs_g": round(float(r["carbohydrate_g"]), 1),
-            })
 
-        if ordered_rows_list:
-            ordered_rows = pd.DataFrame(ordered_rows_list)
-            meal_totals = _sum_macros(ordered_rows)
-        else:
-            meal_totals = {"calories": 0.0, "Protein_g": 0.0, "Fat_g": 0.0, "Carbs_g": 0.0}
-
-        plan.append({
-            "Meal": meal,
-            "Dishes": dishes_localized,   # <- now returns all 4 names
-            "Ingredients": ing_map,
-            "Images": img_map,
-            "PerDish": per_dish,
-            "Calories": meal_totals["calories"],
-            "Protein_g": meal_totals["Protein_g"],
-            "Fat_g": meal_totals["Fat_g"],
-            "Carbs_g": meal_totals["Carbs_g"],
+def suggest_swaps(dish_name: str, diet: Dict, k: int = 5, exclude_names=()) -> Dict:
+    """
+    The k dishes closest in (kcal, protein, fat, carbs) to `dish_name` that
+    a plan for `diet` (same shape as goals["inputs"]["diet"]) could serve,
+    i.e. the dishes in its candidate pool minus its ingredient exclusions.
+    Dishes named in `exclude_names` (e.g. the rest of the current plan) are
+    skipped.
+    """
+    snap = catalog.get_snapshot()
+    df = snap.frame
+    if df.empty:
+        raise ValueError("No dishes available in database.")
+
+    source = df.loc[df["dish_name"] == dish_name]
+    if source.empty:
+        raise ValueError(f"unknown dish: {dish_name}")
+    src = source.iloc[0]
+
+    # Same eligibility as plans (stored Dish flags, cached pool per diet), no per-row checks here.
+    try:
+        eligible_ids = _candidate_pools(diet, snap.version).frame["dish_id"]
+    except ValueError:  # no mains for this diet: nothing a plan could hold either
+        eligible_ids = []
+    skip = set(exclude_names) | {dish_name}
+    mask = (df["dish_id"].isin(eligible_ids) & ~df["dish_id"].isin(_excluded_ids(diet, snap))
+            & ~df["dish_name"].isin(skip)).to_numpy()
+
+    hits = snap.macro_index.query(src[MACRO_COLUMNS].to_numpy(dtype=float), k=k, mask=mask)
+    swaps = []
+    for dist, row in hits:
+        r = df.iloc[row]
+        swaps.append({
+            "dish_name": r["dish_name"],
+            "dish_ms_name": r.get("dish_ms_name"),
+            "dish_vi_name": r.get("dish_vi_name"),
+            "dish_zh_name": r.get("dish_zh_name"),
+            "image_url": r.get("image_url"),
+            "Ingredients": r["ingredients_list"],
+            "Calories": round(float(r["calories_kcal"]), 1),
+            "Protein_g": round(float(r["protein_g"]), 1),
+            "Fat_g": round(float(r["fat_g"]), 1),
+            "Carbs_g": round(float(r["carbohydrate_g"]), 1),
+            "distance": round(float(dist), 3),
         })
 
-    return plan
+    return {
+        "dish": {
+            "dish_name": src["dish_name"],
+            "Calories": round(float(src["calories_kcal"]), 1),
+            "Protein_g": round(float(src["protein_g"]), 1),
+            "Fat_g": round(float(src["fat_g"]), 1),
+            "Carbs_g": round(float(src["carbohydrate_g"]), 1),
+        },
+        "swaps": swaps,
+    }
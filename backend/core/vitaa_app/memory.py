@@ -0,0 +1,301 @@
+# vitaa_app/memory.py
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("vitaa_app.memory")
+
+DEFAULT_TRACE_FRAMES = 10
+DEFAULT_TOP_SITES = 10
+DEFAULT_RECENT_REQUESTS = 50
+
+
+# ---------- PROCESS ----------
+def rss_bytes() -> Optional[int]:
+    """Current resident set size from /proc (Linux); None where unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """High-water RSS of this process."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+# ---------- TRACEMALLOC ----------
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+# Tracing costs CPU and memory on every allocation in the worker: it runs
+# only while someone needs it (a traced request, the periodic diff thread)
+# and stops with the last of them, unless it was already on when they came.
+_tracing_lock = threading.Lock()
+_tracing = {"users": 0, "started": False}
+
+
+def acquire_tracing():
+    """Start tracemalloc (MEMORY_TRACE_FRAMES deep) unless it already runs; pair with release_tracing()."""
+    with _tracing_lock:
+        if _tracing["users"] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(getattr(settings, "MEMORY_TRACE_FRAMES", DEFAULT_TRACE_FRAMES))
+            _tracing["started"] = True
+        _tracing["users"] += 1
+
+
+def release_tracing():
+    """Stop tracemalloc when the last user that needed it is done (if acquire_tracing started it)."""
+    with _tracing_lock:
+        _tracing["users"] = max(0, _tracing["users"] - 1)
+        if _tracing["users"] or not _tracing["started"]:
+            return
+        tracemalloc.stop()
+        _tracing["started"] = False
+    with _diff_lock:
+        _diff_state["snapshot"] = None  # a baseline from an earlier trace is not comparable
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _site(traceback) -> str:
+    """Innermost frame in vitaa_app code (who asked for the memory), else the allocating frame."""
+    for frame in reversed(traceback):  # oldest first, most recent last
+        if frame.filename.startswith(_APP_DIR):
+            return f"{frame.filename}:{frame.lineno}"
+    return f"{traceback[-1].filename}:{traceback[-1].lineno}"
+
+
+def top_growth(before, after, limit: int) -> List[Dict]:
+    """Sites (see _site) whose traced allocations grew most between two snapshots."""
+    sites: Dict[str, Dict] = {}
+    for stat in after.compare_to(before, "traceback"):
+        site = sites.setdefault(_site(stat.traceback), {"size_diff": 0, "count_diff": 0, "size": 0})
+        site["size_diff"] += stat.size_diff
+        site["count_diff"] += stat.count_diff
+        site["size"] += stat.size
+    grown = sorted(((k, v) for k, v in sites.items() if v["size_diff"] > 0), key=lambda kv: -kv[1]["size_diff"])
+    return [{"site": k, **v} for k, v in grown[:limit]]
+
+
+class RequestMemory:
+    """
+    tracemalloc accounting for one request: the peak traced allocation above
+    what was live when it started, and per stage (see stage()) the stage's
+    own peak plus the allocation sites that grew most. tracemalloc is process
+    wide, so requests running concurrently in other threads are counted too.
+    """
+
+    def __init__(self, top_sites: int):
+        self.top_sites = top_sites
+        self.stages: List[Dict] = []
+        self._base = 0
+        self._peak = 0
+
+    def start(self):
+        self._base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        self._peak = self._base
+
+    def _fold_peak(self):
+        self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+
+    @contextmanager
+    def stage(self, name: str):
+        self._fold_peak()
+        before = _snapshot()
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            self._peak = max(self._peak, peak)
+            self.stages.append({
+                "stage": name,
+                "peak_bytes": peak - start,
+                "retained_bytes": current - start,
+                "top_sites": top_growth(before, _snapshot(), self.top_sites),
+            })
+            tracemalloc.reset_peak()
+
+    def finish(self) -> Dict:
+        self._fold_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        return {
+            "peak_bytes": self._peak - self._base,
+            "retained_bytes": current - self._base,
+            "stages": self.stages,
+        }
+
+
+_local = threading.local()
+
+
+def stage(name: str):
+    """Context manager marking a stage of the traced request on this thread; no-op otherwise."""
+    tracker = getattr(_local, "tracker", None)
+    return tracker.stage(name) if tracker is not None else nullcontext()
+
+
+# Peaks are process wide (tracemalloc.reset_peak): traced requests run one at a time.
+_request_lock = threading.Lock()
+
+
+@contextmanager
+def track_request():
+    """Trace allocations of the current thread's request; yields the RequestMemory."""
+    tracker = RequestMemory(getattr(settings, "MEMORY_TOP_SITES", DEFAULT_TOP_SITES))
+    with _request_lock:
+        acquire_tracing()
+        try:
+            tracker.start()
+            _local.tracker = tracker
+            yield tracker
+        finally:
+            _local.tracker = None
+            release_tracing()
+
+
+# ---------- RECENT REQUESTS ----------
+_recent_lock = threading.Lock()
+_recent: deque = deque(maxlen=DEFAULT_RECENT_REQUESTS)
+
+
+def record(entry: Dict):
+    global _recent
+    size = getattr(settings, "MEMORY_RECENT_REQUESTS", DEFAULT_RECENT_REQUESTS)
+    with _recent_lock:
+        if _recent.maxlen != size:
+            _recent = deque(_recent, maxlen=size)
+        _recent.append(entry)
+
+
+def recent() -> List[Dict]:
+    with _recent_lock:
+        return list(_recent)
+
+
+# ---------- PERIODIC DIFFS ----------
+_diff_lock = threading.Lock()
+_diff_state = {"snapshot": None, "last": None, "thread": None}
+
+
+def snapshot_diff() -> Optional[Dict]:
+    """
+    Compare a new tracemalloc snapshot with the previous one taken here and
+    keep it as the new baseline. The first call only records the baseline;
+    None as well while tracemalloc is off (see start_periodic_diffs).
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    current = _snapshot()
+    with _diff_lock:
+        previous, _diff_state["snapshot"] = _diff_state["snapshot"], current
+        if previous is None:
+            return None
+        traced = tracemalloc.get_traced_memory()[0]
+        diff = {
+            "taken_at": time.time(),
+            "rss_bytes": rss_bytes(),
+            "traced_bytes": traced,
+            "growth_bytes": sum(s.size_diff for s in current.compare_to(previous, "filename")),
+            "top_sites": top_growth(previous, current, getattr(settings, "MEMORY_TOP_SITES", DEFAULT_TOP_SITES)),
+        }
+        _diff_state["last"] = diff
+    logger.info("memory diff: %+d bytes traced, rss %s; top: %s", diff["growth_bytes"], diff["rss_bytes"],
+                ", ".join(f'{s["site"]} {s["size_diff"]:+d}' for s in diff["top_sites"][:3]) or "-")
+    return diff
+
+
+def last_diff() -> Optional[Dict]:
+    with _diff_lock:
+        return _diff_state["last"]
+
+
+def _diff_loop(interval_s: float):
+    while True:
+        time.sleep(interval_s)
+        try:
+            snapshot_diff()
+        except Exception:
+            logger.exception("memory snapshot diff failed")
+
+
+def _reset_after_fork():
+    # The diff thread does not survive a fork; let the child start its own.
+    if _diff_state["thread"] is not None:
+        _diff_state["thread"] = None
+        _tracing["users"] = max(0, _tracing["users"] - 1)  # its hold went with it
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def start_periodic_diffs():
+    """Start the MEMORY_SNAPSHOT_INTERVAL_S diff thread once per process (no-op when 0); it keeps tracing on."""
+    interval_s = float(getattr(settings, "MEMORY_SNAPSHOT_INTERVAL_S", 0) or 0)
+    if interval_s <= 0:
+        return
+    with _diff_lock:
+        if _diff_state["thread"] is not None:
+            return
+        thread = threading.Thread(target=_diff_loop, args=(interval_s,), name="vitaa-memory-diff", daemon=True)
+        _diff_state["thread"] = thread
+    acquire_tracing()
+    snapshot_diff()  # baseline
+    thread.start()
+
+
+def reset():
+    """Forget recent traces and the diff baseline (tests)."""
+    with _recent_lock:
+        _recent.clear()
+    with _diff_lock:
+        _diff_state["snapshot"] = _diff_state["last"] = None
+
+
+# ---------- REPORT ----------
+def report() -> Dict:
+    """Worker memory: RSS, tracemalloc totals, catalog and planner cache sizes, recent traces, last diff."""
+    from vitaa_app import catalog
+
+    tracing = tracemalloc.is_tracing()
+    traced, traced_peak = tracemalloc.get_traced_memory() if tracing else (None, None)
+    return {
+        "pid": os.getpid(),
+        "rss_bytes": rss_bytes(),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "tracemalloc": {"tracing": tracing, "traced_bytes": traced, "peak_bytes": traced_peak},
+        "caches": catalog.cache_report(),
+        "recent_requests": recent(),
+        "last_snapshot_diff": last_diff(),
+    }
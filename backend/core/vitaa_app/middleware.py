@@ -0,0 +1,187 @@
+# vitaa_app/middleware.py
+import hmac
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from vitaa_app import catalog, memory
+from vitaa_app.profiling import StackSampler, write_capture
+
+logger = logging.getLogger("vitaa_app.db")
+
+DEFAULT_SLOW_QUERY_MS = 100.0
+
+
+class QueryStats:
+    """Execute wrapper counting queries and DB time for one request (all aliases)."""
+
+    def __init__(self, slow_ms: float):
+        self.slow_ms = slow_ms
+        self.count = 0
+        self.db_ms = 0.0
+        self.view = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - started) * 1000.0
+            self.count += 1
+            self.db_ms += ms
+            if ms >= self.slow_ms:
+                logger.warning("slow query %.1f ms on %s in %s: %s",
+                               ms, context["connection"].alias, self.view or "-", sql[:500])
+
+
+class QueryAccountingMiddleware:
+    """
+    Counts queries and DB time per request and reports them with total app
+    time in a Server-Timing header:
+
+        Server-Timing: db;dur=3.1;desc="4 queries", app;dur=12.7
+
+    Statements slower than SLOW_QUERY_MS are logged with the view that ran
+    them; requests over their QUERY_BUDGETS entry (keyed by URL name) are
+    logged too. Work handed to other threads (analysis jobs) is not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats(getattr(settings, "SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS))
+        request.query_stats = stats
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(stats))
+            response = self.get_response(request)
+        app_ms = (time.perf_counter() - started) * 1000.0
+
+        timing = f'db;dur={stats.db_ms:.1f};desc="{stats.count} queries", app;dur={app_ms:.1f}'
+        if response.has_header("Server-Timing"):
+            timing = response["Server-Timing"] + ", " + timing
+        response["Server-Timing"] = timing
+
+        match = getattr(request, "resolver_match", None)
+        budget = getattr(settings, "QUERY_BUDGETS", {}).get(match.url_name if match else None)
+        if budget is not None and stats.count > budget:
+            logger.warning("query budget exceeded in %s: %d queries (budget %d)",
+                           stats.view, stats.count, budget)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_stats.view = f"{view_func.__module__}.{view_func.__name__}"
+
+
+# ---------- PROFILING ----------
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def request_id(request) -> str:
+    """Client-supplied X-Request-ID when it is a safe file name, otherwise a new one."""
+    rid = request.headers.get("X-Request-ID", "")
+    return rid if _REQUEST_ID_RE.match(rid) else uuid.uuid4().hex
+
+
+def diagnostics_selected(request, header: str, rate_setting: str) -> bool:
+    """True when `header` carries DIAGNOSTICS_TOKEN or the request is sampled at settings.<rate_setting>."""
+    token = getattr(settings, "DIAGNOSTICS_TOKEN", "")
+    sent = request.headers.get(header, "")
+    if token and sent and hmac.compare_digest(sent, token):
+        return True
+    rate = getattr(settings, rate_setting, 0.0)
+    return rate > 0 and random.random() < rate
+
+
+class SamplingProfilerMiddleware:
+    """
+    Samples the stack of selected requests and writes a collapsed-stack file
+    (plus metadata) to PROFILE_DIR. A request is profiled when it carries
+    `X-Vitaa-Profile: <DIAGNOSTICS_TOKEN>` or is picked by PROFILE_SAMPLE_RATE.
+    Profiled responses carry `X-Profile-Id`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not diagnostics_selected(request, "X-Vitaa-Profile", "PROFILE_SAMPLE_RATE"):
+            return self.get_response(request)
+
+        capture_id = request_id(request)
+        sampler = StackSampler(threading.get_ident(), getattr(settings, "PROFILE_INTERVAL_MS", 5) / 1000.0)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            samples = sampler.stop()
+        duration_ms = (time.perf_counter() - started) * 1000.0
+
+        try:
+            write_capture(str(settings.PROFILE_DIR), capture_id, samples, {
+                "request_id": capture_id,
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "catalog_version": catalog.catalog_version(),
+                "duration_ms": round(duration_ms, 1),
+                "interval_ms": round(sampler.interval_s * 1000.0, 3),
+            })
+        except OSError:
+            logging.getLogger("vitaa_app.profiling").exception("could not write profile %s", capture_id)
+        else:
+            response["X-Profile-Id"] = capture_id
+        return response
+
+
+# ---------- MEMORY ----------
+class MemoryAccountingMiddleware:
+    """
+    tracemalloc accounting for selected requests (`X-Vitaa-Memory:
+    <DIAGNOSTICS_TOKEN>` or MEMORY_SAMPLE_RATE): peak allocation, bytes
+    still held afterwards, and per-stage peaks and top allocation sites (see
+    memory.stage). Results go to the "vitaa_app.memory" log and the recent
+    list of the memory diagnostics endpoint; responses carry
+    `X-Memory-Peak` (bytes).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not diagnostics_selected(request, "X-Vitaa-Memory", "MEMORY_SAMPLE_RATE"):
+            return self.get_response(request)
+
+        rss_before = memory.rss_bytes()
+        with memory.track_request() as tracker:
+            response = self.get_response(request)
+        result = tracker.finish()
+        rss_after = memory.rss_bytes()
+
+        match = getattr(request, "resolver_match", None)
+        entry = {
+            "request_id": request_id(request),
+            "method": request.method,
+            "path": request.path,
+            "view": match.url_name if match else None,
+            "status": response.status_code,
+            "rss_bytes": rss_after,
+            "rss_delta_bytes": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+            **result,
+        }
+        memory.record(entry)
+        memory.logger.info("memory %s %s: peak %d B, retained %d B, stages %s",
+                           request.method, request.path, result["peak_bytes"], result["retained_bytes"],
+                           ", ".join(f'{st["stage"]}={st["peak_bytes"]}' for st in result["stages"]) or "-")
+        response["X-Memory-Peak"] = str(result["peak_bytes"])
+        return response
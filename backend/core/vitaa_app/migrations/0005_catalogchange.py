@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+def seed_catalog_changes(apps, schema_editor):
+    """Record existing dishes so a delta from version 0 returns the whole catalog."""
+    Dish = apps.get_model('vitaa_app', 'Dish')
+    CatalogChange = apps.get_model('vitaa_app', 'CatalogChange')
+    CatalogChange.objects.bulk_create(
+        [CatalogChange(dish_id=pk, op='upsert') for pk in Dish.objects.values_list('dish_id', flat=True)],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vitaa_app', '0004_dish_dish_ms_name_dish_dish_vi_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('version', models.BigAutoField(primary_key=True, serialize=False)),
+                ('dish_id', models.IntegerField(db_index=True)),
+                ('op', models.CharField(choices=[('upsert', 'Upsert'), ('delete', 'Delete')], max_length=8)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Catalog Change',
+                'verbose_name_plural': 'Catalog Changes',
+                'db_table': 'catalog_change',
+            },
+        ),
+        migrations.RunPython(seed_catalog_changes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vitaa_app', '0005_catalogchange'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='allergen',
+            index=models.Index(fields=['allergen_name'], name='allergen_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dish',
+            index=models.Index(fields=['veg_class', 'dish_id'], name='dish_veg_class_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dish',
+            index=models.Index(fields=['calories_kcal'], name='dish_calories_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dish',
+            index=models.Index(fields=['protein_g'], name='dish_protein_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:07
+
+from django.db import migrations, models
+
+
+def fill_ingredients_list(apps, schema_editor):
+    Dish = apps.get_model('vitaa_app', 'Dish')
+    dishes = list(Dish.objects.only('dish_id', 'ingredients'))
+    for d in dishes:
+        d.ingredients_list = [s.strip() for s in (d.ingredients or '').split(',') if s.strip()]
+    Dish.objects.bulk_update(dishes, ['ingredients_list'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vitaa_app', '0007_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dish',
+            name='ingredients_list',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(fill_ingredients_list, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vitaa_app', '0008_dish_ingredients_list'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDishHistory',
+            fields=[
+                ('user_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('recent', models.BinaryField()),
+                ('previous', models.BinaryField()),
+                ('window_started_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'User Dish History',
+                'verbose_name_plural': 'User Dish Histories',
+                'db_table': 'user_dish_history',
+            },
+        ),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:26
+
+from django.db import migrations, models
+
+
+# The classification rules and allergen bit layout as they were when this
+# migration was written (meal_planner_service / models may change later; run
+# `manage.py refresh_dish_flags` to apply the current ones).
+BANNED_NAME_KEYWORDS = {
+    "beer", "lager", "ale", "wine", "cider", "whisky", "whiskey", "vodka", "rum", "gin", "soju", "sake",
+    "liqueur", "brandy",
+    "coffee", "tea", "cola", "soda", "soft drink", "energy drink", "water", "sparkling", "milk tea", "bubble tea",
+    "sugar", "honey", "syrup", "candy", "dessert", "ice cream", "gelato", "chocolate",
+    "cake", "cupcake", "cookie", "biscuit", "pastry", "donut", "doughnut", "sweet", "caramel",
+    "jam", "jelly", "marshmallow", "sweetened", "toffee", "gummy bears",
+}
+MIN_CAL_PER_DISH = 120
+SIDE_MAX_KCAL = 350
+MAIN_MIN_KCAL = 250
+MAIN_MIN_PROTEIN_G = 15.0
+MAIN_MIN_PROT_DENS = 7.0
+FAT_BOMB_RATIO = 2.0
+ALLERGEN_MASK_BITS = 63
+
+
+def dish_flags(name, kcal, prot, fat, carbs):
+    name = (name or "").lower()
+    kcal, prot, fat, carbs = (float(v or 0) for v in (kcal, prot, fat, carbs))
+    banned = any(w in name for w in BANNED_NAME_KEYWORDS) or (prot < 1 and fat <= 1 and carbs >= 30)
+    pdens = prot / kcal * 100 if kcal > 0 else 0
+    is_main = not (banned or kcal < MAIN_MIN_KCAL
+                   or (prot < MAIN_MIN_PROTEIN_G and pdens < MAIN_MIN_PROT_DENS)
+                   or (fat > FAT_BOMB_RATIO * prot and carbs < 20) or kcal < MIN_CAL_PER_DISH)
+    is_side = not banned and (kcal <= SIDE_MAX_KCAL or "nut" in name or "seed" in name)
+    return {
+        "protein_density": round(pdens, 3) if kcal > 0 else 0.0,
+        "is_banned": banned,
+        "is_main": is_main,
+        "is_side": is_side,
+    }
+
+
+def allergen_mask(allergen_ids):
+    mask = 0
+    for allergen_id in allergen_ids:
+        mask |= 1 << (min(allergen_id, ALLERGEN_MASK_BITS) - 1)
+    return mask
+
+
+def fill_planner_flags(apps, schema_editor):
+    Dish = apps.get_model('vitaa_app', 'Dish')
+    AllergenDish = apps.get_model('vitaa_app', 'AllergenDish')
+    links = {}
+    for dish_id, allergen_id in AllergenDish.objects.values_list('dish_id', 'allergen_id'):
+        links.setdefault(dish_id, []).append(allergen_id)
+    dishes = list(Dish.objects.only('dish_id', 'dish_name', 'calories_kcal', 'protein_g', 'fat_g', 'carbohydrate_g'))
+    for d in dishes:
+        for k, v in dish_flags(d.dish_name, d.calories_kcal, d.protein_g, d.fat_g, d.carbohydrate_g).items():
+            setattr(d, k, v)
+        d.allergen_mask = allergen_mask(links.get(d.dish_id, ()))
+    Dish.objects.bulk_update(
+        dishes, ['protein_density', 'is_banned', 'is_main', 'is_side', 'allergen_mask'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vitaa_app', '0009_userdishhistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dish',
+            name='allergen_mask',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dish',
+            name='is_banned',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='dish',
+            name='is_main',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='dish',
+            name='is_side',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='dish',
+            name='protein_density',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddIndex(
+            model_name='dish',
+            index=models.Index(condition=models.Q(('is_banned', False), models.Q(('is_main', True), ('is_side', True), _connector='OR')), fields=['veg_class', 'calories_kcal'], name='dish_planner_idx'),
+        ),
+        migrations.RunPython(fill_planner_flags, migrations.RunPython.noop),
+    ]
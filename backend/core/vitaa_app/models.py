@@ -1,12 +1,48 @@
+import uuid
+
 from django.db import models
 
 
+def split_ingredients(raw):
+    return [s.strip() for s in str(raw or '').split(',') if s.strip()]
+
+
+# Dish.allergen_mask has one bit per allergen id; ids past the last bit share
+# it, so that bit alone only says "maybe" (see meal_planner_service).
+ALLERGEN_MASK_BITS = 63
+
+
+def allergen_bit(allergen_id):
+    return 1 << (min(allergen_id, ALLERGEN_MASK_BITS) - 1)
+
+
+def allergen_mask(allergen_ids):
+    mask = 0
+    for allergen_id in allergen_ids:
+        mask |= allergen_bit(allergen_id)
+    return mask
+
+
+def allergen_ids_matching(terms):
+    """
+    Ids of allergens whose name contains one of the lower-case `terms`:
+    "peanut" matches "Peanuts". The planner's allergy filter and dish search
+    both match this way.
+    """
+    terms = [t for t in terms if t]
+    if not terms:
+        return []
+    return [aid for aid, name in Allergen.objects.values_list("allergen_id", "allergen_name")
+            if any(t in name.lower() for t in terms)]
+
+
 class Allergen(models.Model):
     allergen_id = models.AutoField(primary_key=True)
     allergen_name = models.CharField(max_length=255)
 
     class Meta:
         db_table = 'allergen'
+        indexes = [models.Index(fields=['allergen_name'], name='allergen_name_idx')]
         verbose_name = 'Allergen'
         verbose_name_plural = 'Allergens'
 
@@ -22,18 +58,57 @@ class Dish(models.Model):
     dish_zh_name = models.CharField(max_length=255, null=True, blank=True)
     image_url = models.CharField(max_length=255)
     ingredients = models.CharField(max_length=255)
+    # Structured copy of `ingredients`, read by the planner without parsing.
+    ingredients_list = models.JSONField(default=list, blank=True)
     veg_class = models.CharField(max_length=255)
     fat_g = models.DecimalField(max_digits=7, decimal_places=1)
     protein_g = models.DecimalField(max_digits=7, decimal_places=1)
     carbohydrate_g = models.DecimalField(max_digits=7, decimal_places=1)
     calories_kcal = models.IntegerField()
+    # Planner classification, derived on save (meal_planner_service.dish_flags);
+    # `manage.py refresh_dish_flags` recomputes them after the rules change.
+    protein_density = models.FloatField(default=0.0)
+    is_banned = models.BooleanField(default=False)
+    is_main = models.BooleanField(default=False)
+    is_side = models.BooleanField(default=False)
+    # allergen_bit() of every linked allergen, kept current by vitaa_app.signals.
+    allergen_mask = models.BigIntegerField(default=0)
 
     class Meta:
         db_table = 'dish'
         unique_together = ('dish_name', 'image_url')
+        # Search filters (see vitaa_app.dish_search); veg_class is paired with the
+        # dish_id keyset so equality + "dish_id > cursor" is one index range.
+        # dish_planner_idx covers the planner's eligibility query: only rows that
+        # are not banned and can be a main or a side, by diet class and kcal.
+        indexes = [
+            models.Index(fields=['veg_class', 'dish_id'], name='dish_veg_class_idx'),
+            models.Index(fields=['calories_kcal'], name='dish_calories_idx'),
+            models.Index(fields=['protein_g'], name='dish_protein_idx'),
+            models.Index(fields=['veg_class', 'calories_kcal'], name='dish_planner_idx',
+                         condition=models.Q(is_banned=False) & (models.Q(is_main=True) | models.Q(is_side=True))),
+        ]
         verbose_name = 'Dish'
         verbose_name_plural = 'Dishes'
 
+    def save(self, *args, **kwargs):
+        # `ingredients` is what the admin edits; re-derive the list whenever the
+        # two disagree (the importer always writes them consistently).
+        if ', '.join(self.ingredients_list or []) != (self.ingredients or ''):
+            self.ingredients_list = split_ingredients(self.ingredients)
+        self.refresh_flags()
+        super().save(*args, **kwargs)
+
+    def refresh_flags(self):
+        """Recompute the derived planner columns from name and macros; True if any changed."""
+        from vitaa_app.meal_planner_service import dish_flags
+
+        flags = dish_flags(self.dish_name, self.calories_kcal, self.protein_g, self.fat_g, self.carbohydrate_g)
+        changed = any(getattr(self, k) != v for k, v in flags.items())
+        for k, v in flags.items():
+            setattr(self, k, v)
+        return changed
+
     def __str__(self):
         return self.dish_name
 
@@ -49,4 +124,75 @@ class AllergenDish(models.Model):
         verbose_name_plural = 'Allergen Dishes'
 
     def __str__(self):
-        return f"{self.dish.dish_name} - {self.allergen.allergen_name}"
\ No newline at end of file
+        return f"{self.dish.dish_name} - {self.allergen.allergen_name}"
+
+class CatalogChange(models.Model):
+    """
+    Append-only log of catalog writes. Every Dish / AllergenDish save or
+    delete, and every Allergen save (for each linked dish), appends a row (see
+    vitaa_app.signals); the highest version is the catalog version used for
+    ETags and cache keys. Queryset .update() and bulk writes send no signals
+    and must append their own rows.
+    """
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    OP_CHOICES = [(UPSERT, 'Upsert'), (DELETE, 'Delete')]
+
+    version = models.BigAutoField(primary_key=True)
+    dish_id = models.IntegerField(db_index=True)
+    op = models.CharField(max_length=8, choices=OP_CHOICES)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'catalog_change'
+        verbose_name = 'Catalog Change'
+        verbose_name_plural = 'Catalog Changes'
+
+    def __str__(self):
+        return f"v{self.version} {self.op} dish {self.dish_id}"
+
+
+class AnalysisJob(models.Model):
+    """A health analysis forwarded to n8n in the background (see vitaa_app.jobs)."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    job_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=QUEUED)
+    payload = models.JSONField()
+    result = models.JSONField(null=True, blank=True)
+    error = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'analysis_job'
+        verbose_name = 'Analysis Job'
+        verbose_name_plural = 'Analysis Jobs'
+
+    def __str__(self):
+        return f"{self.job_id} ({self.status})"
+
+
+class UserDishHistory(models.Model):
+    """
+    Dishes recently served to a user, as two rolling Bloom filters (see
+    vitaa_app.dish_history): `recent` for the current window, `previous` for
+    the one before. A few hundred bytes per user regardless of catalog size.
+    """
+    user_id = models.CharField(max_length=64, primary_key=True)
+    recent = models.BinaryField()
+    previous = models.BinaryField()
+    window_started_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'user_dish_history'
+        verbose_name = 'User Dish History'
+        verbose_name_plural = 'User Dish Histories'
+
+    def __str__(self):
+        return self.user_id
@@ -0,0 +1,80 @@
+# vitaa_app/profiles.py
+from typing import Dict, List
+
+# Flat client profile (as posted to /api/plan/health/) -> calc_targets payload
+# and planner goals. Shared by the view and the bulk_plans command.
+
+# map activity_frequency -> utils.calc_targets activity_level
+ACTIVITY_MAP = {
+    "sedentary": "sedentary",
+    "low": "lightly_active",
+    "medium": "moderately_active",
+    "high": "very_active",
+    "very_high": "extra_active",
+}
+
+
+def norm(s):
+    return str(s or "").strip()
+
+
+def term_list(value) -> List:
+    """A list-valued diet field as a list: a bare string is one term, not its characters."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def diet_from_body(body: Dict) -> Dict:
+    """Flat request fields -> goals["inputs"]["diet"] for the planner."""
+    diet_pref = norm(body.get("diet_preference")).lower()
+    if diet_pref in {"veg", "vegetarian"}:
+        diet_pref = "vegetarian"
+    elif diet_pref in {"vegan"}:
+        diet_pref = "vegan"
+    elif diet_pref in {"non-veg", "non vegetarian", "non_vegetarian"}:
+        diet_pref = "non-veg"
+    elif not diet_pref:
+        diet_pref = "any"
+
+    allergies = [str(a).strip().lower() for a in term_list(body.get("allergies"))]
+
+    return {
+        "diet_preference": diet_pref,
+        "include_eggs": bool(body.get("include_eggs", True)),
+        "allergies": allergies,
+        "exclude_ingredients": term_list(body.get("exclude_ingredients")),
+        "dislikes": term_list(body.get("dislikes")),
+    }
+
+
+def targets_profile(body: Dict) -> Dict:
+    """calc_targets payload; KeyError for a missing field, ValueError for a bad one."""
+    activity_freq = norm(body.get("activity_frequency")).lower()
+    activity_level = ACTIVITY_MAP.get(activity_freq)
+    if not activity_level:
+        raise ValueError("activity_frequency must be one of: " + ", ".join(ACTIVITY_MAP.keys()))
+
+    return {
+        "age": int(body["age"]),
+        "sex": norm(body["sex"]).lower(),
+        "height_cm": float(body["height_cm"]),
+        "weight_kg": float(body["weight_kg"]),
+        "activity_level": activity_level,
+    }
+
+
+def planner_goals(body: Dict, calories_kcal: float) -> Dict:
+    goals = {
+        "energy": {"target_kcal": calories_kcal},
+        "inputs": {
+            "fitness_goal": norm(body.get("fitness_goal")).lower() or "maintenance",
+            "user_id": norm(body.get("user_id")) or None,
+            "diet": diet_from_body(body),
+        },
+    }
+    if body.get("time_budget_ms") is not None:
+        goals["time_budget_ms"] = float(body["time_budget_ms"])
+    return goals
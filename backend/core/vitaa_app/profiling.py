@@ -0,0 +1,60 @@
+# vitaa_app/profiling.py
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+# In-process sampling profiler for single requests: a helper thread reads the
+# request thread's stack every `interval_s` and counts identical stacks.
+# Output is the collapsed-stack format flamegraph.pl / speedscope read:
+#     frame;frame;frame <count>
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval_s: float = 0.005):
+        self.thread_id = thread_id
+        self.interval_s = max(0.001, interval_s)
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="vitaa-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+
+def write_capture(directory: str, capture_id: str, samples: Counter, meta: Dict) -> str:
+    """Write <id>.folded (collapsed stacks) and <id>.json (metadata); returns the .folded path."""
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, f"{time.strftime('%Y%m%dT%H%M%S')}_{capture_id}")
+    with open(stem + ".folded", "w", encoding="utf-8") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+    with open(stem + ".json", "w", encoding="utf-8") as f:
+        json.dump({**meta, "samples": sum(samples.values()), "stacks": len(samples)}, f, indent=2)
+    return stem + ".folded"
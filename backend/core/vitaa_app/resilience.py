@@ -0,0 +1,132 @@
+# vitaa_app/resilience.py
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+    def __init__(self, name: str, retry_after_s: float):
+        super().__init__(f"{name} circuit is open; retry in {retry_after_s:.0f}s")
+        self.retry_after_s = retry_after_s
+
+
+class BulkheadFullError(Exception):
+    """Raised when all concurrency slots for a dependency are taken."""
+
+    def __init__(self, name: str, retry_after_s: float = 1.0):
+        super().__init__(f"too many in-flight {name} calls")
+        self.retry_after_s = retry_after_s
+
+
+def retry_after_header(e) -> str:
+    return str(max(1, math.ceil(getattr(e, "retry_after_s", 1))))
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures;
+    open -> half-open once `reset_timeout_s` has passed, letting up to
+    `half_open_probes` calls through; a probe success closes the circuit,
+    a probe failure re-opens it for another `reset_timeout_s`.
+
+    Usage:
+        breaker.allow()          # raises CircuitOpenError when open
+        ... call ...
+        breaker.on_success() / breaker.on_failure() / breaker.on_abandon()
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout_s: float = 30.0,
+                 half_open_probes: int = 1, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout_s = reset_timeout_s
+        self.half_open_probes = max(1, half_open_probes)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout_s:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._probes = 0
+
+    def allow(self):
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return
+            remaining = self.reset_timeout_s - (self._clock() - self._opened_at)
+            raise CircuitOpenError(self.name, max(remaining, 1.0))
+
+    def on_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._probes = 0
+
+    def on_failure(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open()
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._open()
+
+    def on_abandon(self):
+        """The allowed call never reached the dependency (e.g. bulkhead full)."""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes:
+                self._probes -= 1
+
+
+class Bulkhead:
+    """Caps concurrent calls to a dependency; waits at most `wait_s` for a slot."""
+
+    def __init__(self, name: str, max_concurrent: int = 8, wait_s: float = 0.5):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.wait_s = wait_s
+        self._sem = threading.BoundedSemaphore(self.max_concurrent)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @contextmanager
+    def slot(self):
+        if not self._sem.acquire(timeout=self.wait_s):
+            raise BulkheadFullError(self.name)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._sem.release()
@@ -0,0 +1,65 @@
+# vitaa_app/signals.py
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from vitaa_app import catalog
+from vitaa_app.db_routers import schedule_replica_refresh
+from vitaa_app.models import Allergen, AllergenDish, CatalogChange, Dish, allergen_bit, allergen_mask
+
+# Only per-instance saves and deletes send these signals. Queryset
+# .update() and bulk_create / bulk_update / raw SQL writes to catalog tables
+# must log their own CatalogChange rows, invalidate the version and schedule
+# the replica refresh (as refresh_dish_flags does), or caches keep serving
+# the old rows.
+
+
+def _log_changes(dish_ids, op):
+    changes = [CatalogChange(dish_id=d, op=op) for d in dish_ids]
+    if not changes:
+        return
+    CatalogChange.objects.bulk_create(changes, batch_size=500)
+    # Other workers notice the new version within CATALOG_VERSION_TTL_S;
+    # this one drops its cached version as soon as the write commits.
+    transaction.on_commit(catalog.invalidate_version)
+    schedule_replica_refresh()
+
+
+def _log_change(dish_id, op):
+    _log_changes([dish_id], op)
+
+
+@receiver(post_save, sender=Dish)
+def dish_saved(sender, instance, **kwargs):
+    _log_change(instance.dish_id, CatalogChange.UPSERT)
+
+
+@receiver(post_delete, sender=Dish)
+def dish_deleted(sender, instance, **kwargs):
+    _log_change(instance.dish_id, CatalogChange.DELETE)
+
+
+@receiver(post_save, sender=AllergenDish)
+@receiver(post_delete, sender=AllergenDish)
+def allergen_dish_changed(sender, instance, **kwargs):
+    # An allergen link changing is an update of the dish it belongs to.
+    dishes = Dish.objects.filter(dish_id=instance.dish_id)
+    if kwargs.get("created"):
+        dishes.update(allergen_mask=F("allergen_mask").bitor(allergen_bit(instance.allergen_id)))
+    else:
+        # Read the links from default: the replica may not have this change yet.
+        dishes.update(allergen_mask=allergen_mask(
+            AllergenDish.objects.using("default").filter(dish_id=instance.dish_id)
+            .values_list("allergen_id", flat=True)))
+    _log_change(instance.dish_id, CatalogChange.UPSERT)
+
+
+@receiver(post_save, sender=Allergen)
+def allergen_saved(sender, instance, created, **kwargs):
+    # A rename changes the allergens of every dish linked to it. (Deleting an
+    # allergen cascades to its AllergenDish rows, which log themselves.)
+    if created:
+        return
+    _log_changes(AllergenDish.objects.using("default").filter(allergen_id=instance.pk)
+                 .values_list("dish_id", flat=True).distinct(), CatalogChange.UPSERT)
@@ -0,0 +1,91 @@
+# vitaa_app/single_flight.py
+import json
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+
+# Seconds a follower waits for the leader before computing on its own.
+DEFAULT_WAIT_S = 10.0
+
+
+def canonical_key(group: str, payload: Any) -> str:
+    """Stable key for a JSON-like payload: same content -> same key, whatever the key order."""
+    return group + ":" + json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller (leader)
+    runs the function, everyone arriving while it runs (followers) waits for
+    and receives the leader's result or exception.
+
+    Nothing is cached: once the leader finishes, the next call with the same
+    key runs the function again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], Any], wait_s: Optional[float] = None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+            return call.result
+
+        if wait_s is None:
+            wait_s = DEFAULT_WAIT_S
+        if not call.done.wait(wait_s):
+            # Leader is too slow for this caller's budget: do the work ourselves.
+            return fn()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+_flight = SingleFlight()
+
+
+def _wait_for(group: str) -> float:
+    """SINGLE_FLIGHT_WAIT_S is either one number or a {group: seconds} dict."""
+    conf = getattr(settings, "SINGLE_FLIGHT_WAIT_S", DEFAULT_WAIT_S)
+    if isinstance(conf, dict):
+        return float(conf.get(group, DEFAULT_WAIT_S))
+    return float(conf)
+
+
+def coalesce(group: str, fn: Callable[[Any], Any], payload: Any):
+    """
+    Run fn(payload) once per distinct in-flight payload.
+    Disabled (plain call) when settings.SINGLE_FLIGHT_ENABLED is False.
+    """
+    if not getattr(settings, "SINGLE_FLIGHT_ENABLED", True):
+        return fn(payload)
+    return _flight.do(canonical_key(group, payload), lambda: fn(payload), wait_s=_wait_for(group))
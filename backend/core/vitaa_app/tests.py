@@ -1,5 +1,72 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from unittest import mock
+
+import numpy as np
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, override_settings
+from vitaa_app import catalog, health_analysis, memory, warmup
+from vitaa_app.models import Allergen, AllergenDish, Dish, allergen_mask
+from vitaa_app.dish_history import bloom_add, bloom_contains
+from vitaa_app.ingredient_index import IngredientIndex
+from vitaa_app.macro_index import MacroKDTree
+from vitaa_app.resilience import CircuitBreaker, CircuitOpenError
+from vitaa_app.meal_planner_service import _candidate_pools, generate_meal_plan, knobs, suggest_swaps
 from vitaa_app.utils import calc_targets
+from vitaa_app.single_flight import SingleFlight, canonical_key
+
+
+def make_dish(name, kcal=400, protein=30, fat=10, carbs=40, veg_class="non-veg",
+              ingredients="chicken, rice", allergens=()):
+    dish = Dish.objects.create(
+        dish_name=name, image_url=f"https://img.example/{name}.jpg",
+        ingredients=ingredients, veg_class=veg_class, calories_kcal=kcal,
+        protein_g=protein, fat_g=fat, carbohydrate_g=carbs,
+    )
+    for a in allergens:
+        allergen, _ = Allergen.objects.get_or_create(allergen_name=a)
+        AllergenDish.objects.create(dish=dish, allergen=allergen)
+    return dish
+
+
+def seed_planner_catalog():
+    """A small catalog with enough mains and sides for three meals."""
+    make_dish("Grilled Chicken", kcal=450, protein=40, fat=12, carbs=30, ingredients="chicken breast, garlic")
+    make_dish("Pork Chop", kcal=520, protein=38, fat=20, carbs=25, ingredients="pork, black pepper")
+    make_dish("Beef Stir Fry", kcal=480, protein=35, fat=15, carbs=40, ingredients="beef, soy sauce, onion")
+    make_dish("Salmon Bowl", kcal=550, protein=36, fat=18, carbs=50, ingredients="salmon, rice")
+    make_dish("Tofu Curry", kcal=420, protein=22, fat=14, carbs=45, veg_class="vegan",
+              ingredients="tofu, coconut milk, curry paste")
+    make_dish("Lentil Stew", kcal=380, protein=20, fat=6, carbs=55, veg_class="vegan",
+              ingredients="lentils, tomatoes, onion")
+    make_dish("Garden Salad", kcal=150, protein=4, fat=7, carbs=15, veg_class="vegan",
+              ingredients="lettuce, tomatoes, cucumber")
+    make_dish("Boiled Greens", kcal=130, protein=5, fat=4, carbs=12, veg_class="vegan",
+              ingredients="bok choy, garlic")
+    make_dish("Mushroom Soup", kcal=200, protein=6, fat=9, carbs=20, veg_class="vegetarian",
+              ingredients="mushrooms, cream")
+
+
+def plan_dish_names(plan):
+    return {d["dish_name"] for meal in plan for d in meal["Dishes"]}
+
+
+def plan_goals(target_kcal=2000, **diet):
+    return {
+        "energy": {"target_kcal": target_kcal},
+        "inputs": {"fitness_goal": "maintenance", "diet": {"diet_preference": "any", **diet}},
+    }
+
 
 class CalcTargetsTests(TestCase):
     '''
@@ -42,4 +109,1211 @@ class CalcTargetsTests(TestCase):
         # Macro split percentages should sum ~100
         split = result["targets"]["macro_split_pct"]
         total_pct = split["protein"] + split["fat"] + split["carbs"]
-        self.assertTrue(98 <= total_pct <= 102)  # allow rounding wiggle
\ No newline at end of file
+        self.assertTrue(98 <= total_pct <= 102)  # allow rounding wiggle
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_canonical_key_ignores_key_order(self):
+        self.assertEqual(canonical_key("plan", {"a": 1, "b": [1, 2]}),
+                         canonical_key("plan", {"b": [1, 2], "a": 1}))
+        self.assertNotEqual(canonical_key("plan", {"a": 1}), canonical_key("targets", {"a": 1}))
+
+    def test_concurrent_identical_calls_run_once(self):
+        flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def work():
+            calls.append(1)
+            release.wait(2)
+            return {"ok": True}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("k", work, wait_s=5)))
+                   for _ in range(5)]
+        for t in threads:
+            t.start()
+        while flight.in_flight() == 0:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"ok": True}] * 5)
+        self.assertEqual(flight.in_flight(), 0)
+
+
+class DishCatalogTests(TestCase):
+    url = "/api/catalog/dishes/"
+
+    def setUp(self):
+        catalog.reset()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dish = make_dish("Chicken Rice", allergens=["soy"])
+
+    def test_full_catalog_with_etag_and_304(self):
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        body = resp.json()
+        self.assertEqual([d["dish_name"] for d in body["dishes"]], ["Chicken Rice"])
+        self.assertEqual(body["dishes"][0]["allergens"], ["soy"])
+        self.assertEqual(body["dishes"][0]["ingredients"], ["chicken", "rice"])
+
+        etag = resp["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+    def test_delta_since_version(self):
+        version = self.client.get(self.url).json()["version"]
+        deleted_id = self.dish.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            make_dish("Tofu Salad", veg_class="vegan")
+            self.dish.delete()
+
+        resp = self.client.get(self.url, {"since": version})
+        self.assertEqual(resp.status_code, 200)
+        delta = resp.json()
+        self.assertGreater(delta["version"], version)
+        self.assertEqual([d["dish_name"] for d in delta["upserts"]], ["Tofu Salad"])
+        self.assertEqual(delta["deleted"], [deleted_id])
+
+    def test_allergen_rename_and_delete_change_linked_dishes(self):
+        resp = self.client.get(self.url)
+        etag, version = resp["ETag"], resp.json()["version"]
+        with self.captureOnCommitCallbacks(execute=True):
+            make_dish("Plain Rice")  # not linked to soy: not reported for the rename
+        version_after_insert = self.client.get(self.url).json()["version"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            soy = Allergen.objects.get(allergen_name="soy")
+            soy.allergen_name = "soybeans"
+            soy.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        delta = self.client.get(self.url, {"since": version_after_insert}).json()
+        self.assertEqual([(d["dish_name"], d["allergens"]) for d in delta["upserts"]],
+                         [("Chicken Rice", ["soybeans"])])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            soy.delete()
+        delta = self.client.get(self.url, {"since": version}).json()
+        self.assertEqual(sorted((d["dish_name"], d["allergens"]) for d in delta["upserts"]),
+                         [("Chicken Rice", []), ("Plain Rice", [])])
+        self.assertEqual(Dish.objects.get(pk=self.dish.pk).allergen_mask, 0)
+
+
+class DishSearchTests(TestCase):
+    url = "/api/catalog/dishes/search/"
+
+    def setUp(self):
+        catalog.reset()
+        make_dish("Grilled Chicken", kcal=450, protein=40)
+        make_dish("Chicken Satay", kcal=380, protein=30, allergens=["peanuts"])
+        make_dish("Tofu Salad", kcal=250, protein=15, veg_class="vegan")
+        pho = make_dish("Beef Noodle Soup", kcal=500, protein=35)
+        pho.dish_vi_name = "Phở bò"
+        pho.save()
+
+    def _names(self, **params):
+        return [d["dish_name"] for d in self.client.get(self.url, params).json()["results"]]
+
+    def test_name_prefix_in_any_locale(self):
+        self.assertEqual(self._names(q="chick"), ["Grilled Chicken", "Chicken Satay"])
+        self.assertEqual(self._names(q="pho b"), ["Beef Noodle Soup"])
+
+    def test_filters(self):
+        self.assertEqual(self._names(veg_class="vegan"), ["Tofu Salad"])
+        self.assertEqual(self._names(min_kcal=400, min_protein=36), ["Grilled Chicken"])
+        self.assertEqual(self._names(q="chicken", exclude_allergens="peanuts"), ["Grilled Chicken"])
+        # Allergen terms match like plan allergies do: "peanut" excludes "peanuts".
+        self.assertEqual(self._names(q="chicken", exclude_allergens="Peanut"), ["Grilled Chicken"])
+
+    def test_rows_come_from_the_page_query_not_a_lagging_snapshot(self):
+        self.assertEqual(len(self._names()), 4)  # caches the snapshot for CATALOG_VERSION_TTL_S
+        make_dish("Chicken Katsu", kcal=600, protein=35)  # commit hooks not run: the snapshot lags
+        body = self.client.get(self.url, {"limit": 5}).json()
+        self.assertEqual([d["dish_name"] for d in body["results"]][-1], "Chicken Katsu")
+        self.assertIsNone(body["next_cursor"])
+
+    def test_keyset_pagination(self):
+        seen, cursor = [], ""
+        while True:
+            body = self.client.get(self.url, {"limit": 1, "cursor": cursor}).json()
+            seen.extend(d["dish_name"] for d in body["results"])
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 4)
+        self.assertEqual(len(set(seen)), 4)
+
+
+class IngredientExclusionTests(TestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+
+    def test_index_matches_words_plurals_and_phrases(self):
+        index = IngredientIndex([(1, ["Soy Sauce", "garlic"]), (2, ["soy beans"]), (3, ["tomatoes"])])
+        self.assertEqual(index.lookup("soy"), {1, 2})
+        self.assertEqual(index.lookup("soy sauce"), {1})
+        self.assertEqual(index.lookup("tomato"), {3})
+        self.assertEqual(index.lookup("basil"), set())
+
+    def test_planner_drops_excluded_and_disliked_dishes(self):
+        goals = plan_goals(exclude_ingredients=["pork"], dislikes=["mushroom", "soy sauce"])
+        for _ in range(5):
+            names = plan_dish_names(generate_meal_plan(goals))
+            self.assertTrue(names)
+            self.assertFalse(names & {"Pork Chop", "Mushroom Soup", "Beef Stir Fry"})
+
+    def test_single_string_terms(self):
+        from vitaa_app.profiles import diet_from_body
+
+        diet = diet_from_body({"exclude_ingredients": "pork", "dislikes": "mushroom", "allergies": "Soy"})
+        self.assertEqual((diet["exclude_ingredients"], diet["dislikes"], diet["allergies"]),
+                         (["pork"], ["mushroom"], ["soy"]))
+
+        goals = plan_goals(exclude_ingredients="pork", dislikes="mushroom")
+        for _ in range(5):
+            names = plan_dish_names(generate_meal_plan(goals))
+            self.assertTrue(names)
+            self.assertFalse(names & {"Pork Chop", "Mushroom Soup"})
+
+
+class DishSwapTests(TestCase):
+    url = "/api/plan/swap/"
+
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+
+    def test_kdtree_matches_brute_force_with_mask(self):
+        rng = np.random.default_rng(7)
+        points = rng.uniform([100, 0, 0, 0], [900, 60, 40, 100], size=(500, 4))
+        mask = rng.random(500) < 0.6
+        tree = MacroKDTree(points)
+        q = points[3]
+        scaled = points / tree.scale
+        dists = np.sqrt(((scaled - q / tree.scale) ** 2).sum(axis=1))
+        dists[~mask] = np.inf
+        expected = list(np.argsort(dists)[:5])
+        self.assertEqual([r for _, r in tree.query(q, k=5, mask=mask)], expected)
+
+    def test_swap_respects_diet_and_excludes(self):
+        resp = self.client.post(self.url, json.dumps({
+            "dish_name": "Tofu Curry", "k": 3, "diet_preference": "vegan",
+            "exclude": ["Lentil Stew"],
+        }), content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        names = [d["dish_name"] for d in resp.json()["swaps"]]
+        self.assertEqual(len(names), 2)
+        self.assertEqual(set(names), {"Garden Salad", "Boiled Greens"})
+
+    def test_swaps_use_stored_flags_not_per_row_checks(self):
+        make_dish("Chocolate Cake", kcal=420, protein=6, fat=18, carbs=60, veg_class="vegetarian",
+                  ingredients="flour, chocolate")
+        catalog.reset()
+        with mock.patch("vitaa_app.meal_planner_service.is_banned_row") as per_row:
+            swaps = suggest_swaps("Tofu Curry", {}, k=20)["swaps"]
+        per_row.assert_not_called()
+        names = {d["dish_name"] for d in swaps}
+        self.assertNotIn("Chocolate Cake", names)
+        self.assertIn("Lentil Stew", names)
+
+    def test_unknown_dish(self):
+        resp = self.client.post(self.url, json.dumps({"dish_name": "Nope"}), content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+
+
+HEALTH_PROFILE = {
+    "Age": 40, "Sex": "Male", "FamilyHistory": {"Diabetes": "No", "Hypertension": "Yes"},
+    "WeightKg": 90, "HeightCm": 175, "WaistCircumferenceCm": 100,
+    "ActivityLevel": "Low", "Smoking": "No", "AlcoholConsumption": "Occasional",
+}
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_probes_and_closes(self):
+        now = [0.0]
+        breaker = CircuitBreaker("t", failure_threshold=2, reset_timeout_s=10, clock=lambda: now[0])
+        for _ in range(2):
+            breaker.allow()
+            breaker.on_failure()
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow()
+
+        now[0] = 11
+        breaker.allow()  # the half-open probe
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow()  # only one probe at a time
+        breaker.on_failure()
+        self.assertEqual(breaker.state, "open")
+
+        now[0] = 22
+        breaker.allow()
+        breaker.on_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_open_circuit_fails_fast_in_view(self):
+        breaker = CircuitBreaker("n8n", failure_threshold=1, reset_timeout_s=30)
+        breaker.on_failure()
+        url = "/api/webhooks/user-profile/"
+        with mock.patch("vitaa_app.health_analysis._breaker", breaker), \
+                mock.patch("vitaa_app.health_analysis.requests.post") as post:
+            resp = self.client.post(url, json.dumps(HEALTH_PROFILE), content_type="application/json")
+            self.assertEqual(resp.status_code, 503)
+            self.assertGreaterEqual(int(resp["Retry-After"]), 1)
+
+            with override_settings(N8N_FALLBACK_MODE="local"):
+                resp = self.client.post(url, json.dumps(HEALTH_PROFILE), content_type="application/json")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json()["local_analysis"]["anthropometrics"]["bmi"], 29.4)
+            post.assert_not_called()
+
+
+def _fake_n8n_response(status=200, body=None):
+    resp = mock.Mock(status_code=status, text=json.dumps(body or {}))
+    resp.json.return_value = body or {}
+    resp.raise_for_status.return_value = None
+    return resp
+
+
+class AnalysisJobTests(TransactionTestCase):
+    url = "/api/webhooks/user-profile/"
+
+    def test_async_job_runs_in_background_and_long_polls(self):
+        release = threading.Event()
+
+        def slow_post(*args, **kwargs):
+            release.wait(5)
+            return _fake_n8n_response(body={"risk": "moderate"})
+
+        with mock.patch("vitaa_app.health_analysis.requests.post", side_effect=slow_post):
+            resp = self.client.post(self.url + "?mode=async", json.dumps(HEALTH_PROFILE),
+                                    content_type="application/json")
+            self.assertEqual(resp.status_code, 202)
+            body = resp.json()
+            self.assertIn(body["status"], ("queued", "running"))
+            self.assertEqual(resp["Location"], body["status_url"])
+
+            status_path = f"{self.url}jobs/{body['job_id']}/"
+            self.assertIn(self.client.get(status_path).json()["status"], ("queued", "running"))
+            release.set()
+            done = self.client.get(status_path, {"wait": 5}).json()
+
+        self.assertEqual(done["status"], "done")
+        self.assertEqual(done["webhook_response"], {"risk": "moderate"})
+
+    def test_stale_jobs_are_reported_lost(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from vitaa_app import jobs
+        from vitaa_app.models import AnalysisJob
+
+        long_ago = timezone.now() - timedelta(hours=1)
+        queued = AnalysisJob.objects.create(payload=HEALTH_PROFILE)
+        self.assertEqual(jobs.wait_for_job(queued.pk).status, AnalysisJob.QUEUED)  # waiting for a worker
+        AnalysisJob.objects.filter(pk=queued.pk).update(created_at=long_ago)
+        self.assertEqual(jobs.wait_for_job(queued.pk).status, AnalysisJob.FAILED)  # its worker went away
+
+        # Measured from the start, not the creation, once running.
+        running = AnalysisJob.objects.create(payload=HEALTH_PROFILE, status=AnalysisJob.RUNNING,
+                                             started_at=timezone.now())
+        AnalysisJob.objects.filter(pk=running.pk).update(created_at=long_ago)
+        self.assertEqual(jobs.wait_for_job(running.pk).status, AnalysisJob.RUNNING)
+        AnalysisJob.objects.filter(pk=running.pk).update(started_at=long_ago)
+        self.assertEqual(jobs.wait_for_job(running.pk).status, AnalysisJob.FAILED)
+
+        # A worker that finally picks up a job reported lost leaves it as the client saw it.
+        with mock.patch("vitaa_app.health_analysis.requests.post") as post:
+            jobs._run_job(str(running.pk))
+        post.assert_not_called()
+        running.refresh_from_db()
+        self.assertEqual((running.status, running.error["status"]), (AnalysisJob.FAILED, 504))
+
+    def test_rolled_back_submission_leaves_no_wakeup(self):
+        from django.db import transaction
+        from vitaa_app import jobs
+
+        with mock.patch("vitaa_app.jobs._get_executor") as executor:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                job = jobs.submit_analysis(HEALTH_PROFILE)
+                raise RuntimeError
+        executor.assert_not_called()
+        self.assertNotIn(str(job.pk), jobs._done_events)
+
+    def test_bad_payload_rejected_synchronously(self):
+        resp = self.client.post(self.url, json.dumps({"Age": "x"}), content_type="application/json",
+                                HTTP_PREFER="respond-async")
+        self.assertEqual(resp.status_code, 400)
+
+
+class CatalogReplicaTests(TransactionTestCase):
+    databases = {"default", "catalog"}
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "replica.sqlite3")
+        for patcher in (mock.patch("vitaa_app.db_routers._replica_path", return_value=self.path),
+                        mock.patch("vitaa_app.apps._started_pid", None)):  # not a server process
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _replica(self, sql):
+        import sqlite3
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _reading_replica(self):
+        """Serve the "catalog" alias from the replica file (under the test runner it mirrors default)."""
+        original = connections["catalog"]
+        replica = original.__class__(
+            {**original.settings_dict, "NAME": f"file:{self.path}?mode=ro",
+             "OPTIONS": {"init_command": "PRAGMA query_only=1;"}}, "catalog")
+        connections["catalog"] = replica
+        try:
+            yield
+        finally:
+            replica.close()
+            connections["catalog"] = original
+
+    def test_refresh_copies_only_catalog_tables(self):
+        from vitaa_app.db_routers import refresh_catalog_replica
+        from vitaa_app.models import AnalysisJob
+
+        make_dish("Grilled Chicken", allergens=["soy"])
+        dropped = make_dish("Pork Chop")
+        AnalysisJob.objects.create(payload=HEALTH_PROFILE)
+        self.assertTrue(refresh_catalog_replica())
+
+        tables = {t for (t,) in self._replica("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertLessEqual({"dish", "allergen", "allergen_dish", "catalog_change"}, tables)
+        self.assertFalse(tables & {"analysis_job", "user_dish_history", "django_migrations"})
+        self.assertIn(("dish_planner_idx",), self._replica("SELECT name FROM sqlite_master WHERE type = 'index'"))
+        self.assertEqual(self._replica("PRAGMA journal_mode"), [("delete",)])
+        self.assertEqual(self._replica("SELECT count(*) FROM allergen_dish"), [(1,)])
+
+        dropped.delete()
+        refresh_catalog_replica()  # replaces the previous copy
+        self.assertEqual(self._replica("SELECT dish_name FROM dish"), [("Grilled Chicken",)])
+
+    def test_allergen_mask_is_rebuilt_from_default_not_the_replica(self):
+        dish = make_dish("Satay", allergens=["peanut", "soy"])  # refreshes the replica
+        soy = Allergen.objects.get(allergen_name="soy")
+        with self._reading_replica(), mock.patch("vitaa_app.db_routers.request_replica_refresh"):
+            AllergenDish.objects.filter(dish=dish, allergen__allergen_name="peanut").delete()
+            self.assertEqual(AllergenDish.objects.filter(dish=dish).count(), 2)  # the replica is stale
+        self.assertEqual(Dish.objects.using("default").get(pk=dish.pk).allergen_mask, allergen_mask([soy.pk]))
+
+    def test_reimport_replaces_links_despite_a_stale_replica(self):
+        def import_with(allergens):
+            path = os.path.join(os.path.dirname(self.path), "dishes.csv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("dish_name,image_url,ingredients,diet_class,nutritional_profile,allergens\n")
+                f.write(f'Satay,https://img.example/satay.jpg,"chicken, peanuts",non-veg,'
+                        f'"{{""calories_kcal"": 400}}",{allergens}\n')
+            call_command("import_food_data", path, stdout=io.StringIO())
+
+        from vitaa_app.db_routers import refresh_catalog_replica
+
+        refresh_catalog_replica()  # an empty replica, not yet showing the imports below
+        with self._reading_replica(), mock.patch("vitaa_app.db_routers.request_replica_refresh"):
+            import_with("peanut")
+            import_with("soy")
+        links = AllergenDish.objects.using("default").values_list("allergen__allergen_name", flat=True)
+        self.assertEqual(list(links), ["soy"])
+
+    def test_management_command_refreshes_before_it_exits(self):
+        make_dish("Grilled Chicken")
+        # No request served in this process: the refresh runs when the write
+        # commits, not on a background timer the process might not outlive.
+        self.assertEqual(self._replica("SELECT dish_name FROM dish"), [("Grilled Chicken",)])
+
+    @override_settings(CATALOG_REPLICA_REFRESH_DELAY_S=0.2)
+    @mock.patch("vitaa_app.apps.serving_requests", return_value=True)
+    def test_writes_share_one_background_refresh(self, _serving):
+        done = threading.Event()
+        calls = []
+
+        def refresh():
+            calls.append(threading.current_thread().name)
+            done.set()
+
+        with mock.patch("vitaa_app.db_routers.refresh_catalog_replica", side_effect=refresh):
+            for i in range(3):
+                make_dish(f"Dish {i}")
+            self.assertEqual(calls, [])  # not on the writing thread
+            self.assertTrue(done.wait(5))
+            time.sleep(0.3)
+        self.assertEqual(calls, ["vitaa-replica-refresh"])
+
+
+class DishHistoryTests(TestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+
+    def test_bloom_filter_membership(self):
+        bits = bloom_add(None, [3, 17, 4096])
+        self.assertEqual(len(bits), 256)
+        self.assertEqual(list(bloom_contains(bits, [3, 17, 4096, 5, 18])), [True, True, True, False, False])
+
+    def test_user_gets_different_mains_next_time(self):
+        mains = {"Grilled Chicken", "Pork Chop", "Beef Stir Fry", "Salmon Bowl", "Tofu Curry", "Lentil Stew"}
+        goals = plan_goals()
+        goals["inputs"]["user_id"] = "user-1"
+        first = plan_dish_names(generate_meal_plan(goals)) & mains
+        second = plan_dish_names(generate_meal_plan(goals)) & mains
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 3)
+        self.assertFalse(first & second)
+
+
+class WarmupTests(TransactionTestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+        catalog.reset()
+
+    def tearDown(self):
+        warmup._state.update(status="pending", error=None, duration_ms=None, finished_at=0.0)
+
+    def test_ready_only_after_warmup(self):
+        self.assertEqual(self.client.get("/api/health/ready/").status_code, 200)  # disabled
+
+        with override_settings(VITAA_WARMUP_ENABLED=True):
+            started = threading.Event()
+            release = threading.Event()
+            real_warm_up = warmup.warm_up
+
+            def gated():
+                started.set()
+                release.wait(5)
+                real_warm_up()
+
+            with mock.patch.object(warmup, "warm_up", gated):
+                self.assertEqual(self.client.get("/api/health/ready/").status_code, 503)
+                started.wait(5)
+                release.set()
+                for _ in range(200):
+                    if warmup._state["status"] != "running":
+                        break
+                    time.sleep(0.01)
+            resp = self.client.get("/api/health/ready/")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("warmup_ms", resp.json())
+            self.assertGreater(catalog.pools.stats()["size"], 0)
+            self.assertNotIn("frame", catalog.get_snapshot()._built)  # plans load only eligible rows
+
+    def test_started_by_first_request_of_each_process(self):
+        from vitaa_app import apps
+
+        with override_settings(VITAA_WARMUP_ENABLED=True), \
+                mock.patch.object(apps, "_started_pid", None), \
+                mock.patch.object(warmup, "start") as start:
+            self.client.get("/api/catalog/dishes/search/", {"q": "tofu"})
+            self.client.get("/api/catalog/dishes/search/", {"q": "tofu"})
+            self.assertEqual(start.call_count, 1)
+
+            apps._started_pid = -1  # as seen from a forked child
+            self.client.get("/api/catalog/dishes/search/", {"q": "tofu"})
+            self.assertEqual(start.call_count, 2)
+
+    def test_fork_during_warmup_resets_state(self):
+        warmup._state.update(status="running")
+        warmup._reset_after_fork()
+        self.assertEqual(warmup._state["status"], "pending")
+
+        warmup._state.update(status="ready")
+        warmup._reset_after_fork()
+        self.assertEqual(warmup._state["status"], "ready")
+
+
+class BulkPlansCommandTests(TestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+        catalog.reset()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.src = os.path.join(self.tmp.name, "profiles.jsonl")
+        self.out = os.path.join(self.tmp.name, "plans.jsonl")
+        base = {"age": 30, "sex": "male", "height_cm": 175, "weight_kg": 78, "activity_frequency": "medium"}
+        rows = [dict(base, user_id="u1"), {"age": 30, "user_id": "bad"}, dict(base, user_id="u3")]
+        with open(self.src, "w") as f:
+            f.writelines(json.dumps(r) + "\n" for r in rows)
+
+    def _records(self):
+        with open(self.out) as f:
+            return [json.loads(line) for line in f]
+
+    def test_plans_every_row_and_resumes_from_checkpoint(self):
+        call_command("bulk_plans", self.src, self.out, workers=0, stdout=mock.MagicMock())
+        records = self._records()
+        self.assertEqual([r["row"] for r in records], [0, 1, 2])
+        self.assertIn("plan", records[0])
+        self.assertIn("error", records[1])
+
+        # Simulate a crash after the first row: checkpoint at row 1, junk after it.
+        with open(self.out) as f:
+            first = f.readline()
+        with open(self.out, "w") as f:
+            f.write(first + '{"partial": ')
+        with open(self.out + ".checkpoint", "w") as f:
+            json.dump({"input": os.path.abspath(self.src), "rows_done": 1, "offset": len(first)}, f)
+
+        call_command("bulk_plans", self.src, self.out, workers=0, stdout=mock.MagicMock())
+        self.assertEqual([r["user_id"] for r in self._records()], ["u1", "bad", "u3"])
+
+
+class LoadtestCommandTests(SimpleTestCase):
+    def test_percentiles_are_nearest_rank(self):
+        from vitaa_app.management.commands.loadtest import percentile
+
+        vals = list(range(1, 101))
+        self.assertEqual([percentile(vals, p) for p in (50, 90, 95, 99, 100)], [50, 90, 95, 99, 100])
+        self.assertEqual([percentile([1, 2, 3, 4], p) for p in (25, 50, 51, 99)], [1, 2, 3, 4])
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_schedule_does_not_drift(self):
+        from vitaa_app.management.commands.loadtest import send_times
+
+        times = list(send_times(10.0, 60.0, 30.0))
+        self.assertEqual(len(times), 1800)
+        self.assertEqual(times[0], 10.0)
+        self.assertAlmostEqual(times[-1], 10.0 + 1799 / 30.0, places=9)
+        self.assertEqual(len(list(send_times(0.0, 1.0, 3.0))), 3)
+
+    def test_open_loop_latency_includes_waiting_for_a_thread(self):
+        class Session:
+            def post(self, *args, **kwargs):
+                time.sleep(0.05)
+                return mock.Mock(status_code=200)
+
+        out = io.StringIO()
+        with mock.patch("vitaa_app.management.commands.loadtest.requests.Session", Session):
+            call_command("loadtest", "--rate", "100", "--duration", "0.2", "--max-in-flight", "1",
+                         "--mix", "targets=1", "--seed", "1", stdout=out)
+        lines = out.getvalue().splitlines()
+        count, _ok, _p50, _p90, _p95, p99, _max = lines[2].split()[1:8]
+        # 20 requests due 10 ms apart, served one at a time in 50 ms each:
+        # the last one is answered about 20 * 50 - 190 = 810 ms after it was due.
+        self.assertEqual(int(count), 20)
+        self.assertGreater(float(p99), 600)
+        self.assertTrue(lines[-1].startswith("19 of 20 requests were due while"))
+
+
+class ImportQueryBudgetTests(TestCase):
+    def test_import_stays_within_query_budget(self):
+        from django.conf import settings
+        from vitaa_app.management.commands.bench_import import run_import, write_synthetic_csv
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dishes.csv")
+            write_synthetic_csv(path, 40, seed=1)
+            first = run_import(path)
+            again = run_import(path)  # update path
+
+        self.assertEqual(Dish.objects.count(), 40)
+        self.assertTrue(AllergenDish.objects.exists())
+        for r in (first, again):
+            self.assertLessEqual(r["queries_per_row"], settings.IMPORT_QUERY_BUDGET_PER_ROW)
+
+
+def server_timing_queries(response):
+    """Query count from the Server-Timing header set by QueryAccountingMiddleware."""
+    db = next(m for m in response["Server-Timing"].split(", ") if m.startswith("db;"))
+    return int(db.split('desc="', 1)[1].split(" ", 1)[0])
+
+
+class QueryBudgetMixin:
+    """assertQueryBudget(response): queries <= settings.QUERY_BUDGETS[url name]."""
+
+    def assertQueryBudget(self, response):
+        from django.conf import settings
+        name = response.resolver_match.url_name
+        self.assertIn(name, settings.QUERY_BUDGETS, f"no query budget for route {name!r}")
+        used = server_timing_queries(response)
+        self.assertLessEqual(used, settings.QUERY_BUDGETS[name],
+                             f"{name} ran {used} queries (budget {settings.QUERY_BUDGETS[name]})")
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+
+    def _post(self, url, body):
+        catalog.reset()  # budgets hold on a cold catalog cache
+        return self.client.post(url, json.dumps(body), content_type="application/json")
+
+    def _get(self, url, **headers):
+        catalog.reset()
+        return self.client.get(url, headers=headers)
+
+    def test_every_api_route_within_budget(self):
+        from django.urls import get_resolver
+        profile = {"age": 30, "sex": "male", "height_cm": 175, "weight_kg": 78,
+                   "activity_frequency": "medium", "user_id": "u1"}
+        with mock.patch("vitaa_app.health_analysis.requests.post",
+                        return_value=_fake_n8n_response(body={"risk": "low"})):
+            submitted = self._post("/api/webhooks/user-profile/?mode=async", HEALTH_PROFILE)
+            job = submitted.json()
+            responses = [
+                submitted,
+                self._post("/api/nutrition/targets/", dict(profile, activity_level="sedentary")),
+                self._post("/api/mealplan/", plan_goals(2000)),
+                self._post("/api/plan/health/", profile),
+                self._post("/api/plan/swap/", {"dish_name": "Grilled Chicken"}),
+                self._post("/api/webhooks/user-profile/", HEALTH_PROFILE),
+                self._get(f"/api/webhooks/user-profile/jobs/{job['job_id']}/"),
+                self._get("/api/health/ready/"),
+                self._get("/api/catalog/dishes/"),
+                self._get("/api/catalog/dishes/search/?q=gr"),
+            ]
+            with override_settings(DIAGNOSTICS_TOKEN="t"):
+                responses.append(self._get("/api/diagnostics/memory/", **{"X-Vitaa-Diagnostics": "t"}))
+        for resp in responses:
+            self.assertLess(resp.status_code, 400, resp.content)
+            self.assertQueryBudget(resp)
+
+        named = {p.name for p in get_resolver().url_patterns if getattr(p, "name", None)}
+        self.assertEqual(named, {r.resolver_match.url_name for r in responses})
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_queries_logged_with_view(self):
+        with self.assertLogs("vitaa_app.db", "WARNING") as logs:
+            self._get("/api/catalog/dishes/")
+        self.assertIn("vitaa_app.views.dish_catalog", logs.output[0])
+
+
+class SamplingProfilerTests(TestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def _plan(self, **headers):
+        body = {"age": 30, "sex": "male", "height_cm": 175, "weight_kg": 78, "activity_frequency": "medium"}
+        return self.client.post("/api/plan/health/", json.dumps(body),
+                                content_type="application/json", headers=headers)
+
+    def test_profiles_only_authorized_requests(self):
+        with override_settings(DIAGNOSTICS_TOKEN="s3cret", PROFILE_DIR=self.tmp.name, PROFILE_INTERVAL_MS=1):
+            self.assertNotIn("X-Profile-Id", self._plan(**{"X-Vitaa-Profile": "wrong"}))
+            resp = self._plan(**{"X-Vitaa-Profile": "s3cret", "X-Request-ID": "req-42"})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["X-Profile-Id"], "req-42")
+        files = sorted(os.listdir(self.tmp.name))
+        self.assertEqual([f.rsplit(".", 1)[1] for f in files], ["folded", "json"])
+        with open(os.path.join(self.tmp.name, files[1])) as f:
+            meta = json.load(f)
+        self.assertEqual(meta["request_id"], "req-42")
+        self.assertEqual(meta["catalog_version"], catalog.catalog_version())
+        with open(os.path.join(self.tmp.name, files[0])) as f:
+            for line in f:
+                stack, count = line.rsplit(" ", 1)
+                self.assertTrue(int(count) > 0 and stack)
+
+
+class PlannerDeadlineTests(TestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+
+    def test_full_search_without_budget(self):
+        plan = generate_meal_plan(plan_goals(2000))
+        self.assertTrue(all(meal["SearchComplete"] for meal in plan))
+
+    @mock.patch("vitaa_app.combo_index.MAIN_CHUNK", 1)  # one main per deadline check
+    def test_expired_deadline_still_returns_a_plan(self):
+        goals = dict(plan_goals(2000), time_budget_ms=1e-6)
+        plan = generate_meal_plan(goals)
+        self.assertEqual(len(plan), 3)
+        for meal in plan:
+            self.assertTrue(meal["Dishes"])
+            self.assertFalse(meal["SearchComplete"])
+
+    @mock.patch("vitaa_app.combo_index.MAIN_CHUNK", 1)
+    @override_settings(PLANNER_TIME_BUDGET_MS=1e-6)
+    def test_global_budget_caps_request_budget(self):
+        plan = generate_meal_plan(dict(plan_goals(2000), time_budget_ms=60_000))
+        self.assertFalse(any(meal["SearchComplete"] for meal in plan))
+
+
+class CandidatePoolCacheTests(TestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+
+    def test_equivalent_diets_share_a_pool(self):
+        generate_meal_plan(plan_goals(2000, allergies=["Peanuts", "milk"]))
+        generate_meal_plan(plan_goals(1800, allergies=["milk ", "peanuts"]))
+        stats = catalog.pools.stats()
+        self.assertEqual((stats["misses"], stats["hits"]), (1, 1))
+
+        generate_meal_plan(plan_goals(2000, diet_preference="vegan"))
+        self.assertEqual(catalog.pools.stats()["misses"], 2)
+
+    def test_exclusions_are_masks_over_a_shared_pool(self):
+        generate_meal_plan(plan_goals(2000))
+        cases = {("pork",): {"Pork Chop"}, ("mushroom",): {"Mushroom Soup"},
+                 ("pork", "garlic"): {"Pork Chop", "Grilled Chicken", "Boiled Greens"}}
+        for dislikes, dropped in cases.items():
+            names = plan_dish_names(generate_meal_plan(plan_goals(2000, dislikes=list(dislikes))))
+            self.assertTrue(names)
+            self.assertFalse(names & dropped)
+        self.assertEqual(catalog.pools.stats()["misses"], 1)
+
+        with self.assertRaisesMessage(ValueError, "No suitable 'main' dishes"):
+            generate_meal_plan(plan_goals(2000, exclude_ingredients=["chicken", "pork", "beef", "salmon",
+                                                                     "tofu", "lentils"]))
+
+    @override_settings(PLANNER_POOL_CACHE_SIZE=1)
+    def test_lru_eviction(self):
+        generate_meal_plan(plan_goals(2000))
+        generate_meal_plan(plan_goals(2000, diet_preference="vegan"))
+        generate_meal_plan(plan_goals(2000))
+        stats = catalog.pools.stats()
+        self.assertEqual((stats["size"], stats["misses"], stats["evictions"]), (1, 3, 2))
+
+
+class ComboIndexTests(SimpleTestCase):
+    def test_matches_brute_force_best_combo(self):
+        from itertools import combinations
+        from vitaa_app.combo_index import ComboIndex
+
+        rng = np.random.default_rng(3)
+        main_mac = np.column_stack([rng.uniform(250, 700, 40), rng.uniform(15, 50, 40),
+                                    rng.uniform(5, 30, 40), rng.uniform(10, 80, 40)])
+        side_mac = np.column_stack([rng.uniform(50, 350, 25), rng.uniform(1, 15, 25),
+                                    rng.uniform(1, 15, 25), rng.uniform(5, 50, 25)])
+        index = ComboIndex(np.arange(40), main_mac, np.arange(100, 125), side_mac)
+        side_ok = np.ones(25, dtype=bool)
+        side_ok[3] = False
+
+        def score(t):
+            return np.abs(t[:, 0] - 700) + 0.25 * t[:, 2] - 0.15 * t[:, 1]
+
+        brute = []
+        allowed = [s for s in range(25) if side_ok[s]]
+        for m in range(40):
+            for sides in [()] + [(s,) for s in allowed] + list(combinations(allowed, 2)):
+                totals = main_mac[m] + side_mac[list(sides)].sum(axis=0)
+                brute.append(score(totals[None])[0])
+
+        scores, m, j, k, complete = index.query(700, score, np.ones(40, dtype=bool), side_ok, want=5)
+        self.assertTrue(complete)
+        np.testing.assert_allclose(scores, sorted(brute)[:5])
+        self.assertNotIn(3, set(j) | set(k))
+
+    def test_all_nearby_sides_excluded_still_finds_a_combo(self):
+        from types import SimpleNamespace
+        from vitaa_app.combo_index import ComboIndex
+        from vitaa_app.meal_planner_service import choose_meal
+
+        side_mac = [[100 + 10 * i, 5, 3, 12] for i in range(20)]
+        index = ComboIndex([1], [[500, 35, 12, 40]], np.arange(100, 120), side_mac)
+        with override_settings(PLANNER_KNOBS={"COMBO_SETS_PER_MAIN": 1, "COMBO_KCAL_WINDOW": 1}):
+            scores, m, j, k, _ = index.query(700, lambda t: np.abs(t[:, 0] - 700), np.ones(1, dtype=bool),
+                                             np.zeros(20, dtype=bool), want=5, window=1, per_main=1)
+            self.assertEqual((len(scores), j[0], k[0]), (1, 20, 20))  # the main alone
+
+            ids, totals, _ = choose_meal(SimpleNamespace(combos=index), 700, False, set(),
+                                         side_ok=np.zeros(20, dtype=bool), rng=np.random.default_rng(0))
+            self.assertEqual((ids, totals["calories"]), ([1], 500.0))
+
+            # Nothing qualifies among unused dishes: used ones are allowed again, not an error.
+            empty = (np.empty(0), np.empty(0, int), np.empty(0, int), np.empty(0, int), True)
+            with mock.patch.object(index, "query", side_effect=[empty, index.query(
+                    700, lambda t: np.abs(t[:, 0] - 700), np.ones(1, dtype=bool), np.ones(20, dtype=bool), want=1)]):
+                ids, _, _ = choose_meal(SimpleNamespace(combos=index), 700, False, {100},
+                                        rng=np.random.default_rng(0))
+            self.assertEqual(ids[0], 1)
+
+
+class ConcurrentPlannerTests(TransactionTestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+        for i in range(12):  # a wider pool so seeds actually pick differently
+            make_dish(f"Side Salad {i}", kcal=80 + 15 * i, protein=3 + i % 4, fat=2, carbs=10,
+                      veg_class="vegan", ingredients="lettuce, cucumber")
+        catalog.reset()
+
+    def test_seeded_plans_identical_under_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from django.db import connection
+
+        diets = [{}, {"diet_preference": "vegan"}, {"allergies": ["peanuts"]}]
+        jobs = [dict(plan_goals(1600 + 50 * (n % 7), **diets[n % 3]), seed=n) for n in range(48)]
+        expected = [generate_meal_plan(g) for g in jobs]
+        catalog.reset()  # threads race to build the snapshot, pools and combo indexes too
+
+        def run(goals):
+            try:
+                return generate_meal_plan(goals)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            got = list(pool.map(run, jobs))
+        self.assertEqual(got, expected)
+        self.assertGreater(len({json.dumps(p) for p in got}), 3)
+
+
+class IncrementalSnapshotTests(TestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+        catalog.reset()
+
+    def test_patched_members_match_full_reload(self):
+        snap = catalog.get_snapshot()
+        snap.frame, snap.dishes
+        self.assertEqual(catalog.build_counts, {"full": 2, "incremental": 0, "reused": 0})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            chicken = Dish.objects.get(dish_name="Grilled Chicken")
+            chicken.calories_kcal = 480
+            chicken.save()
+            Dish.objects.get(dish_name="Pork Chop").delete()
+            make_dish("Lamb Curry", kcal=600, protein=35, allergens=["milk"])
+            AllergenDish.objects.create(dish=Dish.objects.get(dish_name="Salmon Bowl"),
+                                        allergen=Allergen.objects.get(allergen_name="milk"))
+
+        patched = catalog.get_snapshot()
+        self.assertGreater(patched.version, snap.version)
+        frame, dishes = patched.frame, patched.dishes
+        self.assertEqual(catalog.build_counts["incremental"], 2)
+
+        catalog.reset()
+        full = catalog.get_snapshot()
+        self.assertEqual(dishes, full.dishes)
+        self.assertTrue(frame.equals(full.frame))
+        self.assertIn("milk", full.dishes_by_id[Dish.objects.get(dish_name="Salmon Bowl").pk]["allergens"])
+
+    def test_edits_carry_indexes_and_pools_forward(self):
+        snap = catalog.get_snapshot()
+        name_index, ingredient_index, macro_index = snap.name_index, snap.ingredient_index, snap.macro_index
+        vegan = _candidate_pools({"diet_preference": "vegan"}, snap.version)
+        vegan.combos
+        _candidate_pools({"diet_preference": "any"}, snap.version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            chicken = Dish.objects.get(dish_name="Grilled Chicken")
+            chicken.calories_kcal = 480
+            chicken.save()
+        snap = catalog.get_snapshot()
+        self.assertIs(snap.name_index, name_index)
+        self.assertIs(snap.ingredient_index, ingredient_index)
+        self.assertIsNot(snap.macro_index, macro_index)
+        self.assertIs(_candidate_pools({"diet_preference": "vegan"}, snap.version), vegan)  # not a vegan dish
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Dish.objects.filter(dish_name="Pork Chop").get().delete()
+            beef = Dish.objects.get(dish_name="Beef Stir Fry")
+            beef.dish_name = "Tofu Curry"  # now shadows the real (later) Tofu Curry
+            beef.save()
+        snap = catalog.get_snapshot()
+        self.assertIsNot(snap.name_index, name_index)
+        patched = _candidate_pools({"diet_preference": "any"}, snap.version)
+        self.assertIs(_candidate_pools({"diet_preference": "vegan"}, snap.version), vegan)
+
+        catalog.pools.clear()
+        full = _candidate_pools({"diet_preference": "any"}, snap.version)
+        self.assertTrue(patched.frame.equals(full.frame))
+        self.assertEqual(list(patched.mains["dish_id"]), list(full.mains["dish_id"]))
+        self.assertEqual(list(patched.sides["dish_id"]), list(full.sides["dish_id"]))
+
+    @override_settings(CATALOG_INCREMENTAL_MAX_CHANGES=1)
+    def test_large_change_sets_reload(self):
+        catalog.get_snapshot().frame
+        with self.captureOnCommitCallbacks(execute=True):
+            make_dish("Lamb Curry", kcal=600)
+            make_dish("Duck Rice", kcal=650)
+        catalog.get_snapshot().frame
+        self.assertEqual(catalog.build_counts, {"full": 2, "incremental": 0, "reused": 0})
+
+
+class PlannerFlagsTests(TestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+
+    def test_flags_derived_on_save(self):
+        chicken = Dish.objects.get(dish_name="Grilled Chicken")
+        self.assertEqual((chicken.is_main, chicken.is_side, chicken.is_banned), (True, False, False))
+        self.assertAlmostEqual(chicken.protein_density, 40 / 450 * 100, places=2)
+        cola = make_dish("Cola Float", kcal=200, protein=0, fat=0, carbs=50)
+        self.assertTrue(cola.is_banned)
+        self.assertFalse(cola.is_main or cola.is_side)
+
+    def test_allergen_mask_follows_links(self):
+        dish = make_dish("Peanut Noodles", kcal=500, protein=20, allergens=["peanuts", "wheat"])
+        ids = Allergen.objects.filter(allergen_name__in=["peanuts", "wheat"]).values_list("pk", flat=True)
+        self.assertEqual(Dish.objects.get(pk=dish.pk).allergen_mask, allergen_mask(ids))
+        AllergenDish.objects.filter(dish=dish, allergen__allergen_name="peanuts").delete()
+        self.assertEqual(Dish.objects.get(pk=dish.pk).allergen_mask,
+                         allergen_mask([Allergen.objects.get(allergen_name="wheat").pk]))
+
+    def test_pool_loads_only_eligible_rows(self):
+        make_dish("Satay Chicken", kcal=500, protein=35, allergens=["peanuts"])
+        make_dish("Iced Tea", kcal=150, protein=0, fat=0, carbs=35)
+        pool = _candidate_pools({"diet_preference": "any", "allergies": ["nut"]}, catalog.catalog_version())
+        names = set(pool.frame["dish_name"])
+        self.assertNotIn("Satay Chicken", names)
+        self.assertNotIn("Iced Tea", names)
+        self.assertIn("Grilled Chicken", names)
+
+        pool = _candidate_pools({"diet_preference": "vegan"}, catalog.catalog_version())
+        self.assertEqual(set(pool.frame["dish_name"]),
+                         {"Tofu Curry", "Lentil Stew", "Garden Salad", "Boiled Greens"})
+
+    def test_allergens_sharing_the_overflow_bit_are_checked_exactly(self):
+        for pk, name in ((70, "lupin"), (71, "mustard")):
+            Allergen.objects.create(allergen_id=pk, allergen_name=name)
+        make_dish("Lupin Burger", kcal=500, protein=30, allergens=["lupin"])
+        version = catalog.catalog_version()
+        mustard = _candidate_pools({"diet_preference": "any", "allergies": ["mustard"]}, version)
+        lupin = _candidate_pools({"diet_preference": "any", "allergies": ["lupin"]}, version)
+        self.assertIn("Lupin Burger", set(mustard.frame["dish_name"]))
+        self.assertNotIn("Lupin Burger", set(lupin.frame["dish_name"]))
+
+    def test_refresh_command_repairs_flags_and_bumps_version(self):
+        Dish.objects.filter(dish_name="Grilled Chicken").update(is_main=False, allergen_mask=1)
+        before = catalog.catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("refresh_dish_flags", stdout=open(os.devnull, "w"))
+        chicken = Dish.objects.get(dish_name="Grilled Chicken")
+        self.assertEqual((chicken.is_main, chicken.allergen_mask), (True, 0))
+        self.assertGreater(catalog.catalog_version(), before)
+
+
+@override_settings(DIAGNOSTICS_TOKEN="s3cret")
+class MemoryAccountingTests(TestCase):
+    def setUp(self):
+        catalog.reset()
+        memory.reset()
+        seed_planner_catalog()
+        self.addCleanup(memory.reset)
+
+    def _plan(self, **headers):
+        return self.client.post("/api/mealplan/", json.dumps(plan_goals(2000)),
+                                content_type="application/json", headers=headers)
+
+    def test_traces_only_authorized_requests_by_stage(self):
+        self.assertNotIn("X-Memory-Peak", self._plan(**{"X-Vitaa-Memory": "wrong"}))
+        resp = self._plan(**{"X-Vitaa-Memory": "s3cret", "X-Request-ID": "mem-1"})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreater(int(resp["X-Memory-Peak"]), 0)
+        [entry] = memory.recent()
+        self.assertEqual((entry["request_id"], entry["view"]), ("mem-1", "meal_plan"))
+        stages = [s["stage"] for s in entry["stages"]]
+        self.assertEqual(stages, ["pool"] + ["search", "assemble"] * 3 + ["response"])
+        self.assertGreaterEqual(entry["peak_bytes"], max(s["peak_bytes"] for s in entry["stages"]))
+        self.assertTrue(any(s["top_sites"] for s in entry["stages"]))
+        self.assertFalse(tracemalloc.is_tracing())  # stopped with the traced request
+
+    def test_concurrent_traced_requests_are_serialized(self):
+        inside, overlap = [0], []
+        real_start = memory.RequestMemory.start
+
+        def start(tracker):
+            inside[0] += 1
+            overlap.append(inside[0])
+            time.sleep(0.05)
+            real_start(tracker)
+
+        def run():
+            with memory.track_request():
+                inside[0] -= 1
+
+        with mock.patch.object(memory.RequestMemory, "start", start):
+            threads = [threading.Thread(target=run) for _ in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(5)
+        self.assertEqual(overlap, [1, 1, 1])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_diagnostics_endpoint(self):
+        self.assertEqual(self.client.get("/api/diagnostics/memory/").status_code, 403)
+        with override_settings(DIAGNOSTICS_TOKEN=""):
+            self.assertEqual(self.client.get("/api/diagnostics/memory/").status_code, 404)
+
+        generate_meal_plan(plan_goals(2000))
+        headers = {"X-Vitaa-Diagnostics": "s3cret"}
+        body = self.client.get("/api/diagnostics/memory/?diff=1", headers=headers).json()
+        self.assertFalse(body["tracemalloc"]["tracing"])  # a diagnostics read does not start tracing
+        self.assertIsNone(body["last_snapshot_diff"])
+
+        memory.acquire_tracing()  # what the periodic diff thread holds
+        self.addCleanup(memory.release_tracing)
+        self.client.get("/api/diagnostics/memory/?diff=1", headers=headers)  # baseline
+        body = self.client.get("/api/diagnostics/memory/?diff=1", headers=headers).json()
+
+        self.assertEqual(body["caches"]["planner_pools"]["size"], 1)
+        self.assertGreater(body["caches"]["planner_pools"]["bytes"], 0)
+        self.assertIsNotNone(body["last_snapshot_diff"])
+        self.assertTrue(body["tracemalloc"]["tracing"])
+        if body["rss_bytes"] is not None:
+            self.assertGreater(body["rss_bytes"], 0)
+
+
+class PlannerKnobsTests(TestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+
+    def test_settings_override_knobs(self):
+        with override_settings(PLANNER_KNOBS={"MAX_ITEMS_PER_MEAL": 1}):
+            plan = generate_meal_plan(plan_goals(2000))
+        self.assertEqual([len(m["Dishes"]) for m in plan], [1, 1, 1])
+        self.assertEqual(knobs()["RANDOM_TOPK"], 5)
+
+        with override_settings(PLANNER_KNOBS={"NO_SUCH_KNOB": 1}):
+            with self.assertRaises(ImproperlyConfigured):
+                knobs()
+
+    def test_knob_types_are_checked_at_start(self):
+        from vitaa_app.apps import check_planner_knobs
+
+        for bad in ({"RANDOM_TOPK": "5"}, {"RANDOM_TOPK": 2.5}, {"PROTEIN_BONUS": True},
+                    {"MEAL_SPLIT": {"Lunch": "all"}}):
+            with override_settings(PLANNER_KNOBS=bad):
+                self.assertEqual([e.id for e in check_planner_knobs()], ["vitaa_app.E001"], bad)
+        with override_settings(PLANNER_KNOBS={"PROTEIN_BONUS": 1, "COMBO_KCAL_WINDOW": 40}):
+            self.assertEqual(check_planner_knobs(), [])  # ints are fine for float knobs
+
+
+class PlannerSweepTests(TransactionTestCase):
+    def setUp(self):
+        catalog.reset()
+        seed_planner_catalog()
+
+    def test_sweep_reports_grid_and_leaves_flags_alone(self):
+        from vitaa_app.management.commands.sweep_planner import pareto_front
+
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "sweep.json")
+            call_command("sweep_planner", "--knob", "RANDOM_TOPK=1,5", "--knob", "MAIN_MIN_KCAL=250,500",
+                         "--count", "6", "--repeat", "1", "--json", out, stdout=open(os.devnull, "w"))
+            with open(out) as f:
+                results = json.load(f)["results"]
+
+        self.assertEqual([r["knobs"] for r in results], [
+            {"RANDOM_TOPK": 1, "MAIN_MIN_KCAL": 250}, {"RANDOM_TOPK": 1, "MAIN_MIN_KCAL": 500},
+            {"RANDOM_TOPK": 5, "MAIN_MIN_KCAL": 250}, {"RANDOM_TOPK": 5, "MAIN_MIN_KCAL": 500},
+        ])
+        self.assertTrue(any(r["pareto"] for r in results))
+        self.assertTrue(all(r["p95_ms"] > 0 for r in results))
+        self.assertEqual(results[0]["failures"], 0)  # the copy holds the catalog
+        # Flags recomputed for MAIN_MIN_KCAL=500 stayed in the scratch copy.
+        self.assertTrue(Dish.objects.get(dish_name="Grilled Chicken").is_main)
+        self.assertEqual(catalog.pools.stats()["size"], 0)
+
+        with self.assertRaises(CommandError):
+            call_command("sweep_planner", "--knob", 'RANDOM_TOPK="3"', stdout=open(os.devnull, "w"))
+
+        rows = [{"failures": 0, "kcal_dev_pct": 5, "macro_dev_pct": 9, "variety": 0.5, "p95_ms": 3, "cpu_ms": 2},
+                {"failures": 0, "kcal_dev_pct": 6, "macro_dev_pct": 9, "variety": 0.5, "p95_ms": 3, "cpu_ms": 2},
+                {"failures": 0, "kcal_dev_pct": 6, "macro_dev_pct": 9, "variety": 0.5, "p95_ms": 1, "cpu_ms": 1}]
+        self.assertEqual(pareto_front(rows), [0, 2])
+
+
+@override_settings(N8N_BATCH_ENABLED=True, N8N_BATCH_WINDOW_MS=2000, N8N_BATCH_MAX_SIZE=4)
+class N8nBatchingTests(SimpleTestCase):
+    def setUp(self):
+        health_analysis._batch_rejected_until[0] = 0.0
+        self.addCleanup(health_analysis._batch_rejected_until.__setitem__, 0, 0.0)
+        patcher = mock.patch("vitaa_app.health_analysis._breaker", CircuitBreaker("n8n"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def analyse_concurrently(self, ages):
+        results = {}
+
+        def run(age):
+            results[age] = health_analysis.n8n_health_analysis({**HEALTH_PROFILE, "Age": age})
+
+        threads = [threading.Thread(target=run, args=(age,)) for age in ages]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        return results
+
+    def test_concurrent_payloads_share_one_call(self):
+        def post(url, json=None, timeout=None):
+            return _fake_n8n_response(body={"results": [{"age": p["age"]} for p in json["batch"]]})
+
+        with mock.patch("vitaa_app.health_analysis.requests.post", side_effect=post) as fake:
+            results = self.analyse_concurrently([31, 32, 33, 34])
+
+        self.assertEqual(fake.call_count, 1)
+        self.assertEqual(results, {age: {"age": age} for age in (31, 32, 33, 34)})
+
+    def _submit_concurrently(self, batcher, items, single, window_s, max_size):
+        results = {}
+
+        def run(item):
+            results[item] = batcher.submit(item, single, window_s=window_s, max_size=max_size)
+
+        threads = [threading.Thread(target=run, args=(item,)) for item in items]
+        for t in threads:
+            t.start()
+            time.sleep(0.01)  # join in order: the first item leads
+        for t in threads:
+            t.join(10)
+        return results
+
+    def test_full_batch_flushes_before_the_window_ends(self):
+        from vitaa_app.batching import MicroBatcher
+
+        sent = []
+        batcher = MicroBatcher(lambda items: sent.append(list(items)) or [i * 10 for i in items])
+        started = time.monotonic()
+        results = self._submit_concurrently(batcher, [1, 2, 3], single=None, window_s=5.0, max_size=3)
+        self.assertLess(time.monotonic() - started, 2.0)
+        self.assertEqual((sent, results), ([[1, 2, 3]], {1: 10, 2: 20, 3: 30}))
+
+    def test_followers_wait_for_a_slow_batch_instead_of_calling_again(self):
+        from vitaa_app.batching import MicroBatcher
+
+        def slow_send(items):
+            time.sleep(0.3)  # much longer than the window
+            return [i * 10 for i in items]
+
+        single = mock.Mock(side_effect=lambda i: -i)
+        results = self._submit_concurrently(MicroBatcher(slow_send), [1, 2], single, window_s=0.05, max_size=5)
+        single.assert_not_called()
+        self.assertEqual(results, {1: 10, 2: 20})
+
+    def test_rejected_batch_falls_back_to_single_calls(self):
+        def post(url, json=None, timeout=None):
+            if "batch" in json:
+                return _fake_n8n_response(status=400, body={"error": "unknown field"})
+            return _fake_n8n_response(body={"age": json["age"]})
+
+        with mock.patch("vitaa_app.health_analysis.requests.post", side_effect=post) as fake:
+            results = self.analyse_concurrently([41, 42, 43, 44])
+            self.assertEqual(results, {age: {"age": age} for age in (41, 42, 43, 44)})
+            self.assertEqual(fake.call_count, 1 + 4)
+
+            # Batching pauses after a rejection: the next payload goes out alone, at once.
+            self.assertEqual(health_analysis.n8n_health_analysis(HEALTH_PROFILE), {"age": 40})
+            self.assertEqual(fake.call_count, 6)
@@ -1,17 +1,54 @@
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.urls import reverse
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
 from django.views.decorators.csrf import csrf_exempt
+import hmac
 import json
 from requests import RequestException, HTTPError
 
 from vitaa_app.utils import calc_targets
-from vitaa_app.meal_planner_service import generate_meal_plan
-from vitaa_app.health_analysis import n8n_health_analysis
+from vitaa_app.meal_planner_service import generate_meal_plan, suggest_swaps
+from vitaa_app.health_analysis import local_health_summary, n8n_health_analysis
+from vitaa_app.resilience import BulkheadFullError, CircuitOpenError, retry_after_header
+from vitaa_app.single_flight import coalesce
+from vitaa_app import catalog
+from vitaa_app import dish_search
+from vitaa_app import jobs
+from vitaa_app import memory
+from vitaa_app import profiles
+from vitaa_app import warmup
+
+def _upstream_unavailable(data, e):
+    """n8n is being shed: fast 503 + Retry-After, or local metrics if N8N_FALLBACK_MODE == "local"."""
+    if getattr(settings, "N8N_FALLBACK_MODE", "503") == "local":
+        try:
+            summary = local_health_summary(data)
+        except Exception as ve:
+            return JsonResponse({"error": str(ve)}, status=400)
+        return JsonResponse({"forwarded": False, "fallback": True, "reason": str(e), "local_analysis": summary},
+                            status=200)
+    response = JsonResponse({"error": "Health analysis temporarily unavailable", "details": str(e)}, status=503)
+    response["Retry-After"] = retry_after_header(e)
+    return response
+
+def _submit_analysis_job(request, data):
+    try:
+        job = jobs.submit_analysis(data)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    status_url = request.build_absolute_uri(reverse("n8n_health_analysis_job", args=[job.pk]))
+    response = JsonResponse({**jobs.job_status(job), "status_url": status_url}, status=202)
+    response["Location"] = status_url
+    return response
 
 @csrf_exempt
 def n8n_health_analysis_view(request):
     """
     Proxy endpoint: accepts user profile JSON and forwards it to n8n after normalization.
+    With ?mode=async (or "Prefer: respond-async") it returns 202 and a job id
+    immediately; poll the status_url for the result.
     """
     if request.method != "POST":
         return JsonResponse({"error": "POST required"}, status=405)
@@ -21,9 +58,14 @@ def n8n_health_analysis_view(request):
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON body"}, status=400)
 
+    if request.GET.get("mode") == "async" or "respond-async" in request.headers.get("Prefer", ""):
+        return _submit_analysis_job(request, data)
+
     try:
         result = n8n_health_analysis(data)
         return JsonResponse({"forwarded": True, "webhook_response": result}, status=200)
+    except (CircuitOpenError, BulkheadFullError) as e:
+        return _upstream_unavailable(data, e)
     except HTTPError as e:
         return JsonResponse(
             {"error": "Webhook returned error", "details": str(e), "body": getattr(e.response, "text", "")},
@@ -34,14 +76,32 @@ def n8n_health_analysis_view(request):
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=400)
 
+def n8n_health_analysis_job(request, job_id):
+    """
+    Status of an async health analysis: GET, optional ?wait=<seconds> (max 30)
+    to long-poll until the job finishes.
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "GET required"}, status=405)
+    try:
+        wait_s = float(request.GET.get("wait") or 0)
+    except ValueError:
+        return JsonResponse({"error": "wait must be a number of seconds"}, status=400)
+
+    job = jobs.wait_for_job(job_id, wait_s)
+    if job is None:
+        return JsonResponse({"error": "job not found"}, status=404)
+    return JsonResponse(jobs.job_status(job), status=200)
+
 @csrf_exempt
 def meal_plan_view(request):
     if request.method != "POST":
         return JsonResponse({"error": "POST required"}, status=405)
     try:
         goals = json.loads(request.body.decode("utf-8"))
-        plan = generate_meal_plan(goals)
-        return JsonResponse({"plan": plan}, status=200, safe=False)
+        plan = coalesce("plan", generate_meal_plan, goals)
+        with memory.stage("response"):
+            return JsonResponse({"plan": plan}, status=200, safe=False)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=400)
 
@@ -50,24 +110,12 @@ def nutrition_targets(request):
     if request.method == "POST":
         try:
             payload = json.loads(request.body.decode("utf-8"))
-            result = calc_targets(payload)
+            result = coalesce("targets", calc_targets, payload)
             return JsonResponse(result, safe=False, status=200)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=400)
     return JsonResponse({"error": "POST required"}, status=405)
 
-# map activity_frequency -> utils.calc_targets activity_level
-_ACTIVITY_MAP = {
-    "sedentary": "sedentary",
-    "low": "lightly_active",
-    "medium": "moderately_active",
-    "high": "very_active",
-    "very_high": "extra_active",
-}
-
-def _norm(s):
-    return str(s or "").strip()
-
 @csrf_exempt
 def health_plan_meal(request):
     """
@@ -78,7 +126,10 @@ def health_plan_meal(request):
       "allergies": ["Peanuts","Shellfish"],
       "diet_preference": "Vegetarian",
       "include_eggs": true,
-      "fitness_goal": "Weight Loss"
+      "fitness_goal": "Weight Loss",
+      "exclude_ingredients": ["pork"], "dislikes": ["mushroom"],   (optional)
+      "user_id": "abc123",  (optional: vary dishes across this user's requests)
+      "time_budget_ms": 50  (optional: planner search deadline)
     }
     """
     if request.method != "POST":
@@ -88,52 +139,19 @@ def health_plan_meal(request):
         body = json.loads(request.body.decode("utf-8"))
 
         # --- Nutrition targets ---
-        activity_freq = _norm(body.get("activity_frequency")).lower()
-        activity_level = _ACTIVITY_MAP.get(activity_freq)
-        if not activity_level:
-            raise ValueError("activity_frequency must be one of: " + ", ".join(_ACTIVITY_MAP.keys()))
-
-        profile = {
-            "age": int(body["age"]),
-            "sex": _norm(body["sex"]).lower(),
-            "height_cm": float(body["height_cm"]),
-            "weight_kg": float(body["weight_kg"]),
-            "activity_level": activity_level,
-        }
-
-        targets_result = calc_targets(profile)
+        profile = profiles.targets_profile(body)
+        targets_result = coalesce("targets", calc_targets, profile)
         calories_kcal = float(targets_result["targets"]["calories_kcal"])
 
         # --- Meal planner goals ---
-        diet_pref = _norm(body.get("diet_preference")).lower()
-        if diet_pref in {"veg", "vegetarian"}:
-            diet_pref = "vegetarian"
-        elif diet_pref in {"vegan"}:
-            diet_pref = "vegan"
-        elif diet_pref in {"non-veg", "non vegetarian", "non_vegetarian"}:
-            diet_pref = "non-veg"
-        elif not diet_pref:
-            diet_pref = "any"
-
-        allergies = [str(a).strip().lower() for a in body.get("allergies", [])]
-
-        goals = {
-            "energy": {"target_kcal": calories_kcal},
-            "inputs": {
-                "fitness_goal": _norm(body.get("fitness_goal")).lower() or "maintenance",
-                "diet": {
-                    "diet_preference": diet_pref,
-                    "include_eggs": bool(body.get("include_eggs", True)),
-                    "allergies": allergies,
-                },
-            },
-        }
+        goals = profiles.planner_goals(body, calories_kcal)
 
         # --- Generate meal plan ---
-        plan = generate_meal_plan(goals)
+        plan = coalesce("plan", generate_meal_plan, goals)
 
         targets_only = targets_result.get("targets", {})
-        return JsonResponse({"targets": targets_only, "plan": plan}, status=200, safe=False)
+        with memory.stage("response"):
+            return JsonResponse({"targets": targets_only, "plan": plan}, status=200, safe=False)
 
     except KeyError as ke:
         return JsonResponse({"error": f"missing field: {ke.args[0]}"}, status=400)
@@ -141,3 +159,162 @@ def health_plan_meal(request):
         return JsonResponse({"error": str(ve)}, status=400)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=400)
+
+
+@csrf_exempt
+def swap_dish(request):
+    """
+    Nearest-macro replacements for one dish of a plan. Expects:
+    {
+      "dish_name": "Grilled Chicken", "k": 5,
+      "exclude": ["names", "already", "in", "the", "plan"],   (optional)
+      "diet_preference": "Vegetarian", "include_eggs": true,
+      "allergies": ["Peanuts"], "exclude_ingredients": [], "dislikes": []
+    }
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+
+    try:
+        body = json.loads(request.body.decode("utf-8"))
+        k = max(1, min(int(body.get("k", 5)), 50))
+        result = suggest_swaps(
+            profiles.norm(body["dish_name"]),
+            profiles.diet_from_body(body),
+            k=k,
+            exclude_names=[str(n) for n in body.get("exclude", [])],
+        )
+        return JsonResponse(result, status=200)
+    except KeyError as ke:
+        return JsonResponse({"error": f"missing field: {ke.args[0]}"}, status=400)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+def dish_catalog(request):
+    """
+    Read-only dish catalog.
+      GET /api/catalog/dishes/            -> {"version", "dishes": [...]}
+      GET /api/catalog/dishes/?since=<v>  -> {"version", "since", "upserts": [...], "deleted": [ids]}
+    Every response carries a strong ETag for the catalog version; a matching
+    If-None-Match is answered with 304 without touching the database.
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "GET required"}, status=405)
+
+    since = request.GET.get("since")
+    try:
+        since = int(since) if since not in (None, "") else None
+    except ValueError:
+        return JsonResponse({"error": "since must be an integer version"}, status=400)
+
+    snap = catalog.get_snapshot()
+    if since is None:
+        etag = f'"catalog-v{snap.version}"'
+    else:
+        etag = f'"catalog-v{snap.version}-since{since}"'
+
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified["ETag"] = etag
+        return not_modified
+
+    if since is None:
+        response = HttpResponse(snap.body, content_type="application/json")
+    else:
+        response = JsonResponse(catalog.delta_since(snap, since))
+    response["ETag"] = etag
+    # Clients may keep the copy but must revalidate; revalidation is a cheap 304.
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def _float_param(request, name):
+    raw = request.GET.get(name)
+    if raw in (None, ""):
+        return None
+    try:
+        return float(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+
+
+def _list_param(request, name):
+    values = []
+    for raw in request.GET.getlist(name):
+        values.extend(s.strip().lower() for s in raw.split(",") if s.strip())
+    return values
+
+
+def dish_catalog_search(request):
+    """
+    Browse/search dishes.
+      GET /api/catalog/dishes/search/?q=&veg_class=&min_kcal=&max_kcal=
+          &min_protein=&max_protein=&exclude_allergens=a,b&cursor=&limit=
+    `q` is a name prefix matched against all localized names (word starts,
+    accent-insensitive) in the cached catalog snapshot. `exclude_allergens`
+    matches allergen names by substring, as plan allergies do. The filters
+    and the returned rows both come from the database, so a page is never
+    cut short by a lagging snapshot. Pages are keyed by dish_id: pass back
+    `next_cursor` as `cursor` to continue.
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "GET required"}, status=405)
+
+    try:
+        filters = {
+            "veg_classes": _list_param(request, "veg_class"),
+            "min_kcal": _float_param(request, "min_kcal"),
+            "max_kcal": _float_param(request, "max_kcal"),
+            "min_protein": _float_param(request, "min_protein"),
+            "max_protein": _float_param(request, "max_protein"),
+            "exclude_allergens": _list_param(request, "exclude_allergens"),
+        }
+        after = int(request.GET.get("cursor") or 0)
+        limit = int(request.GET.get("limit") or dish_search.DEFAULT_PAGE_SIZE)
+    except ValueError as ve:
+        return JsonResponse({"error": str(ve)}, status=400)
+    limit = max(1, min(limit, dish_search.MAX_PAGE_SIZE))
+
+    snap = catalog.get_snapshot()
+    q = (request.GET.get("q") or "").strip()
+    name_ids = snap.name_index.match(q) if q else None
+
+    ids, next_cursor = dish_search.search_dish_ids(name_ids=name_ids, after=after, limit=limit, **filters)
+    return JsonResponse({
+        "version": snap.version,
+        "results": catalog.dish_rows(ids) if ids else [],
+        "next_cursor": next_cursor,
+    })
+
+
+def readiness(request):
+    """Load balancer readiness probe: 200 once this worker has finished warm-up, 503 before."""
+    state = warmup.status()
+    body = {"status": state["status"]}
+    if state.get("duration_ms") is not None:
+        body["warmup_ms"] = state["duration_ms"]
+    if state.get("error"):
+        body["error"] = state["error"]
+    return JsonResponse(body, status=200 if state["status"] == "ready" else 503)
+
+
+def memory_diagnostics(request):
+    """
+    Worker memory report (RSS, tracemalloc totals, catalog/planner cache sizes,
+    recently traced requests, last snapshot diff). Requires the
+    X-Vitaa-Diagnostics header to match DIAGNOSTICS_TOKEN; 404 when no token
+    is configured. ?diff=1 takes a snapshot diff against the previous one
+    first (while tracemalloc runs, see MEMORY_SNAPSHOT_INTERVAL_S).
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "GET required"}, status=405)
+    token = getattr(settings, "DIAGNOSTICS_TOKEN", "")
+    if not token:
+        return JsonResponse({"error": "not found"}, status=404)
+    sent = request.headers.get("X-Vitaa-Diagnostics", "")
+    if not (sent and hmac.compare_digest(sent, token)):
+        return JsonResponse({"error": "forbidden"}, status=403)
+    if request.GET.get("diff") == "1":
+        memory.snapshot_diff()
+    return JsonResponse(memory.report(), status=200)
@@ -0,0 +1,104 @@
+# vitaa_app/warmup.py
+import logging
+import os
+import threading
+import time
+from typing import Dict
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Retry a failed warm-up at most this often (driven by readiness probes).
+RETRY_AFTER_S = 10.0
+
+_lock = threading.Lock()
+_state: Dict = {"status": "pending", "error": None, "duration_ms": None, "finished_at": 0.0}
+
+_DUMMY_GOALS = [
+    {"energy": {"target_kcal": 2000}, "inputs": {"fitness_goal": "maintenance",
+                                                 "diet": {"diet_preference": "any"}}},
+    {"energy": {"target_kcal": 1600}, "inputs": {"fitness_goal": "weight loss",
+                                                 "diet": {"diet_preference": "vegetarian"}}},
+]
+
+
+def _reset_after_fork():
+    # A fork keeps the state but not the warm-up thread: a child forked while
+    # it ran must run its own. Finished warm-ups carry over with the caches.
+    global _lock
+    _lock = threading.Lock()
+    if _state["status"] == "running":
+        _state.update(status="pending", error=None)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def enabled() -> bool:
+    return getattr(settings, "VITAA_WARMUP_ENABLED", False)
+
+
+def warm_up():
+    """
+    Build the catalog API structures and run a couple of throwaway plans
+    (which build their own candidate pools from the database) so the first
+    real request pays no load/import/first-call costs. The full planner
+    frame is left to the swap endpoint, the only thing still reading it.
+    """
+    from vitaa_app import catalog
+    from vitaa_app.meal_planner_service import generate_meal_plan
+
+    snap = catalog.get_snapshot()
+    snap.name_index
+    snap.ingredient_index
+    snap.body
+    if not snap.dishes:
+        return  # nothing to plan with yet; still ready to serve
+    for goals in _DUMMY_GOALS:
+        try:
+            generate_meal_plan(goals)
+        except ValueError:
+            pass  # e.g. no vegetarian mains in this catalog
+
+
+def _run():
+    started = time.perf_counter()
+    close_old_connections()
+    try:
+        warm_up()
+    except Exception as e:
+        logger.exception("warm-up failed")
+        with _lock:
+            _state.update(status="failed", error=str(e), finished_at=time.monotonic())
+    else:
+        with _lock:
+            _state.update(status="ready", error=None, finished_at=time.monotonic(),
+                          duration_ms=round((time.perf_counter() - started) * 1000, 1))
+        logger.info("warm-up finished in %.0f ms", _state["duration_ms"])
+    finally:
+        close_old_connections()
+
+
+def start():
+    """Start warm-up in a background thread (no-op if already running or done)."""
+    with _lock:
+        if _state["status"] in ("running", "ready"):
+            return
+        _state.update(status="running", error=None)
+    threading.Thread(target=_run, name="vitaa-warmup", daemon=True).start()
+
+
+def status() -> Dict:
+    """Readiness snapshot; retries a failed warm-up after RETRY_AFTER_S."""
+    if not enabled():
+        return {"status": "ready", "warmup": "disabled"}
+    with _lock:
+        retry = _state["status"] == "failed" and time.monotonic() - _state["finished_at"] >= RETRY_AFTER_S
+        pending = _state["status"] == "pending"
+    if retry or pending:
+        start()
+    with _lock:
+        return dict(_state)